@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from .models import ChatHistory, Thread
+from .models import ChatHistory, Company, DailyActivity, Thread
 
 # Register your models here.
 admin.site.register(ChatHistory)
 admin.site.register(Thread)
+admin.site.register(Company)
+admin.site.register(DailyActivity)
@@ -0,0 +1,263 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from rag_sample_django.config import get_config
+
+# 応答側で消費されるトークン数の見込み（実際の使用量で後から精算する）
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+class AdmissionRejected(Exception):
+    """
+    OpenAIの呼び出し枠が空くまでの待ち時間が上限を超えた
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"OpenAI capacity exhausted, retry after {self.retry_after}s")
+
+
+def estimate_tokens(messages, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    """
+    メッセージのトークン数を概算する（ASCIIは4文字で1トークン、それ以外は1文字1トークン）
+    """
+    tokens = completion_tokens
+    for message in messages:
+        content = message.get("content") or ""
+        ascii_chars = sum(1 for char in content if ord(char) < 128)
+        tokens += 4 + math.ceil(ascii_chars / 4) + (len(content) - ascii_chars)
+    return tokens
+
+
+def usage_tokens(response):
+    """
+    レスポンスの実際の使用トークン数（取得できない場合はNone）
+    """
+    total = getattr(getattr(response, "usage", None), "total_tokens", None)
+    return total if isinstance(total, int) else None
+
+
+class TokenBucket:
+    def __init__(self, capacity, now):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60  # 1分あたりの上限を1秒あたりの補充量に換算
+        self.level = self.capacity
+        self.updated_at = now
+
+    def refill(self, now):
+        elapsed = max(0.0, now - self.updated_at)
+        self.level = min(self.capacity, self.level + elapsed * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount):
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def resize(self, capacity):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60
+        self.level = min(self.level, self.capacity)
+
+
+class _Ticket:
+    def __init__(self, user_key, tokens):
+        self.user_key = user_key
+        self.tokens = tokens
+
+
+class DeploymentLimiter:
+    """
+    デプロイメントごとのTPM/RPMをトークンバケットで管理し、
+    ユーザーごとのラウンドロビンで呼び出しを順番待ちさせる。
+    バケットはプロセスごとなので、同じデプロイメントを使うprocessesのプロセスで上限を等分する
+    """
+
+    def __init__(
+        self,
+        name,
+        tokens_per_minute,
+        requests_per_minute,
+        max_wait,
+        processes=1,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.max_wait = max_wait
+        self.processes = max(1, processes)
+        self._clock = clock
+        now = clock()
+        self.tokens = TokenBucket(tokens_per_minute / self.processes, now)
+        self.requests = TokenBucket(requests_per_minute / self.processes, now)
+        self.blocked_until = now
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # ユーザー -> 待機中のチケット
+
+    def acquire(self, user_key, tokens, max_wait=None):
+        """
+        呼び出し枠を確保する。待ち時間が上限を超える場合はAdmissionRejectedを送出する。
+        戻り値は確保したトークン数（settleで実際の使用量と精算する）
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        tokens = min(tokens, self.tokens.capacity)
+        ticket = _Ticket(user_key, tokens)
+        with self._cond:
+            now = self._clock()
+            self._refill(now)
+            # 待ち時間の見込みが上限を超えるなら、待たせずにすぐ拒否する
+            estimated_wait = self._estimated_wait(ticket, now)
+            if estimated_wait > max_wait:
+                raise AdmissionRejected(estimated_wait)
+
+            deadline = now + max_wait
+            self._queues.setdefault(user_key, deque()).append(ticket)
+            try:
+                while True:
+                    now = self._clock()
+                    self._refill(now)
+                    wait = self._estimated_wait(None, now)
+                    if self._next_ticket() is ticket:
+                        wait = self._wait_for(ticket, now)
+                        if wait <= 0:
+                            self.tokens.level -= ticket.tokens
+                            self.requests.level -= 1
+                            return ticket.tokens
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise AdmissionRejected(max(wait, 1))
+                    self._cond.wait(min(max(wait, 0.01), remaining))
+            finally:
+                self._remove(ticket)
+                self._cond.notify_all()
+
+    def settle(self, reserved, actual):
+        """
+        見込みで確保したトークン数を実際の使用量で精算する
+        """
+        if actual is None:
+            return
+        with self._cond:
+            self._refill(self._clock())
+            self.tokens.level = min(
+                self.tokens.capacity, self.tokens.level + reserved - actual
+            )
+            self._cond.notify_all()
+
+    def observe(self, status_code, headers):
+        """
+        レスポンスのx-ratelimit-*ヘッダから残り枠と上限を反映する
+        （ヘッダはデプロイメント全体の値なので、プロセスの数で割る）
+        """
+        with self._cond:
+            now = self._clock()
+            self._refill(now)
+            for bucket, suffix in (
+                (self.tokens, "tokens"),
+                (self.requests, "requests"),
+            ):
+                limit = _header_number(headers, f"x-ratelimit-limit-{suffix}")
+                if limit:
+                    bucket.resize(limit / self.processes)
+                remaining = _header_number(headers, f"x-ratelimit-remaining-{suffix}")
+                if remaining is not None:
+                    bucket.level = min(bucket.level, remaining / self.processes)
+            if status_code == 429:
+                retry_after = _header_number(headers, "retry-after-ms")
+                if retry_after is not None:
+                    retry_after /= 1000
+                else:
+                    retry_after = _header_number(headers, "retry-after") or 1
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            self._cond.notify_all()
+
+    def observe_response(self, response):
+        """
+        httpxのレスポンスフック
+        """
+        self.observe(response.status_code, response.headers)
+
+    def blocked_for(self):
+        with self._cond:
+            return max(0.0, self.blocked_until - self._clock())
+
+    def remaining_ratio(self):
+        with self._cond:
+            self._refill(self._clock())
+            return max(0.0, self.tokens.level / self.tokens.capacity)
+
+    def _refill(self, now):
+        self.tokens.refill(now)
+        self.requests.refill(now)
+
+    def _wait_for(self, ticket, now):
+        return max(
+            self.blocked_until - now,
+            self.tokens.time_until(ticket.tokens),
+            self.requests.time_until(1),
+        )
+
+    def _estimated_wait(self, ticket, now):
+        # 順番待ちのチケットをすべて処理し終えるまでの時間を見積もる
+        tickets = [queued for queue in self._queues.values() for queued in queue]
+        if ticket is not None:
+            tickets.append(ticket)
+        if not tickets:
+            return 0.0
+        return max(
+            self.blocked_until - now,
+            self.tokens.time_until(sum(queued.tokens for queued in tickets)),
+            self.requests.time_until(len(tickets)),
+        )
+
+    def _next_ticket(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.user_key)
+        if queue is None or ticket not in queue:
+            return
+        served = queue[0] is ticket
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.user_key]
+        elif served:
+            # 処理したユーザーを最後尾に回して、ユーザー間で順番に処理する
+            self._queues.move_to_end(ticket.user_key)
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """
+    デプロイメント名ごとに共有されるリミッターを取得する
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            config = get_config()
+            limiter = DeploymentLimiter(
+                name,
+                tokens_per_minute=config.openai_tokens_per_minute,
+                requests_per_minute=config.openai_requests_per_minute,
+                max_wait=config.openai_admission_max_wait,
+                processes=config.openai_quota_processes,
+            )
+            _limiters[name] = limiter
+        return limiter
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RagSampleAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rag_sample_app"
+
+    def ready(self):
+        # search_cache: ドキュメントの変更で検索結果のキャッシュを無効にするシグナルを登録する
+        # throttling: 回数制限のキャッシュの設定を確認するシステムチェックを登録する
+        from . import search_cache, throttling  # noqa: F401
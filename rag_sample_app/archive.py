@@ -0,0 +1,150 @@
+import datetime
+import json
+import zlib
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .metrics import metrics
+from .models import ChatHistory, Thread, ThreadArchive, TurnUsage
+from .purge import delete_chats
+from .sharding import shards, use_shard
+
+# 圧縮率を優先する（アーカイブは書き込みより読み込みの方が少ない）
+COMPRESSION_LEVEL = 9
+
+CHAT_FIELDS = ("id", "message", "sender", "timestamp")
+
+
+def compress_chats(chats):
+    rows = [
+        {
+            "id": chat.id,
+            "message": chat.message,
+            "sender": chat.sender,
+            "timestamp": chat.timestamp.isoformat(),
+        }
+        for chat in chats
+    ]
+    data = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(data.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def load_rows(data):
+    return json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+
+
+def decompress_chats(thread, data):
+    """
+    アーカイブのデータを保存しないChatHistoryの一覧に戻す
+    """
+    rows = load_rows(data)
+    return [
+        ChatHistory(
+            id=row["id"],
+            thread_id=thread,
+            message=row["message"],
+            sender=row["sender"],
+            timestamp=datetime.datetime.fromisoformat(row["timestamp"]),
+        )
+        for row in rows
+    ]
+
+
+def chat_history(thread):
+    """
+    アーカイブとホットテーブルを合わせたスレッドのチャット履歴（古い順）
+    """
+    archive = ThreadArchive.objects.filter(thread=thread).first()
+    chats = ChatHistory.objects.filter(thread_id=thread).order_by("timestamp", "id")
+    if archive is None:
+        return list(chats)
+    # アーカイブ後に書き込まれた行だけをホットテーブルから読む
+    return decompress_chats(thread, archive.data) + list(
+        chats.filter(id__gt=archive.last_chat_id)
+    )
+
+
+def chat_history_values(thread):
+    """
+    chat_historyと同じ履歴を、モデルを作らずに辞書の一覧で返す
+    """
+    archive = ThreadArchive.objects.filter(thread=thread).first()
+    chats = ChatHistory.objects.filter(thread_id=thread).order_by("timestamp", "id")
+    rows = []
+    if archive is not None:
+        for row in load_rows(archive.data):
+            row["thread_id"] = thread.pk
+            row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+            rows.append(row)
+        chats = chats.filter(id__gt=archive.last_chat_id)
+    # スレッドIDはすべての行で同じなので、DBからは読まない
+    for row in chats.values(*CHAT_FIELDS):
+        row["thread_id"] = thread.pk
+        rows.append(row)
+    return rows
+
+
+def archive_thread(thread, batch_size=None):
+    """
+    スレッドのチャット履歴を圧縮して１行にまとめ、ホットテーブルから削除する。
+    既にアーカイブがある場合は、その後に書き込まれた履歴を追加する
+    """
+    batch_size = batch_size or get_config().purge_batch_size
+    with use_shard(thread._state.db):
+        return _archive_thread(thread, batch_size)
+
+
+def _archive_thread(thread, batch_size):
+    with transaction.atomic(using=thread._state.db):
+        chats = chat_history(thread)
+        if not chats:
+            return 0
+        last_chat_id = max(chat.id for chat in chats)
+        if not thread.summary:
+            # AllThreadsでアーカイブを展開しなくて済むように要約を作っておく
+            thread.summary = "\n".join(
+                chat.message for chat in reversed(chats) if chat.sender != "AI"
+            )
+            thread.save(update_fields=["summary", "updated_at"])
+        ThreadArchive.objects.update_or_create(
+            thread=thread,
+            defaults={
+                "data": compress_chats(chats),
+                "message_count": len(chats),
+                "last_chat_id": last_chat_id,
+            },
+        )
+
+    # アーカイブの保存後は、残った行を読み込み時に無視するので、ロックを短くするため分けて削除する
+    archived = ChatHistory.objects.filter(thread_id=thread, id__lte=last_chat_id)
+    # 使用量はdefaultにあるので、サブクエリではなくIDの一覧で紐付けを外す
+    TurnUsage.objects.filter(
+        chat_id__in=list(archived.values_list("id", flat=True))
+    ).update(chat=None)
+    deleted = delete_chats(archived, batch_size)
+    metrics.inc("archived_threads_total")
+    metrics.inc("archived_chats_total", deleted)
+    return deleted
+
+
+def archive_idle_threads(days=None, batch_size=None, now=None):
+    """
+    すべてのシャードで、最後のチャットから指定日数が経ったスレッドをアーカイブする
+    """
+    days = get_config().archive_after_days if days is None else days
+    now = timezone.now() if now is None else now
+    archived = 0
+    deleted = 0
+    for alias in shards():
+        with use_shard(alias):
+            threads = Thread.objects.annotate(
+                last_activity=Max("chats__timestamp")
+            ).filter(last_activity__lt=now - datetime.timedelta(days=days))
+            for thread in list(threads):
+                deleted += archive_thread(thread, batch_size)
+                archived += 1
+    return archived, deleted
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import unicodedata
+
+
+def normalize_search_word(search_word):
+    """
+    同一の入力とみなせるように文字列を正規化する（NFKC・前後の空白・連続する空白）
+    """
+    return " ".join(unicodedata.normalize("NFKC", search_word).split())
+
+
+def coalescing_key(*parts):
+    """
+    キーを構成する要素から固定長のキーを作成する
+    """
+    joined = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同じキーで同時に実行された処理を１回にまとめ、結果を共有する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        実行中の同じキーの処理があればその完了を待って結果を返し、なければfnを実行する。
+        戻り値は (結果, 共有された結果かどうか)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,56 @@
+"""
+検索結果からプロンプトに入れるドキュメントを選ぶ。
+MMR（Maximal Marginal Relevance）で、クエリに近く、選択済みのものと似ていないドキュメントを順に選び、
+ほぼ同じ内容のドキュメントでプロンプトの文字数を使わないようにする
+"""
+
+import numpy as np
+
+from rag_sample_django.config import get_config
+
+from .local_search import embed
+
+
+def mmr_select(query_embedding, embeddings, k, lambda_, first=None):
+    """
+    MMRでk件を選び、選んだ順のインデックスを返す。
+    類似度は候補同士の行列を１回の行列積で計算し、各ステップでは選択済みとの最大類似度だけを更新する。
+    firstを指定した場合は、その候補を最初に選ぶ
+    """
+    count = len(embeddings)
+    k = min(k, count)
+    if k <= 0:
+        return []
+    relevance = embeddings @ query_embedding
+    similarity = embeddings @ embeddings.T
+    # 選択済みの候補との類似度の最大値（最初は何も選んでいないので0）
+    redundancy = np.zeros(count, dtype=similarity.dtype)
+    available = np.ones(count, dtype=bool)
+
+    selected = []
+    while len(selected) < k:
+        if first is not None and not selected:
+            choice = first
+        else:
+            scores = lambda_ * relevance - (1 - lambda_) * redundancy
+            choice = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(choice)
+        available[choice] = False
+        np.maximum(redundancy, similarity[choice], out=redundancy)
+    return selected
+
+
+def select_documents(search_word, documents, k=None, lambda_=None):
+    """
+    検索結果からk件を選ぶ。統合した検索の１位はそのまま使い、２件目以降をMMRで選ぶ
+    """
+    config = get_config()
+    k = config.context_documents if k is None else k
+    lambda_ = config.mmr_lambda if lambda_ is None else lambda_
+    if len(documents) <= 1 or k <= 1:
+        return documents[:k]
+    embeddings = embed([document.get("content") or "" for document in documents])
+    query_embedding = embed([search_word])[0]
+    return [
+        documents[i] for i in mmr_select(query_embedding, embeddings, k, lambda_, 0)
+    ]
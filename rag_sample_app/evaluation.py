@@ -0,0 +1,225 @@
+"""
+面接全体の評価レポート。スレッドの履歴をチャンクに分けて並列に採点し（map）、
+チャンクごとの結果をPythonで集計する（reduce）。
+処理時間は全チャンクの合計ではなく、最も遅いチャンクの時間に近くなる
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .archive import chat_history
+from .llm import create_chat_completion
+from .metrics import metrics
+from .models import Thread
+from .usage import record_usage
+from .versions import history_version
+
+# 評価基準（キー, 説明）
+RUBRIC = [
+    ("logic", "論理性：質問の意図を理解し、筋道立てて答えているか"),
+    ("specificity", "具体性：経験や数字など具体的な根拠を示しているか"),
+    ("communication", "コミュニケーション：簡潔で分かりやすい表現か"),
+    ("motivation", "意欲：志望動機や仕事への熱意が伝わるか"),
+]
+MIN_SCORE = 1
+MAX_SCORE = 5
+# レポートに残す強み・弱みの最大件数
+MAX_POINTS = 5
+
+EVALUATION_PROMPT = (
+    "あなたは、企業の面接の評価者です。以下の面接の一部について、応募者の回答を評価基準ごとに"
+    f"{MIN_SCORE}〜{MAX_SCORE}点で採点してください。\n"
+    "評価基準:\n{rubric}\n"
+    "次の形式のJSONだけで答えてください。\n"
+    '{{"scores": {{{keys}}}, "strengths": ["強み"], "weaknesses": ["改善点"]}}'
+)
+
+
+class EvaluationError(Exception):
+    pass
+
+
+def build_evaluation_prompt():
+    rubric = "\n".join(f"- {key}: {description}" for key, description in RUBRIC)
+    keys = ", ".join(f'"{key}": 点数' for key, _ in RUBRIC)
+    return EVALUATION_PROMPT.format(rubric=rubric, keys=keys)
+
+
+def transcript_lines(thread, chats):
+    """
+    初回メッセージとチャット履歴を「話者: 発言」の行にする
+    """
+    lines = []
+    if thread.first_message:
+        lines.append(f"面接官: {thread.first_message}")
+    for chat in chats:
+        speaker = "面接官" if chat.sender == "AI" else "応募者"
+        lines.append(f"{speaker}: {chat.message}")
+    return lines
+
+
+def chunk_lines(lines, size):
+    return [lines[i : i + size] for i in range(0, len(lines), size)]
+
+
+def parse_scores(content):
+    """
+    モデルの応答からJSONを取り出し、評価基準ごとの点数を範囲内の整数にそろえる
+    """
+    start = content.find("{")
+    end = content.rfind("}")
+    if start < 0 or end < start:
+        raise EvaluationError("The evaluation is not JSON")
+    try:
+        data = json.loads(content[start : end + 1])
+    except ValueError as e:
+        raise EvaluationError("The evaluation is not JSON") from e
+    if not isinstance(data, dict) or not isinstance(data.get("scores"), dict):
+        raise EvaluationError("The evaluation has no scores")
+
+    scores = {}
+    for key, _ in RUBRIC:
+        value = data["scores"].get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            scores[key] = min(MAX_SCORE, max(MIN_SCORE, round(value)))
+    return {
+        "scores": scores,
+        "strengths": [str(item) for item in data.get("strengths") or []],
+        "weaknesses": [str(item) for item in data.get("weaknesses") or []],
+    }
+
+
+def score_chunk(lines, user_key=None, deadline=None):
+    """
+    １チャンクを採点する（DBは使わないので、ワーカースレッドから呼び出せる）
+    """
+    messages = [
+        {"role": "system", "content": build_evaluation_prompt()},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+    started = time.monotonic()
+    response = create_chat_completion(
+        model=get_config().openai_model,
+        messages=messages,
+        user_key=user_key,
+        deadline=deadline,
+    )
+    latency = time.monotonic() - started
+    try:
+        result = parse_scores(response.choices[0].message.content or "")
+    except EvaluationError:
+        result = None
+    return result, response, latency
+
+
+def _unique(items):
+    seen = []
+    for item in items:
+        if item not in seen:
+            seen.append(item)
+    return seen[:MAX_POINTS]
+
+
+def reduce_results(results, sizes):
+    """
+    チャンクごとの点数を行数で重み付けして平均し、強み・弱みをまとめる
+    """
+    scores = {}
+    for key, _ in RUBRIC:
+        weighted = [
+            (result["scores"][key], size)
+            for result, size in zip(results, sizes)
+            if result is not None and key in result["scores"]
+        ]
+        total = sum(size for _, size in weighted)
+        if total:
+            scores[key] = round(sum(s * size for s, size in weighted) / total, 1)
+
+    valid = [result for result in results if result is not None]
+    return {
+        "scores": scores,
+        "overall": (round(sum(scores.values()) / len(scores), 1) if scores else None),
+        "strengths": _unique(item for r in valid for item in r["strengths"]),
+        "weaknesses": _unique(item for r in valid for item in r["weaknesses"]),
+        "chunks": [
+            {
+                "messages": size,
+                "scores": result["scores"] if result is not None else None,
+            }
+            for result, size in zip(results, sizes)
+        ],
+        "failed_chunks": len(results) - len(valid),
+    }
+
+
+def evaluate_thread(thread, user, deadline=None):
+    """
+    スレッドの履歴をチャンクに分けて同時に採点し、１つのレポートにまとめる
+    """
+    config = get_config()
+    chunks = chunk_lines(
+        transcript_lines(thread, chat_history(thread)), config.evaluation_chunk_size
+    )
+    if not chunks:
+        raise EvaluationError("The thread has no messages to evaluate")
+
+    started = time.monotonic()
+    workers = max(1, min(config.evaluation_concurrency, len(chunks)))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="thread-evaluation"
+    ) as executor:
+        futures = [
+            executor.submit(score_chunk, lines, user.pk, deadline) for lines in chunks
+        ]
+    metrics.observe("evaluation_duration_seconds", time.monotonic() - started)
+    metrics.inc("evaluation_chunks_total", len(chunks))
+
+    # 使用量の保存はワーカーではなく、呼び出し元のスレッド（DB接続）で行う。
+    # 失敗したチャンクがあっても、成功したチャンクの使用量は記録してから送出する
+    scored = []
+    error = None
+    for future in futures:
+        try:
+            scored.append(future.result())
+        except Exception as e:
+            error = error or e
+    for _, response, latency in scored:
+        record_usage(user, response, latency, thread=thread)
+    if error is not None:
+        raise error
+
+    results = [result for result, _, _ in scored]
+    if all(result is None for result in results):
+        raise EvaluationError("The evaluation could not be parsed")
+    sizes = [len(lines) for lines in chunks]
+    report = reduce_results(results, sizes)
+    report["message_count"] = sum(sizes)
+    report["evaluated_at"] = timezone.now().isoformat()
+    return report
+
+
+def get_or_create_evaluation(thread, user, deadline=None):
+    """
+    履歴が変わっていなければスレッドに保存したレポートを返し、変わっていれば作り直す。
+    採点できなかったチャンクがあるレポートは、次の呼び出しで採点し直すように保存しない。
+    戻り値は (レポート, 作成したか)
+    """
+    version = history_version(thread)
+    if thread.evaluation is not None and thread.evaluation_version == version:
+        return thread.evaluation, False
+
+    report = evaluate_thread(thread, user, deadline)
+    if report["failed_chunks"]:
+        return report, True
+    # 評価はスレッド一覧の表示に影響しないので、updated_atは更新しない
+    Thread.objects.using(thread._state.db).filter(pk=thread.pk).update(
+        evaluation=report, evaluation_version=version
+    )
+    thread.evaluation = report
+    thread.evaluation_version = version
+    return report, True
@@ -0,0 +1,195 @@
+"""
+ユーザーの面接（すべてのスレッドとチャット履歴）のNDJSON・CSVでの一括エクスポート。
+スレッドもチャット履歴もキーセット（作成日時・ID）で一定件数ずつ読むので、履歴の量によらず
+メモリの使用量は一定になる（MySQLのiterator()は結果をすべてクライアントに読み込むため使わない）。
+各行のcursorを指定すると、その行の次から再開できる
+"""
+
+import base64
+import csv
+import datetime
+import itertools
+import uuid
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from .archive import load_rows
+from .models import Thread, ThreadArchive
+from .renderers import ORJSON_OPTIONS, _encoder
+from .serializers import chat_history_rows
+from .sharding import use_shard
+
+EXPORT_FIELDS = [
+    "thread_id",
+    "thread_created_at",
+    "message_id",
+    "sender",
+    "message",
+    "timestamp",
+    "cursor",
+]
+EXPORT_CHUNK_SIZE = 500
+
+# 初回メッセージはチャット履歴にないので、ID 0 の行として出力する
+FIRST_MESSAGE_ID = 0
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(thread, chat_id):
+    data = f"{thread.created_at.isoformat()}|{thread.pk}|{chat_id}"
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    """
+    (スレッドの作成日時, スレッドID, 出力済みの最後のチャット履歴のID)
+    """
+    try:
+        data = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        created_at, thread_id, chat_id = data.split("|")
+        return (
+            datetime.datetime.fromisoformat(created_at),
+            uuid.UUID(thread_id),
+            int(chat_id),
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def _threads(user, cursor, chunk_size):
+    """
+    作成日時・IDの順にスレッドを返す。cursorのスレッド自体も含める
+    """
+    threads = Thread.objects.filter(creator=user).order_by("created_at", "id")
+    if cursor is not None:
+        created_at, thread_id, _ = cursor
+        threads = threads.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gte=thread_id)
+        )
+    while True:
+        chunk = list(threads.only("id", "created_at", "first_message")[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        threads = threads.filter(
+            Q(created_at__gt=last.created_at)
+            | Q(created_at=last.created_at, id__gt=last.pk)
+        )
+
+
+def _chat_rows(thread, after_id, chunk_size):
+    """
+    スレッドのチャット履歴をIDの順に一定件数ずつ返す（アーカイブ済みの行を含む）
+    """
+    archive = (
+        ThreadArchive.objects.filter(thread=thread)
+        .values_list("data", "last_chat_id")
+        .first()
+    )
+    if archive is not None:
+        data, last_chat_id = archive
+        rows = [row for row in load_rows(data) if row["id"] > after_id]
+        for row in sorted(rows, key=lambda row: row["id"]):
+            row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+            yield row
+        after_id = max(after_id, last_chat_id)
+
+    chats = thread.chats.order_by("id").values("id", "message", "sender", "timestamp")
+    while True:
+        chunk = list(chats.filter(id__gt=after_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        after_id = chunk[-1]["id"]
+
+
+def export_rows(user, cursor=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    ユーザーのすべてのスレッドのメッセージを、EXPORT_FIELDSの辞書として順に返す
+    """
+    for thread in _threads(user, cursor, chunk_size):
+        after_id = -1
+        if cursor is not None and thread.pk == cursor[1]:
+            after_id = cursor[2]
+        rows = _chat_rows(thread, max(after_id, FIRST_MESSAGE_ID), chunk_size)
+        if after_id < FIRST_MESSAGE_ID and thread.first_message:
+            first = {
+                "id": FIRST_MESSAGE_ID,
+                "message": thread.first_message,
+                "sender": "AI",
+                "timestamp": thread.created_at,
+            }
+            rows = itertools.chain([first], rows)
+        thread_created_at = None
+        for row in rows:
+            row["thread_id"] = str(thread.pk)
+            [row] = chat_history_rows([row])
+            if thread_created_at is None:
+                thread_created_at = chat_history_rows(
+                    [{**row, "timestamp": thread.created_at}]
+                )[0]["timestamp"]
+            yield {
+                "thread_id": row["thread_id"],
+                "thread_created_at": thread_created_at,
+                "message_id": row["id"],
+                "sender": row["sender"],
+                "message": row["message"],
+                "timestamp": row["timestamp"],
+                "cursor": encode_cursor(thread, row["id"]),
+            }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield orjson.dumps(row, default=_encoder.default, option=ORJSON_OPTIONS) + b"\n"
+
+
+class _Echo:
+    # csv.writerの書き込み先（書き込んだ内容をそのまま返す）
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _lines(user, format, cursor, chunk_size):
+    encode = ndjson_lines if format == "ndjson" else csv_lines
+    return encode(export_rows(user, cursor, chunk_size))
+
+
+def stream_export(user, shard, format, cursor=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    StreamingHttpResponseに渡すジェネレーター。レスポンスはビューを抜けてから読まれるので、
+    ユーザーのシャードをジェネレーターの中で有効にする
+    """
+    with use_shard(shard):
+        yield from _lines(user, format, cursor, chunk_size)
+
+
+async def astream_export(
+    user, shard, format, cursor=None, chunk_size=EXPORT_CHUNK_SIZE
+):
+    """
+    ASGIで動かす場合のstream_export。Djangoは同期のイテレーターをすべて読み込んでから送るので、
+    chunk_size行ずつ同期処理のスレッドで読み、非同期のイテレーターとして返す
+    """
+    lines = _lines(user, format, cursor, chunk_size)
+
+    def next_batch():
+        with use_shard(shard):
+            return list(itertools.islice(lines, chunk_size))
+
+    while batch := await sync_to_async(next_batch)():
+        for line in batch:
+            yield line
@@ -0,0 +1,87 @@
+import uuid
+
+from django.core import exceptions
+from django.db import models
+
+
+class Sender(models.TextChoices):
+    USER = "USER"
+    AI = "AI"
+
+
+# DBに保存する値（APIやコードでは文字列のまま扱う）
+SENDER_CODES = {Sender.USER: 1, Sender.AI: 2}
+SENDER_NAMES = {code: Sender(name) for name, code in SENDER_CODES.items()}
+
+
+class SenderField(models.PositiveSmallIntegerField):
+    """
+    送信者を"USER"/"AI"の文字列として扱い、DBにはsmallintで保存するフィールド
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs["choices"] = Sender.choices
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["choices"]
+        return name, path, args, kwargs
+
+    @property
+    def validators(self):
+        # 値は文字列なので、整数の範囲チェックは行わない
+        return list(self._validators)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Sender):
+            return value
+        if isinstance(value, int) and value in SENDER_NAMES:
+            return SENDER_NAMES[value]
+        if value in Sender.values:
+            return Sender(value)
+        raise exceptions.ValidationError(
+            f"“{value}” is not a valid sender.", code="invalid_choice"
+        )
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else SENDER_NAMES[value]
+
+    def get_prep_value(self, value):
+        value = self.to_python(value)
+        return None if value is None else SENDER_CODES[value]
+
+
+class BinaryUUIDField(models.UUIDField):
+    """
+    MySQLではchar(32)ではなくbinary(16)で保存するUUIDフィールド
+    （ほかのDBではUUIDFieldと同じ）
+    """
+
+    def get_internal_type(self):
+        # DBバックエンドのUUID変換を通さずに、from_db_valueで変換する
+        return "BinaryUUIDField"
+
+    def db_type(self, connection):
+        if connection.vendor == "mysql":
+            return "binary(16)"
+        return connection.data_types["UUIDField"]
+
+    def rel_db_type(self, connection):
+        return self.db_type(connection)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor != "mysql":
+            return super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = self.to_python(value)
+        return value.bytes
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return uuid.UUID(bytes=bytes(value))
+        return uuid.UUID(value)
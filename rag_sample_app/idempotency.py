@@ -0,0 +1,80 @@
+"""
+Idempotency-Keyヘッダで再送されたターンに、最初のリクエストと同じ結果を返すための記録。
+記録は IDEMPOTENCY_TTL_SECONDS が経つと期限切れになり（同じキーで再実行される）、
+処理中のまま持ち時間を過ぎた記録はワーカーが途中で停止したものとして次のリクエストが引き継ぐ
+"""
+
+import datetime
+import hashlib
+
+import orjson
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .models import IdempotencyRecord
+
+
+def request_hash(data):
+    """
+    同じキーで別の内容のリクエストが送られたことを検出するためのハッシュ
+    """
+    body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.sha256(body).hexdigest()
+
+
+def _expired_before():
+    return timezone.now() - datetime.timedelta(
+        seconds=get_config().idempotency_ttl_seconds
+    )
+
+
+def find_record(user, key):
+    """
+    ユーザー・キーの記録（期限切れの記録は削除してNoneを返す）
+    """
+    record = IdempotencyRecord.objects.filter(creator=user, key=key).first()
+    if record is not None and record.created_at < _expired_before():
+        IdempotencyRecord.objects.filter(
+            pk=record.pk, created_at=record.created_at
+        ).delete()
+        return None
+    return record
+
+
+def claim_record(user, key, digest):
+    """
+    キーの処理を始める記録を作る。同じキーの処理中の記録がターンの持ち時間
+    （REQUEST_DEADLINE_SECONDS）より古い場合は引き継ぐ。別のワーカーで処理中の場合はNone
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(
+                creator=user, key=key, request_hash=digest
+            )
+    except IntegrityError:
+        pass
+    now = timezone.now()
+    abandoned_before = now - datetime.timedelta(
+        seconds=get_config().request_deadline_seconds
+    )
+    taken = IdempotencyRecord.objects.filter(
+        creator=user,
+        key=key,
+        status_code__isnull=True,
+        created_at__lt=abandoned_before,
+    ).update(created_at=now, request_hash=digest)
+    if not taken:
+        return None
+    return IdempotencyRecord.objects.get(creator=user, key=key)
+
+
+def prune_idempotency_records():
+    """
+    期限切れの記録を削除する
+    """
+    deleted, _ = IdempotencyRecord.objects.filter(
+        created_at__lt=_expired_before()
+    ).delete()
+    return deleted
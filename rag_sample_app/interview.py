@@ -0,0 +1,70 @@
+"""
+面接の１ターン分のプロンプトの作成と保存（HTTPとWebSocketの両方で使う）
+"""
+
+import datetime
+
+from django.utils import timezone
+
+from .diversity import select_documents
+from .models import ChatHistory, Thread
+from .prefetch import schedule_prefetch
+from .usage import record_usage
+
+DOCUMENT_MAX_LENGTH = 2000
+
+
+def limit_string_length(strings, max_length):
+    """
+    文字数制限を超えた文字列を切り詰める
+    """
+    if len(strings) > max_length:
+        return strings[:max_length]
+    return strings
+
+
+def build_prompt(search_word, documents):
+    """
+    最後のuserメッセージの内容を作る。検索結果がある場合はドキュメントに基づいて答えるように指示し、
+    MMRで選んだドキュメントを、合計がDOCUMENT_MAX_LENGTHに収まるまで順に入れてから、ユーザーの入力を続ける
+    """
+    if not documents:
+        return search_word
+    passages = []
+    remaining = DOCUMENT_MAX_LENGTH
+    for doc in select_documents(search_word, documents):
+        if remaining <= 0:
+            break
+        content = limit_string_length(doc.get("content", "No content found"), remaining)
+        passages.append(content)
+        remaining -= len(content)
+    combined_content = "\n".join(passages)
+    return f"以下の<document>に基づいて質問に答えてください（答えられる情報がない場合は、AIベースの回答をしてください）<document> {combined_content}</document>\n\n{search_word}"
+
+
+def save_turn(user, thread, search_word, completion, latency):
+    """
+    ユーザーの入力とAIの応答をチャット履歴に保存し、使用量を記録する
+    """
+    response = completion.choices[0].message.content
+    user_input = ChatHistory(
+        thread_id=thread,
+        message=search_word,
+        timestamp=datetime.datetime.now(),
+        sender="USER",
+    )
+    user_input.save()
+    ai_input = ChatHistory(
+        thread_id=thread,
+        message=response,
+        timestamp=datetime.datetime.now(),
+        sender="AI",
+    )
+    ai_input.save()
+    record_usage(user, completion, latency, thread=thread, chat=ai_input)
+    if not thread.summary:
+        # 要約は次にスレッド一覧を取得したときに作るので、一覧のETagが変わるように更新日時を進める
+        Thread.objects.filter(pk=thread.pk).update(updated_at=timezone.now())
+    # 応募者の次の回答はこの質問についての内容になるので、先に検索しておく
+    schedule_prefetch(thread, response)
+    return response
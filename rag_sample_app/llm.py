@@ -0,0 +1,155 @@
+import time
+from types import SimpleNamespace
+
+from .admission import AdmissionRejected, estimate_tokens, usage_tokens
+from .routing import get_router
+
+
+class CompletionTimeout(Exception):
+    """
+    持ち時間内にOpenAIの応答が得られなかった
+    """
+
+
+def is_retryable(error):
+    """
+    別のデプロイメントで再試行すべきエラー（429・5xx・接続エラー）
+    """
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def was_not_sent(error):
+    """
+    リクエストがデプロイメントに届いておらず、トークンが消費されていないエラー（接続エラー・429）。
+    タイムアウトと5xxは処理の途中で失敗した可能性があるので含めない
+    """
+    import openai
+
+    if isinstance(error, openai.APITimeoutError):
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError))
+
+
+class StreamInterrupted(Exception):
+    """
+    ストリーミングの途中で失敗した（送信済みのトークンがあるので再試行しない）
+    """
+
+
+class StreamedCompletion:
+    """
+    ストリーミングで受け取った応答を、Chat Completionsのレスポンスと同じ形にまとめる
+    """
+
+    def __init__(self, model, content, usage):
+        self.model = model
+        self.usage = usage
+        self.choices = [SimpleNamespace(message=SimpleNamespace(content=content))]
+
+
+def _complete(model, messages, call, user_key=None, deadline=None):
+    """
+    スコアの良いデプロイメントから順に、リミッターで呼び出し枠を確保してから
+    Chat Completions APIを呼び出す。429・5xxの場合は次のデプロイメントに切り替える。
+    deadlineを指定した場合は、枠の待ち時間と呼び出しのタイムアウトを残り時間に収める
+    """
+    # openaiのimportは重いので、起動時ではなく最初の呼び出し時に行う
+    import openai
+
+    tokens = estimate_tokens(messages)
+    rejected = None
+    last_error = None
+    for deployment in get_router().candidates():
+        limiter = deployment.limiter
+        options = {}
+        max_wait = None
+        if deadline is not None:
+            if deadline.expired():
+                break
+            options["timeout"] = deadline.remaining()
+            max_wait = min(limiter.max_wait, deadline.remaining())
+        try:
+            reserved = limiter.acquire(user_key, tokens, max_wait=max_wait)
+        except AdmissionRejected as e:
+            if rejected is None or e.retry_after < rejected.retry_after:
+                rejected = e
+            continue
+
+        started = time.monotonic()
+        try:
+            response = call(deployment.client, deployment.model or model, options)
+        except Exception as e:
+            # 消費された可能性がある場合は、見込みで確保したトークンを戻さない
+            if was_not_sent(e):
+                limiter.settle(reserved, 0)
+            if not is_retryable(e):
+                raise
+            deployment.record_error()
+            last_error = e
+            if isinstance(e, openai.RateLimitError):
+                limiter.observe(e.status_code, e.response.headers)
+                busy = AdmissionRejected(limiter.blocked_for())
+                if rejected is None or busy.retry_after < rejected.retry_after:
+                    rejected = busy
+            continue
+
+        deployment.record_success(time.monotonic() - started)
+        limiter.settle(reserved, usage_tokens(response))
+        return response
+
+    # すべてのデプロイメントで失敗した場合、枠待ちなら503、それ以外は最後のエラー
+    if rejected is not None:
+        raise rejected
+    if last_error is None or isinstance(last_error, openai.APITimeoutError):
+        raise CompletionTimeout() from last_error
+    raise last_error
+
+
+def create_chat_completion(model, messages, user_key=None, deadline=None):
+    """
+    Chat Completions APIを呼び出す（デプロイメントの選択と切り替えは_completeを参照）
+    """
+
+    def call(client, model, options):
+        return client.chat.completions.create(model=model, messages=messages, **options)
+
+    return _complete(model, messages, call, user_key=user_key, deadline=deadline)
+
+
+def stream_chat_completion(model, messages, on_delta, user_key=None, deadline=None):
+    """
+    Chat Completions APIをストリーミングで呼び出し、受け取ったトークンごとにon_deltaを呼ぶ。
+    最初のトークンを受け取る前の失敗だけ、別のデプロイメントで再試行する
+    """
+
+    def call(client, model, options):
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options,
+        )
+        parts = []
+        usage = None
+        response_model = model
+        try:
+            for chunk in stream:
+                response_model = chunk.model or response_model
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        on_delta(choice.delta.content)
+        except Exception as e:
+            if parts:
+                raise StreamInterrupted(str(e)) from e
+            raise
+        return StreamedCompletion(response_model, "".join(parts), usage)
+
+    return _complete(model, messages, call, user_key=user_key, deadline=deadline)
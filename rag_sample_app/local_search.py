@@ -0,0 +1,140 @@
+"""
+Documentテーブルを対象にしたプロセス内の検索（BM25とベクトル類似度）。
+日本語を形態素解析せずに扱えるように、文字のbigramを単語の代わりに使う。
+インデックスは企業（テナント）ごとのシャードに分け、検索では対象の企業のドキュメントだけを見る。
+各シャードは、検索結果のキャッシュと同じその企業のインデックスのバージョンが変わったときに作り直す
+"""
+
+import math
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from .models import Document
+from .search_cache import index_version
+
+# ハッシュしたn-gramの埋め込みの次元数
+EMBEDDING_DIM = 256
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def normalize_text(text):
+    return "".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def tokenize(text):
+    """
+    NFKC正規化・小文字化し、空白を除いた文字のbigramの一覧にする（１文字の場合はその文字）
+    """
+    chars = normalize_text(text)
+    if len(chars) < 2:
+        return [chars] if chars else []
+    return [chars[i : i + 2] for i in range(len(chars) - 1)]
+
+
+def _bigram_buckets(text):
+    """
+    文字のbigramをハッシュした次元の番号（文字コードの配列でまとめて計算する）
+    """
+    codes = np.frombuffer(
+        normalize_text(text).encode("utf-32-le"), dtype=np.uint32
+    ).astype(np.uint64)
+    if len(codes) > 1:
+        codes = codes[:-1] * np.uint64(0x110000) + codes[1:]
+    # hash()はプロセスごとに値が変わるので、乗算ハッシュで次元に割り当てる
+    return (codes * np.uint64(0x9E3779B97F4A7C15) >> np.uint64(40)) % EMBEDDING_DIM
+
+
+def embed(texts):
+    """
+    bigramをハッシュして数えた、L2正規化済みのベクトル（行がテキスト）
+    """
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        vectors[row] = np.bincount(_bigram_buckets(text), minlength=EMBEDDING_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class LocalIndex:
+    """
+    ドキュメントの一覧から作る読み取り専用のインデックス（作成後は複数のスレッドから使える）
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self._postings = {}
+        self._lengths = []
+        for position, document in enumerate(documents):
+            counts = Counter(tokenize(document["content"]))
+            self._lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self._postings.setdefault(token, []).append((position, count))
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0
+        )
+        self._embeddings = embed([document["content"] for document in documents])
+
+    def __len__(self):
+        return len(self.documents)
+
+    def bm25(self, query, k):
+        """
+        BM25のスコアが高い順にk件を返す（スコアが0のドキュメントは含めない）
+        """
+        scores = {}
+        total = len(self.documents)
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, count in postings:
+                norm = BM25_K1 * (
+                    1 - BM25_B + BM25_B * self._lengths[position] / self._average_length
+                )
+                score = idf * count * (BM25_K1 + 1) / (count + norm)
+                scores[position] = scores.get(position, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [self.documents[position] for position, _ in ranked[:k]]
+
+    def vector(self, query, k):
+        """
+        クエリとのコサイン類似度が高い順にk件を返す（類似度が0以下のドキュメントは含めない）
+        """
+        if not self.documents:
+            return []
+        similarities = self._embeddings @ embed([query])[0]
+        top = np.argsort(-similarities, kind="stable")[:k]
+        return [self.documents[i] for i in top if similarities[i] > 0]
+
+
+_lock = threading.Lock()
+# 企業のID（共通のドキュメントはNone）ごとの (インデックスのバージョン, LocalIndex)
+_shards = {}
+
+
+def get_local_index(company_id=None):
+    """
+    企業のインデックスのバージョンが変わっていれば、その企業のDocumentを読み直してシャードを作る
+    """
+    version = index_version(company_id)
+    with _lock:
+        shard = _shards.get(company_id)
+        if shard is None or shard[0] != version:
+            documents = list(
+                Document.objects.filter(company_id=company_id)
+                .order_by("id")
+                .values("id", "content")
+            )
+            shard = (version, LocalIndex(documents))
+            _shards[company_id] = shard
+        return shard[1]
+
+
+def reset_local_index():
+    with _lock:
+        _shards.clear()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from rag_sample_app.archive import archive_idle_threads
+
+
+class Command(BaseCommand):
+    help = "長期間更新のないスレッドのチャット履歴を圧縮してアーカイブする"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, help="最後のチャットからアーカイブするまでの日数"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="１回のDELETEで削除するチャット履歴の件数"
+        )
+
+    def handle(self, *args, **options):
+        threads, chats = archive_idle_threads(
+            days=options["days"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"archived {threads} thread(s), {chats} chat(s)")
+        )
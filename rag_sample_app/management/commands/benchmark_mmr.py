@@ -0,0 +1,60 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag_sample_app.diversity import mmr_select
+from rag_sample_app.local_search import embed
+
+TOPICS = ["営業", "開発", "マネジメント", "データ分析", "カスタマーサポート"]
+
+
+def make_candidates(count, seed=0):
+    """
+    似た内容（同じトピックの言い換え）を多く含む候補の文章を作る
+    """
+    rng = random.Random(seed)
+    candidates = []
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        years = rng.randint(1, 10)
+        candidates.append(
+            f"{topic}の経験が{years}年あります。{topic}ではチームで成果を出すことを大切にしてきました。"
+            * rng.randint(3, 10)
+        )
+    return candidates
+
+
+class Command(BaseCommand):
+    help = "検索結果のMMRによる選択にかかる時間を、候補数ごとに計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--candidates", type=int, nargs="+", default=[100, 300, 1000]
+        )
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--lambda", dest="lambda_", type=float, default=0.7)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        query = embed(["営業でチームの成果を出した経験"])[0]
+        for count in options["candidates"]:
+            texts = make_candidates(count)
+            embed_timings = []
+            select_timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                embeddings = embed(texts)
+                embedded = time.perf_counter()
+                mmr_select(query, embeddings, options["k"], options["lambda_"], 0)
+                embed_timings.append(embedded - started)
+                select_timings.append(time.perf_counter() - embedded)
+
+            select_timings.sort()
+            self.stdout.write(
+                f"{count} candidates: select median {statistics.median(select_timings) * 1000:.2f} ms, "
+                f"p95 {select_timings[int(len(select_timings) * 0.95) - 1] * 1000:.2f} ms, "
+                f"embed median {statistics.median(embed_timings) * 1000:.2f} ms"
+            )
+        self.stdout.write(self.style.SUCCESS("done"))
@@ -0,0 +1,125 @@
+import json
+import time
+from contextlib import nullcontext
+from dataclasses import replace
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from rag_sample_app.diversity import select_documents
+from rag_sample_app.interview import build_prompt
+from rag_sample_app.models import Document
+from rag_sample_app.resilience import Deadline
+from rag_sample_app.retrieval import retrieve
+from rag_sample_app.retrieval_benchmark import StandInSearchServer, summarize
+from rag_sample_app.search_cache import bump_index_version, search_cache
+
+DEFAULT_DATASET = (
+    Path(__file__).resolve().parents[2] / "benchmarks" / "retrieval_queries.json"
+)
+
+
+class Command(BaseCommand):
+    help = "ラベル付きのクエリで検索の品質（recall@k・MRR・nDCG）と速度を計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", default=str(DEFAULT_DATASET))
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--latency-ms",
+            type=float,
+            default=0,
+            help="スタンドインの検索サービスが応答するまでの時間",
+        )
+        parser.add_argument(
+            "--live",
+            action="store_true",
+            help="スタンドインではなく、設定されたAzure AI Searchを使う",
+        )
+        parser.add_argument("--branches", help="RETRIEVAL_BRANCHESを上書きする")
+        parser.add_argument("--context-documents", type=int)
+        parser.add_argument("--mmr-lambda", type=float)
+        parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+
+    def handle(self, *args, **options):
+        with open(options["dataset"], encoding="utf-8") as f:
+            dataset = json.load(f)
+        labels = {
+            document["content"]: document["id"] for document in dataset["documents"]
+        }
+
+        overrides = {}
+        if options["branches"] is not None:
+            overrides["retrieval_branches"] = options["branches"]
+        if options["context_documents"] is not None:
+            overrides["context_documents"] = options["context_documents"]
+        if options["mmr_lambda"] is not None:
+            overrides["mmr_lambda"] = options["mmr_lambda"]
+
+        # ローカルの検索用のドキュメントは最後にロールバックして残さない
+        with transaction.atomic():
+            Document.objects.bulk_create(
+                Document(content=document["content"])
+                for document in dataset["documents"]
+            )
+            # bulk_createではシグナルが送られないので、インデックスのバージョンを直接上げる
+            bump_index_version()
+            server = (
+                nullcontext()
+                if options["live"]
+                else StandInSearchServer(
+                    dataset["documents"], latency=options["latency_ms"] / 1000
+                )
+            )
+            try:
+                with server:
+                    if not options["live"]:
+                        overrides["search_endpoint"] = server.url
+                        overrides["search_index"] = "benchmark"
+                    with override_settings(
+                        APP_CONFIG=replace(settings.APP_CONFIG, **overrides)
+                    ):
+                        results = self.run_queries(dataset, labels, options["repeat"])
+            finally:
+                transaction.set_rollback(True)
+        bump_index_version()
+
+        summary = summarize(results, options["k"])
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        for name, value in summary.items():
+            self.stdout.write(
+                f"{name}: {value:.3f}"
+                if isinstance(value, float)
+                else f"{name}: {value}"
+            )
+
+    def run_queries(self, dataset, labels, repeat):
+        config = settings.APP_CONFIG
+        results = []
+        for _ in range(repeat):
+            for item in dataset["queries"]:
+                # 毎回検索サービスに問い合わせるように、検索結果のキャッシュを使わない
+                search_cache.clear()
+                started = time.perf_counter()
+                documents = retrieve(
+                    item["query"], Deadline(config.request_deadline_seconds)
+                )
+                latency = time.perf_counter() - started
+                context = select_documents(item["query"], documents)
+                prompt = build_prompt(item["query"], documents)
+                results.append(
+                    {
+                        "ranked": [labels.get(d.get("content")) for d in documents],
+                        "context": [labels.get(d.get("content")) for d in context],
+                        "relevant": item["relevant"],
+                        "latency": latency,
+                        "context_bytes": len(prompt.encode("utf-8")),
+                    }
+                )
+        return results
@@ -0,0 +1,67 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from rag_sample_app.archive import chat_history, chat_history_values
+from rag_sample_app.models import ChatHistory, Thread
+from rag_sample_app.renderers import ORJSONRenderer
+from rag_sample_app.serializers import ChatHistorySerializer, chat_history_rows
+
+
+class Command(BaseCommand):
+    help = "チャット履歴のJSON出力にかかる時間を、ModelSerializerと軽量版で比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        messages = options["messages"]
+        # 計測用のデータは最後にロールバックして残さない
+        with transaction.atomic():
+            user = User.objects.create(username=f"benchmark-{uuid.uuid4()}")
+            thread = Thread.objects.create(creator=user)
+            ChatHistory.objects.bulk_create(
+                ChatHistory(
+                    thread_id=thread,
+                    message=f"{i}番目のメッセージです。よろしくお願いします。" * 5,
+                    sender="USER" if i % 2 == 0 else "AI",
+                )
+                for i in range(messages)
+            )
+
+            def before():
+                serializer = ChatHistorySerializer(chat_history(thread), many=True)
+                return JSONRenderer().render(serializer.data)
+
+            def after():
+                return ORJSONRenderer().render(
+                    chat_history_rows(chat_history_values(thread))
+                )
+
+            if before() != after():
+                raise CommandError("the lean path does not match ModelSerializer")
+
+            results = {}
+            for name, render in (("ModelSerializer", before), ("values+orjson", after)):
+                timings = []
+                for _ in range(options["repeat"]):
+                    started = time.perf_counter()
+                    render()
+                    timings.append(time.perf_counter() - started)
+                results[name] = statistics.median(timings) * 1000 * 1000 / messages
+                self.stdout.write(
+                    f"{name}: {results[name]:.2f} ms / 1,000 messages (median of {options['repeat']})"
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"speedup: {results['ModelSerializer'] / results['values+orjson']:.1f}x"
+            )
+        )
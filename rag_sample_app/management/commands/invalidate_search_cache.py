@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_sample_app.models import Company
+from rag_sample_app.search_cache import bump_index_version
+
+
+class Command(BaseCommand):
+    help = "Azure AI Searchのインデックスを更新したあとに、検索結果のキャッシュを無効にする"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            nargs="+",
+            help="インデックスを更新した企業のslug（省略時は共通のインデックスとすべての企業）",
+        )
+
+    def handle(self, *args, **options):
+        slugs = options["company"]
+        if slugs:
+            companies = list(Company.objects.filter(slug__in=slugs))
+            missing = set(slugs) - {company.slug for company in companies}
+            if missing:
+                raise CommandError(f"unknown company: {', '.join(sorted(missing))}")
+            targets = [(company.slug, company.pk) for company in companies]
+        else:
+            targets = [("shared", None)] + list(
+                Company.objects.order_by("id").values_list("slug", "pk")
+            )
+        for name, company_id in targets:
+            version = bump_index_version(company_id)
+            self.stdout.write(
+                self.style.SUCCESS(f"{name}: index version is now {version}")
+            )
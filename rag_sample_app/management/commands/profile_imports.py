@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Djangoの起動とURL設定（ビュー）の読み込みまでを計測する
+STARTUP_CODE = "import django; django.setup(); import rag_sample_django.urls"
+
+
+def parse_importtime(output):
+    """
+    python -X importtime の出力を (累積時間[us], 入れ子の深さ, モジュール名) の一覧にする
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "起動時のimport時間を計測し、時間のかかっているモジュールを表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20)
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr)
+            return
+        rows = parse_importtime(result.stderr)
+        total = sum(cumulative for cumulative, depth, _ in rows if depth == 0)
+        self.stdout.write(f"total import time: {total / 1000:.1f} ms")
+        for cumulative, _, name in sorted(rows, reverse=True)[: options["top"]]:
+            self.stdout.write(f"{cumulative / 1000:10.1f} ms  {name}")
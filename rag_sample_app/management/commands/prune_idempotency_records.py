@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rag_sample_app.idempotency import prune_idempotency_records
+
+
+class Command(BaseCommand):
+    help = "期限切れ（IDEMPOTENCY_TTL_SECONDS）のIdempotency-Keyの記録を削除する"
+
+    def handle(self, *args, **options):
+        deleted = prune_idempotency_records()
+        self.stdout.write(self.style.SUCCESS(f"pruned {deleted} idempotency record(s)"))
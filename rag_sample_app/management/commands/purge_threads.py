@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rag_sample_app.purge import purge_deleted_threads
+
+
+class Command(BaseCommand):
+    help = "論理削除したスレッドとチャット履歴を一定件数ずつ削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, help="１回のDELETEで削除するチャット履歴の件数"
+        )
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=0,
+            help="削除してから指定した秒数が経ったスレッドだけを対象にする",
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - datetime.timedelta(seconds=options["older_than"])
+        threads, chats = purge_deleted_threads(
+            batch_size=options["batch_size"], older_than=older_than
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"purged {threads} thread(s), {chats} chat(s)")
+        )
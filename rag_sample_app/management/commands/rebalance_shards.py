@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from rag_sample_app.sharding import ShardMoveError, misplaced_users, move_user, shards
+
+
+class Command(BaseCommand):
+    help = (
+        "シャードの構成（DB_SHARDS）を変えたあとに、割り当てが変わったユーザーのスレッドと"
+        "チャット履歴を移動する（移動中のユーザーの履歴は一時的に見えなくなるので、メンテナンス中に実行する）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="移動するユーザーの数だけを表示する"
+        )
+
+    def handle(self, *args, **options):
+        users = 0
+        threads = 0
+        chats = 0
+        for source in shards():
+            for user_id, target in misplaced_users(source):
+                users += 1
+                if options["dry_run"]:
+                    self.stdout.write(f"user {user_id}: {source} -> {target}")
+                    continue
+                try:
+                    moved_threads, moved_chats = move_user(
+                        user_id, source, target, options["batch_size"]
+                    )
+                except (IntegrityError, ShardMoveError) as e:
+                    raise CommandError(
+                        f"failed to move user {user_id} from {source} to {target}: {e}"
+                    )
+                threads += moved_threads
+                chats += moved_chats
+        if options["dry_run"]:
+            self.stdout.write(f"{users} user(s) would be moved")
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"moved {users} user(s), {threads} thread(s), {chats} chat(s)"
+            )
+        )
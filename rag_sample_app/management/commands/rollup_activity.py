@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from rag_sample_app.rollup import rollup_activity
+
+
+class Command(BaseCommand):
+    help = (
+        "前回の集計より後のスレッドとチャット履歴を、日・ユーザーごとの利用状況に加算する"
+        "（cronなどで定期的に実行する）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, help="１回に集計するチャット履歴のIDの範囲"
+        )
+
+    def handle(self, *args, **options):
+        threads, chats = rollup_activity(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"rolled up {threads} thread(s), {chats} chat(s)")
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from rag_sample_app.routing import get_router
+from rag_sample_app.utils import get_public_key
+
+
+class Command(BaseCommand):
+    help = "OpenAIクライアントとCognitoの公開鍵を事前に準備する"
+
+    def handle(self, *args, **options):
+        router = get_router()
+        for deployment in router.deployments:
+            deployment.client
+        # 存在しないkidで問い合わせて公開鍵を取得しておく
+        get_public_key(None)
+        self.stdout.write(
+            self.style.SUCCESS(f"warmed up {len(router.deployments)} deployment(s)")
+        )
@@ -0,0 +1,73 @@
+import threading
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in sorted(labels))
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """
+    プロセス内のカウンタ・ゲージ・集計値をPrometheusのテキスト形式で出力する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+        self._gauges = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total = self._summaries.get(key, (0, 0.0))
+            self._summaries[key] = (count + 1, total + value)
+
+    def register_gauge(self, name, fn, **labels):
+        """
+        出力時にfn()の値を読み取るゲージを登録する
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = fn
+
+    def value(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            gauge = self._gauges.get(key)
+            if gauge is None:
+                return self._counters.get(key, 0)
+        # ゲージの関数がほかのメトリクスを読めるように、ロックの外で呼び出す
+        return gauge()
+
+    def reset(self):
+        """
+        カウンタと集計値を消去する（ゲージの登録は残す）
+        """
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted(self._summaries.items())
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (count, total) in summaries:
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        for (name, labels), fn in gauges:
+            lines.append(f"{name}{_format_labels(labels)} {fn()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
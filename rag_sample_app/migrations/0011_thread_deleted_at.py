@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0010_turnusage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0011_thread_deleted_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThreadArchive",
+            fields=[
+                (
+                    "thread",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="archive",
+                        serialize=False,
+                        to="rag_sample_app.thread",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                ("message_count", models.PositiveIntegerField(default=0)),
+                ("last_chat_id", models.PositiveBigIntegerField(default=0)),
+                ("archived_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,132 @@
+import uuid
+
+from django.db import migrations
+
+import rag_sample_app.fields
+
+# スレッドIDを参照している列（モデル名, フィールド名）
+THREAD_REFERENCES = [
+    ("chathistory", "thread_id"),
+    ("turnusage", "thread"),
+    ("threadarchive", "thread"),
+]
+
+
+def copy_sender(apps, schema_editor):
+    # "AI"以外の送信者はすべてユーザーとして扱う
+    # （シャードごとにmigrateするので、実行中のデータベースを使う）
+    ChatHistory = apps.get_model("rag_sample_app", "ChatHistory")
+    chats = ChatHistory.objects.using(schema_editor.connection.alias)
+    chats.filter(sender="AI").update(sender_code="AI")
+    chats.exclude(sender="AI").update(sender_code="USER")
+
+
+def restore_sender(apps, schema_editor):
+    ChatHistory = apps.get_model("rag_sample_app", "ChatHistory")
+    chats = ChatHistory.objects.using(schema_editor.connection.alias)
+    for sender in ("USER", "AI"):
+        chats.filter(sender_code=sender).update(sender=sender)
+
+
+def convert_thread_ids(apps, schema_editor, to_binary):
+    """
+    MySQLのchar(32)のUUIDをbinary(16)に変換する（ほかのDBでは列の型は変わらない）
+    """
+    if schema_editor.connection.vendor != "mysql":
+        return
+
+    quote = schema_editor.quote_name
+    references = [
+        (apps.get_model("rag_sample_app", model_name), field_name)
+        for model_name, field_name in THREAD_REFERENCES
+    ]
+    # 参照元と参照先の型が一致しないと変更できないので、外部キー制約を外しておく
+    for model, field_name in references:
+        column = model._meta.get_field(field_name).column
+        for name in schema_editor._constraint_names(model, [column], foreign_key=True):
+            schema_editor.execute(schema_editor._delete_fk_sql(model, name))
+
+    columns = [(apps.get_model("rag_sample_app", "Thread"), "id")] + references
+    for model, field_name in columns:
+        field = model._meta.get_field(field_name)
+        table = quote(model._meta.db_table)
+        column = quote(field.column)
+        null = "NULL" if field.null else "NOT NULL"
+        # varbinaryを経由して、文字コードの変換をせずに中身を入れ替える
+        schema_editor.execute(
+            f"ALTER TABLE {table} MODIFY {column} varbinary(32) {null}"
+        )
+        if to_binary:
+            schema_editor.execute(f"UPDATE {table} SET {column} = UNHEX({column})")
+            schema_editor.execute(
+                f"ALTER TABLE {table} MODIFY {column} binary(16) {null}"
+            )
+        else:
+            schema_editor.execute(f"UPDATE {table} SET {column} = LOWER(HEX({column}))")
+            schema_editor.execute(
+                f"ALTER TABLE {table} MODIFY {column} char(32) {null}"
+            )
+
+    for model, field_name in references:
+        schema_editor.execute(
+            schema_editor._create_fk_sql(
+                model,
+                model._meta.get_field(field_name),
+                "_fk_%(to_table)s_%(to_column)s",
+            )
+        )
+
+
+def thread_ids_to_binary(apps, schema_editor):
+    convert_thread_ids(apps, schema_editor, to_binary=True)
+
+
+def thread_ids_to_char(apps, schema_editor):
+    convert_thread_ids(apps, schema_editor, to_binary=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0012_threadarchive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chathistory",
+            name="sender_code",
+            field=rag_sample_app.fields.SenderField(null=True),
+        ),
+        migrations.RunPython(copy_sender, restore_sender),
+        migrations.RemoveField(
+            model_name="chathistory",
+            name="sender",
+        ),
+        migrations.RenameField(
+            model_name="chathistory",
+            old_name="sender_code",
+            new_name="sender",
+        ),
+        migrations.AlterField(
+            model_name="chathistory",
+            name="sender",
+            field=rag_sample_app.fields.SenderField(),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="thread",
+                    name="id",
+                    field=rag_sample_app.fields.BinaryUUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(thread_ids_to_binary, thread_ids_to_char),
+            ],
+        ),
+    ]
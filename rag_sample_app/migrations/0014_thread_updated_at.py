@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0013_compact_chathistory"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0014_thread_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="evaluation",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="evaluation_version",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+import rag_sample_app.prompts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0015_thread_evaluation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="interviewer",
+            field=models.CharField(
+                blank=True,
+                default=rag_sample_app.prompts.choose_interviewer,
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="turnusage",
+            name="cached_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
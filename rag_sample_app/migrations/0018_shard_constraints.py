@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0017_company"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="thread",
+            name="company",
+            field=models.ForeignKey(
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="threads",
+                to="rag_sample_app.company",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="thread",
+            name="creator",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="turnusage",
+            name="chat",
+            field=models.OneToOneField(
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="usage",
+                to="rag_sample_app.chathistory",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="turnusage",
+            name="thread",
+            field=models.ForeignKey(
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="usages",
+                to="rag_sample_app.thread",
+            ),
+        ),
+    ]
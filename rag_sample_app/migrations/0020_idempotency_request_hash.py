@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_sample_app", "0019_daily_activity"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="idempotencyrecord",
+            name="request_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="idempotencyrecord",
+            index=models.Index(
+                fields=["created_at"], name="rag_sample__created_febc0f_idx"
+            ),
+        ),
+    ]
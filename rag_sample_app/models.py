@@ -3,10 +3,40 @@ import uuid  # uuidモジュールをインポート
 from django.apps import AppConfig
 from django.contrib.auth.models import AbstractBaseUser, User
 from django.db import models
+from django.utils import timezone
+
+from .fields import BinaryUUIDField, SenderField
+from .prompts import choose_interviewer
+
+
+class CompanyManager(models.Manager):
+    def default_for(self, user):
+        """
+        ユーザーが所属する企業（複数の場合は最初に登録したもの、所属がなければNone）
+        """
+        return self.filter(members=user).order_by("id").first()
+
+
+class Company(models.Model):
+    # 面接のドキュメントを分けて持つ顧客企業（テナント）
+    slug = models.SlugField(unique=True)
+    name = models.CharField(max_length=100)
+    search_index = models.CharField(
+        max_length=128, unique=True
+    )  # この企業のドキュメントだけを持つAzure AI Searchのインデックス
+    members = models.ManyToManyField(User, related_name="companies", blank=True)
+
+    objects = CompanyManager()
+
+    def __str__(self):
+        return self.name
 
 
 class Document(models.Model):
     content = models.TextField()
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name="documents", null=True
+    )  # Noneは企業に属さない共通のドキュメント
 
     def __str__(self):
         return self.content[:50]
@@ -16,16 +46,55 @@ class RagSampleAppConfig(AppConfig):
     name = "rag_sample_app"
 
 
+class ThreadQuerySet(models.QuerySet):
+    def soft_delete(self):
+        """
+        削除日時だけを記録してすぐに見えなくする（実際の削除はpurgeで行う）
+        """
+        now = timezone.now()
+        return self.filter(deleted_at__isnull=True).update(
+            deleted_at=now, updated_at=now
+        )
+
+
+class ThreadManager(models.Manager.from_queryset(ThreadQuerySet)):
+    # 削除済みのスレッドは通常の検索から除く
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Thread(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = BinaryUUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     summary = models.TextField(blank=True, null=True)  # 要約フィールドを追加
+    # スレッドはユーザーごとのシャードに置くので、defaultにあるテーブルへの外部キー制約は作らない
     creator = models.ForeignKey(
-        User, on_delete=models.CASCADE
+        User, on_delete=models.CASCADE, db_constraint=False
     )  # 作成者フィールドを追加
     first_message = models.TextField(
         blank=True, null=True
     )  # 初回メッセージフィールドを追加
+    deleted_at = models.DateTimeField(
+        blank=True, null=True, db_index=True
+    )  # 論理削除した日時
+    updated_at = models.DateTimeField(auto_now=True)  # 要約などを更新した日時
+    evaluation = models.JSONField(blank=True, null=True)  # 面接の評価レポート
+    evaluation_version = models.CharField(
+        max_length=100, blank=True
+    )  # 評価した時点の履歴の状態
+    interviewer = models.CharField(
+        max_length=20, blank=True, default=choose_interviewer
+    )  # システムプロンプトの面接官（プロンプトキャッシュのためスレッドの間は変えない）
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.SET_NULL,
+        related_name="threads",
+        null=True,
+        db_constraint=False,
+    )  # 検索するドキュメントの企業
+
+    objects = ThreadManager()
+    all_objects = ThreadQuerySet.as_manager()
 
 
 class ChatHistory(models.Model):
@@ -35,12 +104,102 @@ class ChatHistory(models.Model):
     # thread_idのデフォルト値を設定
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    sender = models.TextField()
+    sender = SenderField()  # "USER"または"AI"
 
     def __str__(self):
         return f"Thread {self.thread_id.id} - {self.message[:50]}"
 
 
+class ThreadArchive(models.Model):
+    # 長期間更新のないスレッドのチャット履歴をzlibで圧縮したJSONとして１行にまとめる
+    thread = models.OneToOneField(
+        Thread, on_delete=models.CASCADE, primary_key=True, related_name="archive"
+    )
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField(default=0)
+    # アーカイブ済みの最後のチャット履歴のID（これ以下の行はホットテーブルから読まない）
+    last_chat_id = models.PositiveBigIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now=True)
+
+
+class IdempotencyRecord(models.Model):
+    # Idempotency-Keyヘッダで再送されたリクエストに同じ結果を返すための記録
+    creator = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # 処理中はNULL、完了後にレスポンスを保存する
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.JSONField(blank=True, null=True)
+    # 同じキーで別の内容のリクエストを拒否するための、リクエストの内容のハッシュ
+    request_hash = models.CharField(max_length=64, blank=True)
+    # 処理を始めた日時（期限切れと、処理中のまま停止した記録の判定に使う）
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["creator", "key"], name="unique_idempotency_key_per_user"
+            )
+        ]
+        indexes = [models.Index(fields=["created_at"])]
+
+
+class TurnUsage(models.Model):
+    # OpenAI呼び出し１回ごとのトークン使用量と応答時間
+    creator = models.ForeignKey(User, on_delete=models.CASCADE)
+    # スレッドとチャット履歴は別のシャードにあるので、制約を作らず削除時にも連動させない
+    # （削除・アーカイブの処理で先に紐付けを外す）
+    thread = models.ForeignKey(
+        Thread,
+        on_delete=models.DO_NOTHING,
+        related_name="usages",
+        null=True,
+        db_constraint=False,
+    )
+    chat = models.OneToOneField(
+        ChatHistory,
+        on_delete=models.DO_NOTHING,
+        related_name="usage",
+        null=True,
+        db_constraint=False,
+    )  # AIの応答メッセージ
+    model = models.CharField(max_length=100, blank=True)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    total_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(
+        default=0
+    )  # prompt_tokensのうちプロバイダのキャッシュから読まれた分
+    latency_ms = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["creator", "created_at"])]
+
+
+class DailyActivity(models.Model):
+    # 面接を始めた日・ユーザーごとの集計（rollup_activityで新しい行の分だけ加算する）
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    threads = models.PositiveIntegerField(default=0)
+    turns = models.PositiveIntegerField(default=0)  # ユーザーの発言の数
+    messages = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "user"], name="unique_daily_activity_per_user"
+            )
+        ]
+
+
+class RollupWatermark(models.Model):
+    # シャードごとの、DailyActivityに集計済みの位置
+    database = models.CharField(max_length=100, unique=True)
+    last_chat_id = models.PositiveBigIntegerField(default=0)
+    threads_until = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class User(AbstractBaseUser):
     email = models.EmailField(unique=True)
     USERNAME_FIELD = "email"
@@ -0,0 +1,102 @@
+"""
+検索の先読み。AIの質問を保存した直後に、その質問でバックグラウンドに検索しておき、
+応募者の次の回答のターンではAzure AI Searchを待たずに結果を使う（PREFETCH_TTL_SECONDSで有効化）
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from rag_sample_django.config import get_config
+
+from .metrics import metrics
+from .resilience import Deadline
+from .retrieval import hybrid_search, retrieve
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_CACHE_ALIAS = "prefetch"
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval-prefetch")
+
+
+def prefetch_key(thread_id):
+    return f"prefetch:{thread_id}"
+
+
+def hit_ratio():
+    hits = metrics.value("retrieval_prefetch_total", result="hit")
+    misses = metrics.value("retrieval_prefetch_total", result="miss")
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+metrics.register_gauge("retrieval_prefetch_hit_ratio", hit_ratio)
+
+
+def prefetch(thread_id, question, company=None):
+    """
+    質問でスレッドの企業のドキュメントを検索した結果を、スレッドごとのキャッシュに保存する
+    """
+    config = get_config()
+    timeout = Deadline(config.request_deadline_seconds).share(
+        config.retrieval_budget_share
+    )
+    documents = hybrid_search(question, timeout, company)
+    # 何も見つからなかった場合（検索の失敗を含む）は、次のターンで回答の内容で検索する
+    if not documents:
+        metrics.inc("retrieval_prefetches_total", outcome="empty")
+        return
+    caches[PREFETCH_CACHE_ALIAS].set(
+        prefetch_key(thread_id),
+        documents,
+        timeout=config.prefetch_ttl_seconds,
+    )
+    metrics.inc("retrieval_prefetches_total", outcome="stored")
+
+
+def _prefetch_in_background(thread_id, question, company=None):
+    try:
+        prefetch(thread_id, question, company)
+    except Exception:
+        logger.exception("failed to prefetch documents for thread %s", thread_id)
+    finally:
+        # ローカルのインデックスを作るときにDBに接続するので、ワーカーの接続を閉じる
+        connection.close()
+
+
+def schedule_prefetch(thread, question):
+    """
+    トランザクションの確定後に、AIの質問でバックグラウンドに検索する
+    """
+    if not get_config().prefetch_ttl_seconds or not question:
+        return
+    thread_id = thread.pk
+    company = thread.company
+    transaction.on_commit(
+        lambda: _executor.submit(_prefetch_in_background, thread_id, question, company),
+        using=thread._state.db,
+    )
+
+
+def retrieve_for_turn(thread, search_word, deadline):
+    """
+    先読みした結果があればそれを使い、なければretrieveで検索する。
+    先読みの結果は次のAIの質問で作り直すので、１回使ったら消す
+    """
+    company = thread and thread.company
+    if not get_config().prefetch_ttl_seconds or thread is None:
+        return retrieve(search_word, deadline, company)
+
+    cache = caches[PREFETCH_CACHE_ALIAS]
+    key = prefetch_key(thread.pk)
+    documents = cache.get(key)
+    cache.delete(key)
+    # 先読みで何も見つからなかった場合は、回答の内容で検索し直す
+    if not documents:
+        metrics.inc("retrieval_prefetch_total", result="miss")
+        return retrieve(search_word, deadline, company)
+
+    metrics.inc("retrieval_prefetch_total", result="hit")
+    return documents
@@ -0,0 +1,204 @@
+"""
+リクエスト単位のサンプリングプロファイラ。
+PROFILING_TOKENと同じ値のX-Profileヘッダを付けたリクエスト、または PROFILE_SAMPLE_RATE の割合の
+リクエストだけ、別スレッドから一定間隔で処理中のスタックを記録し、SQLの実行ログと一緒に
+プロセス内のリングバッファ（古いものから捨てる）に保存する。
+ミドルウェアなので jwt_required → ビュー → OpenAIの呼び出しまでを含むが、ストリーミングの
+レスポンスはビューを抜けた後に送られるので含まない。
+対象外のリクエストでは設定を読むだけで、何も記録しない
+"""
+
+import hmac
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .metrics import metrics
+
+PROFILE_HEADER = "X-Profile"
+# スタックを記録する間隔（秒）と、１リクエストで記録するSQLの上限
+SAMPLE_INTERVAL = 0.005
+MAX_QUERIES = 500
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_qualname}"
+
+
+def collapse_stack(frame):
+    """
+    flamegraph.plやspeedscopeが読める形式（根元から;区切り）にする
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """
+    指定したスレッドのスタックを別スレッドから一定間隔で数える
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueryLog:
+    """
+    connection.execute_wrapperで、すべてのデータベース（シャードを含む）のSQLと所要時間を記録する
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+
+    def wrap(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            started = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.count += 1
+                if len(self.queries) < MAX_QUERIES:
+                    self.queries.append(
+                        {
+                            "database": alias,
+                            "sql": sql,
+                            "duration_ms": round(
+                                (time.monotonic() - started) * 1000, 3
+                            ),
+                        }
+                    )
+
+        return wrapper
+
+    def capture(self, stack):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self.wrap(alias)))
+
+
+class ProfileStore:
+    """
+    記録したプロファイルのリングバッファ（PROFILE_BUFFER_SIZE件を超えたら古いものから捨てる）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = OrderedDict()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > get_config().profile_buffer_size:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            profiles = list(self._profiles.values())
+        # 新しい順。スタックとSQLのログは個別に取得する
+        return [
+            {
+                key: value
+                for key, value in profile.items()
+                if key not in ("stacks", "query_log")
+            }
+            for profile in reversed(profiles)
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_store = ProfileStore()
+
+
+def collapsed(profile):
+    """
+    「スタック 回数」の行のテキスト（flamegraph.pl・speedscopeで読める）
+    """
+    return "".join(
+        f"{stack} {count}\n" for stack, count in profile["stacks"].most_common()
+    )
+
+
+def should_profile(request, config):
+    token = config.profiling_token
+    # トークンは一定時間で比較する（一致した文字数を応答時間から推測されないように）
+    if token and hmac.compare_digest(
+        request.headers.get(PROFILE_HEADER, "").encode(), token.encode()
+    ):
+        return True
+    return config.profile_sample_rate > 0 and random.random() < (
+        config.profile_sample_rate
+    )
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request, get_config()):
+            return self.get_response(request)
+
+        profile_id = uuid.uuid4().hex
+        query_log = QueryLog()
+        started_at = timezone.now()
+        started = time.monotonic()
+        with ExitStack() as stack:
+            query_log.capture(stack)
+            sampler = stack.enter_context(Sampler(threading.get_ident()))
+            response = self.get_response(request)
+        profile_store.add(
+            {
+                "id": profile_id,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "started_at": started_at,
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+                "samples": sum(sampler.stacks.values()),
+                "stacks": sampler.stacks,
+                "query_count": query_log.count,
+                "query_log": query_log.queries,
+            }
+        )
+        metrics.inc("profiled_requests_total")
+        response["X-Profile-Id"] = profile_id
+        return response
@@ -0,0 +1,45 @@
+"""
+OpenAIに送るmessagesの組み立て。
+プロバイダのプロンプトキャッシュは先頭から一致した部分にだけ効くので、
+システムプロンプト（スレッドごとに固定した面接官）・初回メッセージ・チャット履歴を
+毎回同じバイト列で先頭に置き、検索したドキュメントとユーザーの入力は最後のメッセージにだけ入れる
+"""
+
+import random
+
+INTERVIEWER_NAMES = ["高階", "渡海", "佐伯", "藤原", "西崎", "世良", "猫田"]
+
+
+def choose_interviewer():
+    """
+    スレッドを作るときに面接官を１人選ぶ（以降のターンでは同じ面接官を使う）
+    """
+    return random.choice(INTERVIEWER_NAMES)
+
+
+def system_prompt(interviewer):
+    if not interviewer:
+        return "あなたは、企業の面接官です。面接を受ける人に対して、適切な質問をしてください。"
+    return f"あなたは、企業の面接官の{interviewer}です。面接を受ける人に対して、適切な質問をしてください。面接は１対１です。"
+
+
+def build_prefix(thread, chats):
+    """
+    システムプロンプト・初回メッセージ・チャット履歴をmessagesの形式にする。
+    同じスレッドでは前のターンのprefixの後ろに履歴が追加されるだけになる
+    """
+    messages = [{"role": "system", "content": system_prompt(thread.interviewer)}]
+    messages.append({"role": "assistant", "content": thread.first_message})
+    for item in chats:
+        if item.sender == "USER":
+            messages.append({"role": "user", "content": item.message})
+        elif item.sender == "AI":
+            messages.append({"role": "assistant", "content": item.message})
+    return messages
+
+
+def build_messages(prefix, prompt):
+    """
+    prefixの後ろに、そのターンだけの内容（ドキュメントとユーザーの入力）を１つのメッセージとして追加する
+    """
+    return [*prefix, {"role": "user", "content": prompt}]
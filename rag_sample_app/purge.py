@@ -0,0 +1,97 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, transaction
+
+from rag_sample_django.config import get_config
+
+from .metrics import metrics
+from .models import ChatHistory, Thread, TurnUsage
+from .sharding import active_shard, shards, use_shard
+
+logger = logging.getLogger(__name__)
+
+# 削除はリクエストとは別の１スレッドで順番に行う
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thread-purge")
+
+
+def _delete_chats(ids, using):
+    connection = connections[using]
+    table = connection.ops.quote_name(ChatHistory._meta.db_table)
+    pk = connection.ops.quote_name(ChatHistory._meta.pk.column)
+    placeholders = ", ".join(["%s"] * len(ids))
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", ids)
+        return cursor.rowcount
+
+
+def delete_chats(chats, batch_size):
+    """
+    チャット履歴をbatch_size件ずつ生のDELETEで削除する（chatsと同じデータベースで実行する）
+    """
+    deleted = 0
+    while True:
+        ids = list(chats.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += _delete_chats(ids, chats.db)
+
+
+def purge_thread(thread_id, batch_size=None):
+    """
+    論理削除したスレッドのチャット履歴を一定件数ずつ削除してからスレッドを削除する。
+    ロックを短くするため、Djangoのカスケード削除は使わずにバッチごとにDELETEを発行する
+    """
+    batch_size = batch_size or get_config().purge_batch_size
+    # 使用量は１日の上限の計算に使うので、スレッドとの紐付けだけを外して残す
+    TurnUsage.objects.filter(thread_id=thread_id).update(thread=None, chat=None)
+
+    deleted = delete_chats(ChatHistory.objects.filter(thread_id=thread_id), batch_size)
+    Thread.all_objects.filter(pk=thread_id, deleted_at__isnull=False).delete()
+    metrics.inc("purged_threads_total")
+    metrics.inc("purged_chats_total", deleted)
+    return deleted
+
+
+def purge_deleted_threads(batch_size=None, older_than=None):
+    """
+    すべてのシャードの論理削除済みのスレッドを削除する（バックグラウンドで削除しきれなかった分の回収用）
+    """
+    purged = 0
+    deleted = 0
+    for alias in shards():
+        with use_shard(alias):
+            threads = Thread.all_objects.filter(deleted_at__isnull=False)
+            if older_than is not None:
+                threads = threads.filter(deleted_at__lte=older_than)
+            thread_ids = list(threads.values_list("pk", flat=True))
+            deleted += sum(
+                purge_thread(thread_id, batch_size) for thread_id in thread_ids
+            )
+            purged += len(thread_ids)
+    return purged, deleted
+
+
+def _purge_in_background(thread_ids, shard=None):
+    try:
+        with use_shard(shard):
+            for thread_id in thread_ids:
+                purge_thread(thread_id)
+    except Exception:
+        logger.exception("failed to purge threads %s", thread_ids)
+    finally:
+        connections.close_all()
+
+
+def schedule_purge(thread_ids):
+    """
+    トランザクションの確定後に、バックグラウンドでスレッドを削除する
+    （バックグラウンドのスレッドでも、リクエストと同じユーザーのシャードを使う）
+    """
+    thread_ids = list(thread_ids)
+    shard = active_shard()
+    if thread_ids:
+        transaction.on_commit(
+            lambda: _executor.submit(_purge_in_background, thread_ids, shard),
+            using=shard,
+        )
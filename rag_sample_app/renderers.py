@@ -0,0 +1,28 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# DRFのJSONRendererと同じ出力にするため、日時はDRFのエンコーダーで変換する
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    orjsonで高速にJSONを出力するレンダラー（出力はJSONRendererと同じ）
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # 整形やASCIIのみの出力が必要な場合は通常のJSONRendererを使う
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        # JSONRendererと同様に、JavaScriptの文字列として安全になるようにU+2028/U+2029をエスケープする
+        return ret.replace("\u2028".encode(), b"\\u2028").replace(
+            "\u2029".encode(), b"\\u2029"
+        )
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+class Deadline:
+    """
+    リクエスト全体の処理期限。各段階には残り時間の範囲で持ち時間を割り当てる
+    """
+
+    def __init__(self, budget, clock=time.monotonic):
+        self.budget = budget
+        self._clock = clock
+        self._expires_at = clock() + budget
+
+    def remaining(self):
+        return max(0.0, self._expires_at - self._clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def share(self, fraction):
+        """
+        全体の持ち時間のうちfractionの割合（残り時間を上限とする）
+        """
+        return min(self.remaining(), self.budget * fraction)
+
+
+class CircuitBreaker:
+    """
+    連続してfailure_threshold回失敗すると呼び出しを止め、reset_timeout秒後に
+    １回だけ試行して成功すれば再開する
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self, name, failure_threshold=5, reset_timeout=30, clock=time.monotonic
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = 0.0
+            self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and self._clock() - self._opened_at >= self.reset_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def state_value(self):
+        return self.STATE_VALUES[self.state]
+
+    def allow(self):
+        """
+        呼び出してよいかどうか（half_openの間は１件だけ通す）
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
@@ -0,0 +1,245 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import requests
+from rest_framework import status
+
+from rag_sample_django.config import get_config
+
+from .coalescing import coalescing_key, normalize_search_word
+from .local_search import get_local_index
+from .metrics import metrics
+from .resilience import CircuitBreaker
+from .search_cache import index_version, search_cache
+
+logger = logging.getLogger(__name__)
+
+retrieval_breaker = CircuitBreaker(
+    "retrieval",
+    failure_threshold=get_config().retrieval_breaker_failures,
+    reset_timeout=get_config().retrieval_breaker_reset_seconds,
+)
+metrics.register_gauge("retrieval_circuit_state", retrieval_breaker.state_value)
+
+
+SEARCH_API_VERSION = "2021-04-30-Preview"
+# RRFの定数と、各ブランチから取り出す件数・寄与を数える統合後の件数
+RRF_K = 60
+BRANCH_TOP_K = 10
+FUSED_TOP_K = 5
+
+# ブランチを同時に実行するスレッド（タイムアウトしたブランチもrequestsのtimeoutで終わる）
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+
+class RetrievalError(Exception):
+    pass
+
+
+def search_index_for(company=None):
+    """
+    企業のドキュメントを持つAzure AI Searchのインデックス（企業がない場合は共通のINDEX）
+    """
+    return company.search_index if company is not None else get_config().search_index
+
+
+def search_cache_key(search_word, company=None):
+    """
+    正規化した検索語・検索のパラメータ・企業のインデックスのバージョンから作るキャッシュのキー
+    """
+    config = get_config()
+    return coalescing_key(
+        "search",
+        index_version(company and company.pk),
+        config.search_base_url,
+        search_index_for(company),
+        SEARCH_API_VERSION,
+        normalize_search_word(search_word),
+    )
+
+
+def cached_documents(search_word, company=None):
+    """
+    キャッシュした検索結果を返す。ない場合は (None, 保存用のキー)
+    """
+    key = search_cache_key(search_word, company)
+    documents = search_cache.get(key)
+    metrics.inc("retrieval_cache_total", result="miss" if documents is None else "hit")
+    return documents, key
+
+
+def search_documents(search_word, timeout=None, index=None):
+    """
+    Azure AI Searchのインデックス（省略時は共通のINDEX）を検索し、ヒットしたドキュメントの一覧を返す
+    """
+    config = get_config()
+    index = index or config.search_index
+    search_url = f"{config.search_base_url}/indexes/{index}/docs"
+    headers = {"Content-Type": "application/json", "api-key": config.search_api_key}
+    params = {"api-version": SEARCH_API_VERSION, "search": search_word}
+    response = requests.get(search_url, headers=headers, params=params, timeout=timeout)
+
+    if response.status_code != status.HTTP_200_OK:
+        raise RetrievalError(f"Error {response.status_code}: {response.text}")
+    try:
+        results = response.json()
+    except requests.exceptions.JSONDecodeError as e:
+        raise RetrievalError("JSON decode error: " + str(e)) from e
+    return results.get("value") or []
+
+
+def guarded_search(search_word, timeout, cache_key=None, index=None):
+    """
+    検索の結果をサーキットブレーカーに記録する。検索できなかった場合はNoneを返す。
+    cache_keyを指定した場合は、成功した結果をキャッシュする
+    """
+    started = time.monotonic()
+    try:
+        documents = search_documents(search_word, timeout=timeout, index=index)
+    except (requests.exceptions.RequestException, RetrievalError) as e:
+        retrieval_breaker.record_failure()
+        reason = "timeout" if isinstance(e, requests.exceptions.Timeout) else "error"
+        metrics.inc("retrieval_failures_total", reason=reason)
+        logger.warning("retrieval failed, continuing without documents: %s", e)
+        return None
+    finally:
+        metrics.observe("retrieval_latency_seconds", time.monotonic() - started)
+
+    retrieval_breaker.record_success()
+    if cache_key is not None:
+        search_cache.set(cache_key, documents)
+    return documents
+
+
+def parse_retrieval_branches(value):
+    """
+    "keyword=3,vector=0.5" のような表記をブランチごとのタイムアウト[秒]にする
+    """
+    branches = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, timeout = item.split("=")
+        branches[name.strip()] = float(timeout)
+    return branches
+
+
+def keyword_search(search_word, timeout, company=None):
+    """
+    企業のインデックスでのAzure AI Searchのキーワード検索（キャッシュとサーキットブレーカーを通す）
+    """
+    documents, cache_key = cached_documents(search_word, company)
+    if documents is not None:
+        return documents
+    if not retrieval_breaker.allow():
+        metrics.inc("retrieval_skipped_total", reason="circuit_open")
+        return []
+    return (
+        guarded_search(search_word, timeout, cache_key, search_index_for(company)) or []
+    )
+
+
+def document_key(document):
+    return document.get("content") or ""
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    ブランチごとの順位を 1 / (k + 順位) の合計で１つの順位にまとめる。
+    戻り値は (ドキュメントの一覧, ブランチごとの上位FUSED_TOP_K件への寄与数)
+    """
+    scores = {}
+    documents = {}
+    sources = {}
+    for name, ranking in rankings.items():
+        for rank, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+            # 同じ内容のドキュメントは先に見つかったもの（キーワード検索）を使う
+            documents.setdefault(key, document)
+            sources.setdefault(key, []).append(name)
+    ranked = sorted(scores, key=lambda key: -scores[key])
+    contributions = {name: 0 for name in rankings}
+    for key in ranked[:FUSED_TOP_K]:
+        for name in sources[key]:
+            contributions[name] += 1
+    return [documents[key] for key in ranked[:BRANCH_TOP_K]], contributions
+
+
+def _timed(fn):
+    started = time.monotonic()
+    return fn(), time.monotonic() - started
+
+
+def hybrid_search(search_word, timeout, company=None):
+    """
+    キーワード検索・ベクトル類似度・BM25を同時に実行し、RRFで統合する。
+    どのブランチも企業（Noneは共通のドキュメント）のインデックスだけを検索する。
+    ブランチごとにタイムアウトがあり、間に合わなかったブランチの結果だけを捨てる
+    """
+    branches = parse_retrieval_branches(get_config().retrieval_branches)
+    # ローカルのインデックスはDBから読むので、ワーカーではなく呼び出し元のスレッドで用意する
+    index = (
+        get_local_index(company and company.pk)
+        if branches.keys() & {"vector", "bm25"}
+        else None
+    )
+    calls = {
+        "keyword": lambda: keyword_search(
+            search_word, min(branches["keyword"], timeout), company
+        ),
+        "vector": lambda: index.vector(search_word, BRANCH_TOP_K),
+        "bm25": lambda: index.bm25(search_word, BRANCH_TOP_K),
+    }
+
+    started = time.monotonic()
+    futures = {
+        name: _executor.submit(_timed, calls[name])
+        for name in branches
+        if name in calls
+    }
+    rankings = {}
+    latencies = {}
+    for name, future in futures.items():
+        remaining = started + min(branches[name], timeout) - time.monotonic()
+        try:
+            documents, latency = future.result(timeout=max(0, remaining))
+        except FutureTimeout:
+            metrics.inc("retrieval_branch_timeouts_total", branch=name)
+            latencies[name] = None
+            continue
+        except Exception:
+            logger.exception("retrieval branch %s failed", name)
+            metrics.inc("retrieval_branch_failures_total", branch=name)
+            continue
+        metrics.observe("retrieval_branch_latency_seconds", latency, branch=name)
+        latencies[name] = latency
+        rankings[name] = documents
+
+    documents, contributions = reciprocal_rank_fusion(rankings)
+    for name, count in contributions.items():
+        metrics.inc("retrieval_branch_contributions_total", count, branch=name)
+    logger.info(
+        "hybrid retrieval: %s",
+        ", ".join(
+            f"{name}="
+            + ("timeout" if latencies.get(name) is None else f"{latencies[name]:.3f}s")
+            + f"/{contributions.get(name, 0)}"
+            for name in futures
+        ),
+    )
+    return documents
+
+
+def retrieve(search_word, deadline, company=None):
+    """
+    持ち時間の範囲で企業のドキュメントをハイブリッド検索する。
+    検索できなかった場合は空の一覧を返し、ドキュメントなしで面接を続ける
+    """
+    timeout = deadline.share(get_config().retrieval_budget_share)
+    if timeout <= 0:
+        metrics.inc("retrieval_skipped_total", reason="deadline")
+        return []
+    return hybrid_search(search_word, timeout, company)
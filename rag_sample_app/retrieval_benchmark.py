@@ -0,0 +1,131 @@
+"""
+検索の品質と速度のオフライン評価。ラベル付きのクエリで検索し、recall@k・MRR・nDCGと
+レイテンシ・プロンプトに入るコンテキストのバイト数を集計する。
+Azure AI Searchの代わりに、ローカルのHTTPサーバー（スタンドイン）を使える
+"""
+
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .local_search import LocalIndex
+
+
+def recall_at_k(ranked, relevant, k):
+    if not relevant:
+        return 0.0
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked, relevant):
+    for rank, item in enumerate(ranked, start=1):
+        if item in relevant:
+            return 1 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked, relevant, k):
+    """
+    関連度を0/1としたnDCG@k
+    """
+    dcg = sum(
+        1 / math.log2(rank + 1)
+        for rank, item in enumerate(ranked[:k], start=1)
+        if item in relevant
+    )
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(k, len(relevant)) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentile(values, fraction):
+    """
+    最近傍順位法のパーセンタイル
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class StandInSearchServer:
+    """
+    Azure AI Searchの /indexes/<index>/docs と同じ形のJSONを返すローカルのHTTPサーバー。
+    順位はBM25で付け、latencyを指定した場合は応答の前に待つ
+    """
+
+    def __init__(self, documents, latency=0.0, top=50):
+        self.index = LocalIndex(documents)
+        self.latency = latency
+        self.top = top
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith("/docs"):
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                search = parse_qs(url.query).get("search", [""])[0]
+                body = json.dumps(
+                    {"value": server.index.bm25(search, server.top)},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+
+def summarize(results, k):
+    """
+    クエリごとの結果 {ranked, context, relevant, latency, context_bytes} を集計する
+    """
+    count = len(results)
+    latencies = [result["latency"] for result in results]
+    return {
+        "queries": count,
+        f"recall@{k}": sum(recall_at_k(r["ranked"], r["relevant"], k) for r in results)
+        / count,
+        # プロンプトに入ったドキュメントに、正解がどれだけ含まれるか
+        "context_recall": sum(
+            recall_at_k(r["context"], r["relevant"], len(r["context"])) for r in results
+        )
+        / count,
+        "mrr": sum(reciprocal_rank(r["ranked"], r["relevant"]) for r in results)
+        / count,
+        f"ndcg@{k}": sum(ndcg_at_k(r["ranked"], r["relevant"], k) for r in results)
+        / count,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "context_bytes_avg": sum(r["context_bytes"] for r in results) / count,
+    }
@@ -0,0 +1,218 @@
+"""
+管理画面・ダッシュボード向けの利用状況の日次集計。
+スレッドとチャット履歴はシャードごとに前回の位置（RollupWatermark）より後の行だけを読み、
+面接を始めた日・ユーザーごとの件数としてDailyActivityに加算する。
+集計を読むAPIはDailyActivityだけを参照するので、チャット履歴のテーブルに負荷をかけない
+"""
+
+import datetime
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .models import ChatHistory, DailyActivity, RollupWatermark, Thread
+from .sharding import shards
+
+
+def _add_counts(rows):
+    """
+    (日, ユーザー)ごとの件数を既存の集計に加算する
+    """
+    for row in rows:
+        counts = {
+            name: row[name]
+            for name in ("threads", "turns", "messages")
+            if row.get(name)
+        }
+        if not counts:
+            continue
+        activity, created = DailyActivity.objects.get_or_create(
+            date=row["day"], user_id=row["user"], defaults=counts
+        )
+        if not created:
+            DailyActivity.objects.filter(pk=activity.pk).update(
+                **{name: F(name) + value for name, value in counts.items()}
+            )
+
+
+def _lock_watermark(alias):
+    # 同時に実行された集計が同じ行を二重に数えないように、シャードの位置をロックする
+    RollupWatermark.objects.get_or_create(database=alias)
+    return RollupWatermark.objects.select_for_update().get(database=alias)
+
+
+def _thread_counts(threads):
+    tz = timezone.get_current_timezone()
+    return list(
+        threads.values(day=TruncDate("created_at", tzinfo=tz), user=F("creator_id"))
+        .annotate(threads=Count("id"))
+        .order_by()
+    )
+
+
+def _chat_counts(chats):
+    tz = timezone.get_current_timezone()
+    return list(
+        chats.values(
+            day=TruncDate("thread_id__created_at", tzinfo=tz),
+            user=F("thread_id__creator_id"),
+        )
+        .annotate(messages=Count("id"), turns=Count("id", filter=Q(sender="USER")))
+        .order_by()
+    )
+
+
+@contextmanager
+def locked_watermark(alias):
+    """
+    シャードの集計位置をロックしたトランザクション（その間、シャードの集計は待たされる）
+    """
+    with transaction.atomic():
+        yield _lock_watermark(alias)
+
+
+def _rollup_threads(alias, cutoff):
+    with transaction.atomic():
+        watermark = _lock_watermark(alias)
+        threads = Thread.all_objects.using(alias).filter(created_at__lte=cutoff)
+        if watermark.threads_until is not None:
+            threads = threads.filter(created_at__gt=watermark.threads_until)
+        rows = _thread_counts(threads)
+        _add_counts(rows)
+        watermark.threads_until = cutoff
+        watermark.save(update_fields=["threads_until", "updated_at"])
+    return sum(row["threads"] for row in rows)
+
+
+def _rollup_chats(alias, cutoff, batch_size):
+    """
+    チャット履歴はIDの範囲ごとに集計する。スレッドを始めた日に数えるので、
+    その日に始めた面接の長さ（ターン数の平均）が分かる
+    """
+    chats = ChatHistory.objects.using(alias)
+    watermark = RollupWatermark.objects.filter(database=alias).first()
+    start = watermark.last_chat_id if watermark else 0
+    # cutoffより前に書き込まれた行までを集計する（IDの順と書き込み時刻の順は厳密には一致しない）
+    end = chats.filter(id__gt=start, timestamp__lte=cutoff).aggregate(Max("id"))[
+        "id__max"
+    ]
+    total = 0
+    while end is not None:
+        with transaction.atomic():
+            watermark = _lock_watermark(alias)
+            if watermark.last_chat_id >= end:
+                break
+            upper = min(watermark.last_chat_id + batch_size, end)
+            rows = _chat_counts(
+                chats.filter(id__gt=watermark.last_chat_id, id__lte=upper)
+            )
+            _add_counts(rows)
+            watermark.last_chat_id = upper
+            watermark.save(update_fields=["last_chat_id", "updated_at"])
+        total += sum(row["messages"] for row in rows)
+    return total
+
+
+def rollup_activity(batch_size=None, now=None):
+    """
+    すべてのシャードで、前回の集計より後のスレッドとチャット履歴をDailyActivityに加算する
+    """
+    batch_size = batch_size or get_config().purge_batch_size
+    now = timezone.now() if now is None else now
+    cutoff = now - datetime.timedelta(seconds=get_config().rollup_lag_seconds)
+    threads = 0
+    chats = 0
+    for alias in shards():
+        threads += _rollup_threads(alias, cutoff)
+        chats += _rollup_chats(alias, cutoff, batch_size)
+    return threads, chats
+
+
+def _gap(counted, recounted_after):
+    """
+    移動元で位置counted以下を数え済みで、移動先で位置recounted_afterより後を数える場合に、
+    二重に数える範囲（符号-1）か、どちらでも数えない範囲（符号+1）を (符号, 下限, 上限) で返す。
+    Noneはどの位置よりも前として扱う
+    """
+    if counted == recounted_after:
+        return None
+    if recounted_after is None or (counted is not None and counted > recounted_after):
+        return -1, recounted_after, counted
+    return 1, counted, recounted_after
+
+
+def _signed(rows, sign):
+    for row in rows:
+        for name in ("threads", "turns", "messages"):
+            if name in row:
+                row[name] *= sign
+    return rows
+
+
+def correct_moved_activity(using, thread_ids, source_mark, target_mark):
+    """
+    rebalance_shardsで移したスレッド（usingにあるもの）とチャット履歴が、集計で一度だけ数えられるようにする。
+    source_markは移動元から削除したとき、target_markは移動先に書き込んだときの集計位置
+    """
+    threads = Thread.all_objects.using(using).filter(pk__in=thread_ids)
+    chats = ChatHistory.objects.using(using).filter(thread_id__in=thread_ids)
+    rows = []
+    gap = _gap(source_mark.threads_until, target_mark.threads_until)
+    if gap is not None:
+        sign, lower, upper = gap
+        selected = threads.filter(created_at__lte=upper)
+        if lower is not None:
+            selected = selected.filter(created_at__gt=lower)
+        rows += _signed(_thread_counts(selected), sign)
+    gap = _gap(source_mark.last_chat_id, target_mark.last_chat_id)
+    if gap is not None:
+        sign, lower, upper = gap
+        rows += _signed(_chat_counts(chats.filter(id__gt=lower, id__lte=upper)), sign)
+    _add_counts(rows)
+
+
+def activity_summary(days):
+    """
+    日ごとの面接の数・ターン数の平均・ユーザーあたりのメッセージ数
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rows = (
+        DailyActivity.objects.filter(date__gte=since)
+        .values("date")
+        .annotate(
+            threads=Sum("threads"),
+            turns=Sum("turns"),
+            messages=Sum("messages"),
+            users=Count("user"),
+        )
+        .order_by("date")
+    )
+    return [
+        {
+            **row,
+            "average_turns": (
+                round(row["turns"] / row["threads"], 2) if row["threads"] else 0.0
+            ),
+            "messages_per_user": round(row["messages"] / row["users"], 2),
+        }
+        for row in rows
+    ]
+
+
+def rolled_up_until():
+    """
+    すべてのシャードで集計が済んでいる時刻（一度も集計していなければNone）
+    """
+    watermarks = list(
+        RollupWatermark.objects.filter(database__in=shards()).values_list(
+            "threads_until", flat=True
+        )
+    )
+    if len(watermarks) < len(shards()) or None in watermarks:
+        return None
+    return min(watermarks)
@@ -0,0 +1,172 @@
+import threading
+
+from rag_sample_django.config import get_config
+
+from .admission import get_limiter
+
+# 移動平均の重み（新しい観測値の比率）
+EWMA_ALPHA = 0.2
+# エラー率1.0のデプロイメントはレイテンシを11倍として扱う
+ERROR_PENALTY = 10
+# 残り枠が少ないデプロイメントほどスコアを悪くする（0除算を避ける下限）
+MIN_REMAINING_RATIO = 0.05
+
+
+def build_http_client(limiter):
+    """
+    レスポンスのx-ratelimit-*ヘッダをリミッターに反映するHTTPクライアント
+    """
+    import openai
+
+    return openai.DefaultHttpxClient(
+        event_hooks={"response": [limiter.observe_response]}
+    )
+
+
+class Deployment:
+    """
+    Azure OpenAIのデプロイメント１つ分の接続情報と観測値
+    """
+
+    def __init__(
+        self,
+        name,
+        resource_name=None,
+        deployment_name=None,
+        api_key=None,
+        api_version=None,
+        model=None,
+        region=None,
+        client=None,
+    ):
+        self.name = name
+        self.resource_name = resource_name
+        self.deployment_name = deployment_name
+        self.api_key = api_key
+        self.api_version = api_version
+        self.model = model
+        self.region = region
+        self.limiter = get_limiter(name)
+        self.latency = None
+        self.error_rate = 0.0
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import openai
+
+                # フェイルオーバーするので、クライアント側ではリトライしない
+                self._client = openai.AzureOpenAI(
+                    azure_endpoint=f"https://{self.resource_name}.openai.azure.com",
+                    azure_deployment=self.deployment_name,
+                    api_key=self.api_key,
+                    api_version=self.api_version,
+                    max_retries=0,
+                    http_client=build_http_client(self.limiter),
+                )
+            return self._client
+
+    def record_success(self, latency):
+        with self._lock:
+            self.latency = (
+                latency
+                if self.latency is None
+                else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+            )
+            self.error_rate = (1 - EWMA_ALPHA) * self.error_rate
+
+    def record_error(self):
+        with self._lock:
+            self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+
+    def score(self):
+        """
+        小さいほど優先する。未計測のデプロイメントはレイテンシ0として先に試す
+        """
+        with self._lock:
+            latency = self.latency or 0.0
+            error_rate = self.error_rate
+        remaining = max(self.limiter.remaining_ratio(), MIN_REMAINING_RATIO)
+        return (latency + 0.001) * (1 + ERROR_PENALTY * error_rate) / remaining
+
+
+class DeploymentRouter:
+    def __init__(self, deployments):
+        self.deployments = list(deployments)
+
+    def candidates(self):
+        """
+        試す順番に並べたデプロイメント（429で止まっているものは最後に回す）
+        """
+        return sorted(
+            self.deployments,
+            key=lambda deployment: (
+                deployment.limiter.blocked_for() > 0,
+                deployment.score(),
+            ),
+        )
+
+
+def configure_default_client(config, limiter):
+    """
+    OPENAI_*の環境変数でopenaiモジュールのクライアントを設定する
+    """
+    import openai
+
+    openai.api_type = "azure"
+    openai.api_version = config.openai_api_version
+    openai.api_key = config.openai_api_key
+    openai.azure_endpoint = f"https://{config.openai_resource_name}.openai.azure.com/openai/deployments/{config.openai_deployment_name}/chat/completions?api-version={config.openai_api_version}"
+    # レート制限ヘッダをリミッターに反映する
+    openai.http_client = build_http_client(limiter)
+
+
+def load_deployments():
+    """
+    OPENAI_DEPLOYMENTS（JSON配列）のデプロイメントの一覧を作成する。
+    未設定の場合はOPENAI_*の環境変数で設定したopenaiモジュールを使う
+    """
+    config = get_config()
+    if not config.openai_deployments:
+        import openai
+
+        deployment = Deployment(
+            config.openai_deployment_name or "default",
+            model=config.openai_model,
+            client=openai,
+        )
+        configure_default_client(config, deployment.limiter)
+        return [deployment]
+
+    deployments = []
+    for entry in config.openai_deployments:
+        deployments.append(
+            Deployment(
+                entry["name"],
+                resource_name=entry["resource"],
+                deployment_name=entry["deployment"],
+                api_key=entry.get("api_key", config.openai_api_key),
+                api_version=entry.get("api_version", config.openai_api_version),
+                model=entry.get("model", config.openai_model),
+                region=entry.get("region"),
+            )
+        )
+    return deployments
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    デプロイメントの一覧は初回の呼び出し時に作成する
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = DeploymentRouter(load_deployments())
+        return _router
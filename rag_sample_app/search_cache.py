@@ -0,0 +1,98 @@
+"""
+検索結果のキャッシュ。正規化した検索語と検索のパラメータをキーに、件数の上限（LRU）と
+有効期限の範囲でプロセス内に保持する。
+ドキュメントが追加・変更されたら、その企業（テナント）のインデックスのバージョンを上げて、
+古いエントリをまとめて無効にする
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rag_sample_django.config import get_config
+
+from .models import Document
+
+# インデックスのバージョンはワーカー間で共有するキャッシュに置く
+INDEX_VERSION_CACHE_ALIAS = "retrieval"
+
+
+def index_version_key(company_id=None):
+    # 企業に属さない共通のドキュメントは"shared"
+    return f"retrieval:index-version:{company_id or 'shared'}"
+
+
+def index_version(company_id=None):
+    return caches[INDEX_VERSION_CACHE_ALIAS].get(index_version_key(company_id), 0)
+
+
+def bump_index_version(company_id=None):
+    """
+    企業のインデックスのバージョンを上げて、それまでの検索結果をすべて無効にする
+    """
+    cache = caches[INDEX_VERSION_CACHE_ALIAS]
+    key = index_version_key(company_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # まだバージョンがない場合（別のワーカーが先に作成した場合はそちらを上げる）
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+class LRUCache:
+    """
+    件数の上限と有効期限のあるスレッドセーフなキャッシュ。
+    上限を超えたら最も長く使われていないエントリから捨てる
+    """
+
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+search_cache = LRUCache(
+    get_config().search_cache_size, get_config().search_cache_ttl_seconds
+)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_on_document_change(sender, instance, **kwargs):
+    bump_index_version(instance.company_id)
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework import serializers
 
 from .models import ChatHistory, Document
@@ -16,6 +17,34 @@ class ChatHistorySerializer(serializers.ModelSerializer):
         fields = ["id", "thread_id", "message", "sender", "timestamp"]
 
 
+_datetime_field = serializers.DateTimeField()
+
+
+def chat_history_rows(rows):
+    """
+    .values()で取得した行をChatHistorySerializerと同じ形式にする（読み込み専用の軽量版）
+    """
+    current_timezone = timezone.get_current_timezone()
+
+    def format_timestamp(value):
+        # DateTimeField.to_representationと同じ結果を、タイムゾーンの取得を１回にして作る
+        if value.tzinfo is None:
+            return _datetime_field.to_representation(value)
+        value = value.astimezone(current_timezone).isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return [
+        {
+            "id": row["id"],
+            "thread_id": row["thread_id"],
+            "message": row["message"],
+            "sender": row["sender"],
+            "timestamp": format_timestamp(row["timestamp"]),
+        }
+        for row in rows
+    ]
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
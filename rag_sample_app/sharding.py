@@ -0,0 +1,240 @@
+"""
+スレッドとチャット履歴（アーカイブを含む）の水平分割。
+ユーザー（スレッドの作成者）ごとに DATABASE_SHARDS のどれか１つのデータベースに置く。
+置き先はRendezvous hashingで決めるので、データベースを追加しても移動するのは
+新しいデータベースに割り当てられるユーザーだけになる。
+リクエストの処理中はjwt_requiredが認証したユーザーのシャードを有効にし、ルーターがそのシャードを使う
+"""
+
+import contextvars
+import hashlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+
+from .models import ChatHistory, Thread, ThreadArchive
+
+SHARDED_MODELS = {"thread", "chathistory", "threadarchive"}
+
+_active_shard = contextvars.ContextVar("active_shard", default=None)
+
+
+def shards():
+    return list(getattr(settings, "DATABASE_SHARDS", None) or [DEFAULT_DB_ALIAS])
+
+
+def _weight(alias, user_id):
+    digest = hashlib.blake2b(f"{alias}:{user_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_for(user):
+    """
+    ユーザー（またはユーザーID）のデータを置くデータベースのエイリアス
+    """
+    user_id = getattr(user, "pk", user)
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    return max(aliases, key=lambda alias: _weight(alias, user_id))
+
+
+def active_shard():
+    return _active_shard.get()
+
+
+def activate_shard(alias):
+    """
+    現在のコンテキスト（WebSocketの接続など）でシャードを有効にする
+    """
+    _active_shard.set(alias)
+
+
+@contextmanager
+def use_shard(alias):
+    token = _active_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _active_shard.reset(token)
+
+
+def is_sharded(model):
+    meta = model._meta
+    return meta.app_label == "rag_sample_app" and meta.model_name in SHARDED_MODELS
+
+
+class ShardRouter:
+    """
+    分割したモデルは、関連元のインスタンスのデータベース、有効なシャードの順に決める。
+    それ以外のモデル（ユーザー・使用量・ドキュメントなど）はすべてdefaultに置く
+    """
+
+    def _route(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None:
+            if is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            if isinstance(instance, User):
+                return shard_for(instance)
+        return active_shard()
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 分割したモデル同士は同じシャードの場合だけ関連付けられる
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # テーブルはすべてのデータベースに作る（シャードを増やしたら migrate --database で作成する）
+        return None
+
+
+class ShardMoveError(Exception):
+    """
+    移動先に書き込んだ行が移動元と一致しない（移動元は削除しない）
+    """
+
+
+def _copy_rows(model, objs, using, ignore_conflicts=False):
+    """
+    自動で設定される日時を上書きしないように、取得した値のままINSERTする。
+    ignore_conflictsを指定すると、移動先に既にある行は無視する
+    """
+    if not objs:
+        return
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    columns = ", ".join(quote(field.column) for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    insert = connection.ops.insert_statement(
+        on_conflict=OnConflict.IGNORE if ignore_conflicts else None
+    )
+    rows = [
+        [
+            field.get_db_prep_save(getattr(obj, field.attname), connection)
+            for field in fields
+        ]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"{insert} {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})",
+            rows,
+        )
+
+
+def _copy_chats(batch, target):
+    """
+    チャット履歴をIDを変えずに移動先に書き込む。
+    中断した移動をやり直せるように、同じスレッドの同じIDの行は書き込み済みとして扱い、
+    別のスレッドの行とIDが重なる場合はエラーにする
+    """
+    ids = [chat.pk for chat in batch]
+    existing = dict(
+        ChatHistory.objects.using(target)
+        .filter(pk__in=ids)
+        .values_list("pk", "thread_id")
+    )
+    conflicts = [
+        chat.pk
+        for chat in batch
+        if chat.pk in existing and existing[chat.pk] != chat.thread_id_id
+    ]
+    if conflicts:
+        raise ShardMoveError(
+            f"chat id(s) {conflicts[:10]} already exist on {target} in another thread"
+        )
+    _copy_rows(ChatHistory, [chat for chat in batch if chat.pk not in existing], target)
+    thread_ids = {chat.thread_id_id for chat in batch}
+    copied = (
+        ChatHistory.objects.using(target)
+        .filter(pk__in=ids, thread_id__in=thread_ids)
+        .count()
+    )
+    if copied != len(batch):
+        raise ShardMoveError(f"copied {copied} of {len(batch)} chat(s) to {target}")
+
+
+def move_user(user_id, source, target, batch_size):
+    """
+    ユーザーのスレッド・チャット履歴・アーカイブをsourceからtargetに移す。
+    移動先に書き込んで、すべての行が揃っていることを確認してから移動元を削除するので、
+    途中で失敗しても履歴は失われない（ShardMoveErrorの場合は移動先への書き込みも取り消す）。
+    利用状況の集計（rollup）で移動した行を二重に数えないように、両方のシャードの集計位置を順にロックする。
+    チャット履歴はIDを変えずに移すので、シャード間でIDが重ならないようにしておく必要がある
+    """
+    from .purge import delete_chats
+    from .rollup import correct_moved_activity, locked_watermark
+
+    threads = list(Thread.all_objects.using(source).filter(creator_id=user_id))
+    thread_ids = [thread.pk for thread in threads]
+    archives = ThreadArchive.objects.using(source).filter(thread_id__in=thread_ids)
+    chats = ChatHistory.objects.using(source).filter(thread_id__in=thread_ids)
+
+    # 移動先の集計位置をロックしたまま書き込み、その位置より後の行が移動先で集計されるようにする
+    with locked_watermark(target) as target_mark:
+        with transaction.atomic(using=target):
+            _copy_rows(Thread, threads, target, ignore_conflicts=True)
+            copied = (
+                Thread.all_objects.using(target)
+                .filter(pk__in=thread_ids, creator_id=user_id)
+                .count()
+            )
+            if copied != len(threads):
+                raise ShardMoveError(
+                    f"copied {copied} of {len(threads)} thread(s) to {target}"
+                )
+            archive_rows = list(archives)
+            _copy_rows(ThreadArchive, archive_rows, target, ignore_conflicts=True)
+            copied = (
+                ThreadArchive.objects.using(target)
+                .filter(thread_id__in=thread_ids)
+                .count()
+            )
+            if copied != len(archive_rows):
+                raise ShardMoveError(
+                    f"copied {copied} of {len(archive_rows)} archive(s) to {target}"
+                )
+            last_id = 0
+            while True:
+                batch = list(chats.filter(pk__gt=last_id).order_by("pk")[:batch_size])
+                if not batch:
+                    break
+                _copy_chats(batch, target)
+                last_id = batch[-1].pk
+
+    # 移動元の集計位置をロックしたまま削除し、移動元で集計済みの行と移動先で集計する行の重なりを補正する
+    with locked_watermark(source) as source_mark:
+        moved = delete_chats(chats, batch_size)
+        with transaction.atomic(using=source):
+            archives.delete()
+            Thread.all_objects.using(source).filter(pk__in=thread_ids).delete()
+        correct_moved_activity(target, thread_ids, source_mark, target_mark)
+    return len(threads), moved
+
+
+def misplaced_users(alias):
+    """
+    aliasにデータがあるが、現在のシャードの構成では別のデータベースに割り当てられるユーザー
+    """
+    user_ids = (
+        Thread.all_objects.using(alias)
+        .order_by()
+        .values_list("creator_id", flat=True)
+        .distinct()
+    )
+    return [
+        (user_id, shard_for(user_id))
+        for user_id in user_ids
+        if shard_for(user_id) != alias
+    ]
@@ -0,0 +1,114 @@
+from collections import deque
+
+from django.test import SimpleTestCase
+
+from rag_sample_app.admission import (
+    AdmissionRejected,
+    DeploymentLimiter,
+    _Ticket,
+    estimate_tokens,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class EstimateTokensTest(SimpleTestCase):
+    def test_estimate_tokens(self):
+        """ASCIIは4文字で1トークン、日本語は1文字1トークンで概算されることを確認するテスト"""
+        messages = [
+            {"role": "user", "content": "abcdefgh"},
+            {"role": "user", "content": "面接"},
+        ]
+        self.assertEqual(estimate_tokens(messages, completion_tokens=0), 4 + 2 + 4 + 2)
+
+
+class DeploymentLimiterTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = DeploymentLimiter(
+            "test",
+            tokens_per_minute=600,
+            requests_per_minute=60,
+            max_wait=0,
+            clock=self.clock,
+        )
+
+    def test_acquire_within_capacity(self):
+        self.assertEqual(self.limiter.acquire("user", 100), 100)
+        self.assertEqual(self.limiter.tokens.level, 500)
+
+    def test_reject_when_exhausted(self):
+        """枠が空くまでの待ち時間が上限を超える場合、待たずに拒否されることを確認するテスト"""
+        self.limiter.acquire("user", 600)
+        with self.assertRaises(AdmissionRejected) as cm:
+            self.limiter.acquire("user", 100)
+        # 600TPMは1秒あたり10トークンの補充なので、100トークンには10秒かかる
+        self.assertEqual(cm.exception.retry_after, 10)
+
+    def test_refill(self):
+        self.limiter.acquire("user", 600)
+        self.clock.now = 10
+        self.assertEqual(self.limiter.acquire("user", 100), 100)
+
+    def test_settle_refunds_unused_tokens(self):
+        reserved = self.limiter.acquire("user", 500)
+        self.limiter.settle(reserved, 100)
+        self.assertEqual(self.limiter.tokens.level, 500)
+
+    def test_observe_rate_limit_headers(self):
+        """x-ratelimit-*ヘッダで上限と残り枠が更新されることを確認するテスト"""
+        self.limiter.observe(
+            200,
+            {
+                "x-ratelimit-limit-tokens": "1200",
+                "x-ratelimit-remaining-tokens": "50",
+                "x-ratelimit-remaining-requests": "3",
+            },
+        )
+        self.assertEqual(self.limiter.tokens.capacity, 1200)
+        self.assertEqual(self.limiter.tokens.level, 50)
+        self.assertEqual(self.limiter.requests.level, 3)
+
+    def test_quota_is_divided_between_processes(self):
+        """プロセスの数で上限とヘッダの値を等分することを確認するテスト"""
+        limiter = DeploymentLimiter(
+            "test",
+            tokens_per_minute=600,
+            requests_per_minute=60,
+            max_wait=0,
+            processes=3,
+            clock=self.clock,
+        )
+        self.assertEqual(limiter.tokens.capacity, 200)
+        self.assertEqual(limiter.requests.capacity, 20)
+        limiter.observe(
+            200,
+            {"x-ratelimit-limit-tokens": "1200", "x-ratelimit-remaining-tokens": "300"},
+        )
+        self.assertEqual(limiter.tokens.capacity, 400)
+        self.assertEqual(limiter.tokens.level, 100)
+
+    def test_observe_429_blocks_deployment(self):
+        self.limiter.observe(429, {"retry-after-ms": "3000"})
+        self.assertEqual(self.limiter.blocked_for(), 3)
+        with self.assertRaises(AdmissionRejected) as cm:
+            self.limiter.acquire("user", 1)
+        self.assertEqual(cm.exception.retry_after, 3)
+
+    def test_round_robin_between_users(self):
+        """処理したユーザーは最後尾に回り、ユーザー間で順番に処理されることを確認するテスト"""
+        tickets = [_Ticket("a", 1), _Ticket("a", 1), _Ticket("b", 1)]
+        for ticket in tickets:
+            self.limiter._queues.setdefault(ticket.user_key, deque()).append(ticket)
+
+        self.assertIs(self.limiter._next_ticket(), tickets[0])
+        self.limiter._remove(tickets[0])
+        self.assertIs(self.limiter._next_ticket(), tickets[2])
+        self.limiter._remove(tickets[2])
+        self.assertIs(self.limiter._next_ticket(), tickets[1])
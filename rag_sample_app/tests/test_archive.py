@@ -0,0 +1,127 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from rag_sample_app.archive import archive_idle_threads, archive_thread, chat_history
+from rag_sample_app.models import ChatHistory, Thread, ThreadArchive, TurnUsage
+
+
+def create_chats(thread, *messages, days_ago=0):
+    chats = []
+    for i, message in enumerate(messages):
+        chat = ChatHistory.objects.create(
+            thread_id=thread, message=message, sender="USER" if i % 2 == 0 else "AI"
+        )
+        chats.append(chat)
+    ChatHistory.objects.filter(pk__in=[chat.pk for chat in chats]).update(
+        timestamp=timezone.now() - datetime.timedelta(days=days_ago)
+    )
+    return chats
+
+
+# シャードを追加した設定でも、defaultだけを使う構成としてテストする
+@override_settings(DATABASE_SHARDS=["default"])
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(creator=self.user)
+
+    def test_archive_thread(self):
+        """チャット履歴が圧縮されてホットテーブルから削除されることを確認するテスト"""
+        chats = create_chats(self.thread, "自己紹介します", "ありがとうございます")
+        TurnUsage.objects.create(
+            creator=self.user, thread=self.thread, chat=chats[1], total_tokens=10
+        )
+
+        self.assertEqual(archive_thread(self.thread, batch_size=1), 2)
+
+        self.assertFalse(ChatHistory.objects.exists())
+        archive = ThreadArchive.objects.get(thread=self.thread)
+        self.assertEqual(archive.message_count, 2)
+        self.assertEqual(archive.last_chat_id, chats[1].id)
+        self.assertEqual(TurnUsage.objects.get().thread, self.thread)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, "自己紹介します")
+
+    def test_chat_history_merges_archive(self):
+        """アーカイブ後に追加された履歴と合わせて古い順に読めることを確認するテスト"""
+        old = create_chats(self.thread, "1", "2", days_ago=1)
+        archive_thread(self.thread)
+        new = create_chats(self.thread, "3", "4")
+
+        chats = chat_history(self.thread)
+
+        self.assertEqual([chat.message for chat in chats], ["1", "2", "3", "4"])
+        self.assertEqual([chat.id for chat in chats], [c.id for c in old + new])
+        self.assertLess(
+            chats[0].timestamp, chats[2].timestamp - datetime.timedelta(hours=12)
+        )
+
+        # 再アーカイブすると１つのアーカイブにまとめられる
+        archive_thread(self.thread)
+        self.assertEqual(ThreadArchive.objects.get().message_count, 4)
+        self.assertEqual(
+            [chat.message for chat in chat_history(self.thread)], ["1", "2", "3", "4"]
+        )
+
+    def test_rows_left_after_archive_are_ignored(self):
+        """削除前に残ったアーカイブ済みの行は二重に読まれないことを確認するテスト"""
+        chats = create_chats(self.thread, "1", "2")
+        archive_thread(self.thread)
+        ChatHistory.objects.bulk_create(chats)
+
+        self.assertEqual(
+            [chat.message for chat in chat_history(self.thread)], ["1", "2"]
+        )
+
+    def test_archive_idle_threads(self):
+        """最後のチャットから指定日数が経ったスレッドだけをアーカイブするテスト"""
+        create_chats(self.thread, "old", days_ago=100)
+        active = Thread.objects.create(creator=self.user)
+        create_chats(active, "old", days_ago=100)
+        create_chats(active, "new", days_ago=1)
+
+        self.assertEqual(archive_idle_threads(days=90), (1, 1))
+        self.assertEqual(
+            list(ThreadArchive.objects.values_list("thread", flat=True)),
+            [self.thread.id],
+        )
+        self.assertEqual(ChatHistory.objects.filter(thread_id=active).count(), 2)
+
+    def test_archive_threads_command(self):
+        """archive_threadsコマンドでアーカイブされることを確認するテスト"""
+        create_chats(self.thread, "old", days_ago=10)
+        out = StringIO()
+        call_command("archive_threads", "--days", "7", stdout=out)
+        self.assertIn("archived 1 thread(s), 1 chat(s)", out.getvalue())
+
+
+class ArchivedThreadViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.client.force_authenticate(user=self.user)
+        self.thread = Thread.objects.create(creator=self.user)
+        create_chats(self.thread, "Hello", "Hi", days_ago=100)
+        archive_thread(self.thread)
+
+    def test_chat_history_list(self):
+        """アーカイブ済みのスレッドの履歴がChatHistoryListで読めることを確認するテスト"""
+        response = self.client.get(
+            reverse("chat-history-list"), {"thread_id": self.thread.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([chat["message"] for chat in response.data], ["Hello", "Hi"])
+        self.assertEqual(response.data[0]["thread_id"], self.thread.id)
+
+    def test_all_threads(self):
+        """アーカイブ済みのスレッドがAllThreadsに要約付きで表示されることを確認するテスト"""
+        response = self.client.get(reverse("all-threads"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["threads"][0]["summary"], "Hello")
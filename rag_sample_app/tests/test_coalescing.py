@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from rag_sample_app.coalescing import (
+    SingleFlight,
+    coalescing_key,
+    normalize_search_word,
+)
+
+
+class NormalizeSearchWordTest(SimpleTestCase):
+    def test_normalize(self):
+        """全角英数字・前後や連続する空白が正規化されることを確認するテスト"""
+        self.assertEqual(
+            normalize_search_word("　ＡＢＣ   です \n"),
+            normalize_search_word("ABC です"),
+        )
+
+    def test_coalescing_key(self):
+        self.assertEqual(coalescing_key("a", 1), coalescing_key("a", 1))
+        self.assertNotEqual(coalescing_key("a", 1), coalescing_key("a1"))
+
+
+class SingleFlightTest(SimpleTestCase):
+    def test_concurrent_calls_share_result(self):
+        """同じキーの同時呼び出しは１回だけ実行され、結果が共有されることを確認するテスト"""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+
+        def worker():
+            results.append(flight.do("key", slow))
+
+        leader = threading.Thread(target=worker)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=worker) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        # 後続の呼び出しがすべて待機状態になってから先行の処理を完了させる
+        while flight._calls["key"].waiters < len(followers):
+            time.sleep(0.001)
+        release.set()
+        leader.join(5)
+        for follower in followers:
+            follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result == "result" for result, _ in results))
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_error_is_shared_and_key_released(self):
+        """例外が発生した場合もキーが解放され、次の呼び出しが実行されることを確認するテスト"""
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            flight.do("key", fail)
+        self.assertEqual(flight.do("key", lambda: "ok"), ("ok", False))
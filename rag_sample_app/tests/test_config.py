@@ -0,0 +1,95 @@
+import json
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from rag_sample_django.config import AppConfig, load_environment
+
+
+class EnvironmentTest(SimpleTestCase):
+    # 環境変数のテスト
+    @patch("os.getenv")
+    @patch("rag_sample_django.config.load_dotenv")
+    def test_load_production_env(self, mock_load_dotenv, mock_getenv):
+        # ENVが"production"であることをシミュレート
+        mock_getenv.return_value = "production"
+
+        # テスト対象のコードを実行
+        load_environment()
+
+        # 正しいファイルが読み込まれたか確認
+        mock_load_dotenv.assert_called_once_with(".env.production")
+
+    @patch("os.getenv")
+    @patch("rag_sample_django.config.load_dotenv")
+    def test_load_development_env(self, mock_load_dotenv, mock_getenv):
+        # ENVが設定されていない（デフォルトは "development"）
+        mock_getenv.return_value = None
+
+        # テスト対象のコードを実行
+        load_environment()
+
+        # 正しいファイルが読み込まれたか確認
+        mock_load_dotenv.assert_called_once_with(".env.development")
+
+    @patch("os.getenv")
+    @patch("rag_sample_django.config.load_dotenv")
+    def test_load_staging_env(self, mock_load_dotenv, mock_getenv):
+        # ENVが"staging"であることをシミュレート
+        mock_getenv.return_value = "staging"
+
+        # テスト対象のコードを実行
+        load_environment()
+
+        # 正しいファイルが読み込まれたか確認
+        mock_load_dotenv.assert_called_once_with(".env.development")
+
+
+class AppConfigTest(SimpleTestCase):
+    def test_from_env(self):
+        """環境変数の値が型に合わせて変換されることを確認するテスト"""
+        config = AppConfig.from_env(
+            {
+                "API_KEY": "search-key",
+                "INDEX": "interviews",
+                "OPENAI_MODEL": "gpt-4o-mini",
+                "OPENAI_TOKENS_PER_MINUTE": "1000",
+                "REQUEST_DEADLINE_SECONDS": "12.5",
+                "COGNITO_USER_POOL_ID": "pool",
+                "COGNITO_CLIENT_ID": "client",
+            }
+        )
+        self.assertEqual(config.search_api_key, "search-key")
+        self.assertEqual(config.search_index, "interviews")
+        self.assertEqual(config.openai_model, "gpt-4o-mini")
+        self.assertEqual(config.openai_tokens_per_minute, 1000)
+        self.assertEqual(config.request_deadline_seconds, 12.5)
+        self.assertEqual(config.cognito_client_id, "client")
+        self.assertEqual(
+            config.cognito_jwks_url,
+            "https://cognito-idp.ap-northeast-1.amazonaws.com/pool/.well-known/jwks.json",
+        )
+
+    def test_missing_values_use_defaults(self):
+        """未設定の環境変数があっても作成できることを確認するテスト"""
+        config = AppConfig.from_env({"OPENAI_REQUESTS_PER_MINUTE": ""})
+        self.assertIsNone(config.cognito_user_pool_id)
+        self.assertEqual(config.openai_requests_per_minute, 180)
+
+    def test_deployment_api_key_is_resolved(self):
+        """api_key_envで指定した環境変数のAPIキーが読み込まれることを確認するテスト"""
+        deployments = json.dumps(
+            [{"name": "eastus", "resource": "r", "api_key_env": "EASTUS_KEY"}]
+        )
+        config = AppConfig.from_env(
+            {"OPENAI_DEPLOYMENTS": deployments, "EASTUS_KEY": "key"}
+        )
+        self.assertEqual(
+            config.openai_deployments,
+            ({"name": "eastus", "resource": "r", "api_key": "key"},),
+        )
+
+        # APIキーが未設定の場合は、起動時の設定の読み込みで失敗する
+        with self.assertRaises(ImproperlyConfigured):
+            AppConfig.from_env({"OPENAI_DEPLOYMENTS": deployments})
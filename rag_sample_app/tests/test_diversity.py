@@ -0,0 +1,53 @@
+from io import StringIO
+
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from rag_sample_app.diversity import mmr_select, select_documents
+from rag_sample_app.interview import DOCUMENT_MAX_LENGTH, build_prompt
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class MMRTest(SimpleTestCase):
+    def test_near_duplicates_are_skipped(self):
+        """関連度が高くても、選択済みとほぼ同じ候補より別の内容を優先することを確認するテスト"""
+        query = unit(1, 1, 0)
+        embeddings = np.stack([unit(1, 0.9, 0), unit(1, 0.89, 0), unit(0.2, 1, 0.3)])
+
+        self.assertEqual(mmr_select(query, embeddings, 2, 0.5), [0, 2])
+        # 関連度だけで選ぶ場合は重複した候補も選ぶ
+        self.assertEqual(mmr_select(query, embeddings, 2, 1.0), [0, 1])
+
+    def test_first_and_bounds(self):
+        query = unit(1, 0)
+        embeddings = np.stack([unit(0, 1), unit(1, 0)])
+        self.assertEqual(mmr_select(query, embeddings, 5, 0.7, first=0), [0, 1])
+        self.assertEqual(mmr_select(query, embeddings[:0], 3, 0.7), [])
+
+    def test_select_documents(self):
+        """検索の１位はそのまま使い、同じ内容のドキュメントを後回しにすることを確認するテスト"""
+        documents = [
+            {"content": "営業の経験があります"},
+            {"content": "営業の経験があります。"},
+            {"content": "開発チームのリーダーでした"},
+        ]
+        selected = select_documents("営業と開発の経験", documents, k=2, lambda_=0.5)
+        self.assertEqual(selected, [documents[0], documents[2]])
+        self.assertEqual(select_documents("営業", documents, k=1), documents[:1])
+
+    def test_build_prompt_fills_budget(self):
+        """選んだドキュメントを合計の文字数の上限まで入れることを確認するテスト"""
+        documents = [{"content": "あ" * 1500}, {"content": "い" * 1500}]
+        prompt = build_prompt("質問", documents)
+        self.assertIn("あ" * 1500 + "\n" + "い" * (DOCUMENT_MAX_LENGTH - 1500), prompt)
+        self.assertNotIn("い" * (DOCUMENT_MAX_LENGTH - 1499), prompt)
+
+    def test_benchmark_mmr_command(self):
+        out = StringIO()
+        call_command("benchmark_mmr", "--candidates", "20", "--repeat", "2", stdout=out)
+        self.assertIn("20 candidates: select median", out.getvalue())
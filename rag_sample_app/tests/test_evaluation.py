@@ -0,0 +1,183 @@
+import json
+import threading
+from dataclasses import replace
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rag_sample_app.admission import AdmissionRejected
+from rag_sample_app.evaluation import (
+    EvaluationError,
+    evaluate_thread,
+    get_or_create_evaluation,
+    parse_scores,
+    reduce_results,
+)
+from rag_sample_app.models import ChatHistory, Thread, TurnUsage
+
+SCORES = {"logic": 4, "specificity": 3, "communication": 5, "motivation": 2}
+
+
+def completion(content, total_tokens=10):
+    return SimpleNamespace(
+        model="gpt-4o",
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=total_tokens, completion_tokens=0, total_tokens=total_tokens
+        ),
+    )
+
+
+def evaluation(scores=SCORES, strengths=("具体的",), weaknesses=("冗長",)):
+    return completion(
+        json.dumps(
+            {
+                "scores": scores,
+                "strengths": list(strengths),
+                "weaknesses": list(weaknesses),
+            },
+            ensure_ascii=False,
+        )
+    )
+
+
+class ParseScoresTest(SimpleTestCase):
+    def test_parse_scores(self):
+        """前後の文章を除いてJSONを読み、点数を範囲内の整数にそろえることを確認するテスト"""
+        content = '評価です。{"scores": {"logic": 4.6, "specificity": 9, "motivation": "高い"}, "strengths": ["論理的"]}'
+        self.assertEqual(
+            parse_scores(content),
+            {
+                "scores": {"logic": 5, "specificity": 5},
+                "strengths": ["論理的"],
+                "weaknesses": [],
+            },
+        )
+
+    def test_invalid_json(self):
+        with self.assertRaises(EvaluationError):
+            parse_scores("採点できません")
+        with self.assertRaises(EvaluationError):
+            parse_scores('{"logic": 3}')
+
+    def test_reduce_results(self):
+        """チャンクの行数で重み付けして平均し、失敗したチャンクを除くことを確認するテスト"""
+        results = [
+            {"scores": {"logic": 5}, "strengths": ["a", "b"], "weaknesses": []},
+            {"scores": {"logic": 2}, "strengths": ["b"], "weaknesses": ["c"]},
+            None,
+        ]
+        report = reduce_results(results, [3, 1, 4])
+        self.assertEqual(report["scores"], {"logic": 4.2})
+        self.assertEqual(report["overall"], 4.2)
+        self.assertEqual(report["strengths"], ["a", "b"])
+        self.assertEqual(report["weaknesses"], ["c"])
+        self.assertEqual(report["failed_chunks"], 1)
+        self.assertEqual([chunk["messages"] for chunk in report["chunks"]], [3, 1, 4])
+
+
+@override_settings(
+    APP_CONFIG=replace(
+        settings.APP_CONFIG, evaluation_chunk_size=4, evaluation_concurrency=3
+    )
+)
+class EvaluateThreadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(
+            creator=self.user, first_message="自己紹介をどうぞ"
+        )
+        # 初回メッセージと合わせて12行、４行ずつ３チャンクになる
+        for i in range(11):
+            ChatHistory.objects.create(
+                thread_id=self.thread,
+                message=f"発言{i}",
+                sender="USER" if i % 2 == 0 else "AI",
+            )
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_chunks_are_scored_concurrently(self, mock_completion):
+        """すべてのチャンクが同時に採点され、使用量が記録されることを確認するテスト"""
+        # ３チャンクが同時に実行されていないと、Barrierで待ち続けてタイムアウトする
+        barrier = threading.Barrier(3, timeout=5)
+        transcripts = []
+
+        def score(model, messages, user_key=None, deadline=None):
+            transcripts.append(messages[1]["content"])
+            barrier.wait()
+            return evaluation()
+
+        mock_completion.side_effect = score
+        report = evaluate_thread(self.thread, self.user)
+
+        self.assertEqual(len(transcripts), 3)
+        self.assertIn(
+            "面接官: 自己紹介をどうぞ\n応募者: 発言0\n面接官: 発言1\n応募者: 発言2",
+            transcripts,
+        )
+        self.assertEqual(report["scores"], {key: float(v) for key, v in SCORES.items()})
+        self.assertEqual(report["overall"], 3.5)
+        self.assertEqual(report["message_count"], 12)
+        self.assertEqual(report["strengths"], ["具体的"])
+        self.assertEqual(TurnUsage.objects.filter(thread=self.thread).count(), 3)
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_failed_chunk_records_usage_and_raises(self, mock_completion):
+        """１チャンクが失敗した場合も、ほかのチャンクの使用量を記録してから送出するテスト"""
+        mock_completion.side_effect = [evaluation(), AdmissionRejected(3), evaluation()]
+
+        with self.assertRaises(AdmissionRejected):
+            evaluate_thread(self.thread, self.user)
+        self.assertEqual(TurnUsage.objects.count(), 2)
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_report_is_cached_until_history_changes(self, mock_completion):
+        """履歴が変わるまでは保存したレポートを返すことを確認するテスト"""
+        mock_completion.return_value = evaluation()
+
+        report, created = get_or_create_evaluation(self.thread, self.user)
+        self.assertTrue(created)
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual(thread.evaluation, report)
+        self.assertEqual(thread.updated_at, self.thread.updated_at)
+
+        self.assertEqual(get_or_create_evaluation(thread, self.user), (report, False))
+        self.assertEqual(mock_completion.call_count, 3)
+
+        ChatHistory.objects.create(thread_id=thread, message="追加", sender="USER")
+        _, created = get_or_create_evaluation(thread, self.user)
+        self.assertTrue(created)
+        # 13行になったので４チャンクを採点し直す
+        self.assertEqual(mock_completion.call_count, 7)
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_all_chunks_unparseable(self, mock_completion):
+        """すべてのチャンクの応答が読めない場合は、レポートを保存せずに送出するテスト"""
+        mock_completion.return_value = completion("採点できません")
+
+        with self.assertRaises(EvaluationError):
+            get_or_create_evaluation(self.thread, self.user)
+        self.assertIsNone(Thread.objects.get(pk=self.thread.pk).evaluation)
+        self.assertEqual(TurnUsage.objects.count(), 3)
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_partial_report_is_not_saved(self, mock_completion):
+        """一部のチャンクが読めなかったレポートは返すが、保存しないことを確認するテスト"""
+        mock_completion.side_effect = [
+            evaluation(),
+            completion("採点できません"),
+            evaluation(),
+        ]
+
+        report, created = get_or_create_evaluation(self.thread, self.user)
+        self.assertTrue(created)
+        self.assertEqual(report["failed_chunks"], 1)
+        self.assertIsNone(Thread.objects.get(pk=self.thread.pk).evaluation)
+
+    def test_empty_thread(self):
+        thread = Thread.objects.create(creator=self.user)
+        with self.assertRaises(EvaluationError):
+            evaluate_thread(thread, self.user)
@@ -0,0 +1,98 @@
+import uuid
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from rag_sample_app.fields import BinaryUUIDField, Sender, SenderField
+from rag_sample_app.models import ChatHistory, Thread
+from rag_sample_app.serializers import ChatHistorySerializer
+
+MYSQL = SimpleNamespace(vendor="mysql")
+
+
+class SenderFieldTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(creator=user)
+
+    def test_stored_as_integer(self):
+        """送信者が整数で保存され、文字列として読み込まれることを確認するテスト"""
+        chat = ChatHistory.objects.create(
+            thread_id=self.thread, message="Hi", sender="AI"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT sender FROM {ChatHistory._meta.db_table} WHERE id = %s",
+                [chat.id],
+            )
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+        chat = ChatHistory.objects.get(pk=chat.pk)
+        self.assertEqual(chat.sender, "AI")
+        self.assertEqual(ChatHistory.objects.filter(sender="AI").count(), 1)
+        self.assertEqual(ChatHistory.objects.exclude(sender="AI").count(), 0)
+
+    def test_serializer_exposes_strings(self):
+        """APIでは送信者を文字列で返し、不正な値は受け付けないことを確認するテスト"""
+        chat = ChatHistory.objects.create(
+            thread_id=self.thread, message="Hi", sender=Sender.USER
+        )
+        self.assertEqual(ChatHistorySerializer(chat).data["sender"], "USER")
+
+        serializer = ChatHistorySerializer(
+            data={"thread_id": self.thread.id, "message": "Hi", "sender": "BOT"}
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("sender", serializer.errors)
+
+    def test_invalid_sender(self):
+        with self.assertRaises(ValidationError):
+            SenderField().get_prep_value("BOT")
+
+
+class BinaryUUIDFieldTest(SimpleTestCase):
+    def test_mysql_uses_binary(self):
+        """MySQLではbinary(16)で保存することを確認するテスト"""
+        field = BinaryUUIDField()
+        value = uuid.uuid4()
+        self.assertEqual(field.db_type(MYSQL), "binary(16)")
+        self.assertEqual(field.rel_db_type(MYSQL), "binary(16)")
+        self.assertEqual(field.get_db_prep_value(value, MYSQL), value.bytes)
+        self.assertEqual(field.get_db_prep_value(str(value), MYSQL), value.bytes)
+        self.assertEqual(field.from_db_value(value.bytes, None, MYSQL), value)
+
+    def test_other_databases_use_uuid_column(self):
+        """MySQL以外ではUUIDFieldと同じ列になることを確認するテスト"""
+        field = BinaryUUIDField()
+        value = uuid.uuid4()
+        self.assertEqual(field.db_type(connection), connection.data_types["UUIDField"])
+        self.assertEqual(field.from_db_value(value.hex, None, connection), value)
+
+
+class CompactChatHistoryMigrationTest(TransactionTestCase):
+    migrate_from = [("rag_sample_app", "0012_threadarchive")]
+    migrate_to = [("rag_sample_app", "0013_compact_chathistory")]
+
+    def test_sender_is_converted(self):
+        """既存の送信者の文字列が整数に変換されることを確認するテスト"""
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        user = apps.get_model("auth", "User").objects.create(username="testuser")
+        thread = apps.get_model("rag_sample_app", "Thread").objects.create(
+            creator_id=user.pk
+        )
+        OldChatHistory = apps.get_model("rag_sample_app", "ChatHistory")
+        for sender in ("USER", "AI", "someone"):
+            OldChatHistory.objects.create(thread_id=thread, message="m", sender=sender)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+
+        senders = ChatHistory.objects.order_by("id").values_list("sender", flat=True)
+        self.assertEqual(list(senders), ["USER", "AI", "USER"])
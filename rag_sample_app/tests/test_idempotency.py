@@ -0,0 +1,50 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from rag_sample_app.idempotency import claim_record, find_record
+from rag_sample_app.models import IdempotencyRecord
+
+
+class IdempotencyRecordTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+
+    def age(self, record, **delta):
+        IdempotencyRecord.objects.filter(pk=record.pk).update(
+            created_at=timezone.now() - datetime.timedelta(**delta)
+        )
+
+    def test_claim_in_progress_record(self):
+        """処理中の記録は持ち時間を過ぎるまで引き継がれないテスト"""
+        record = claim_record(self.user, "key", "a")
+        self.assertIsNone(claim_record(self.user, "key", "a"))
+
+        self.age(record, minutes=5)
+        taken = claim_record(self.user, "key", "b")
+        self.assertEqual(taken.pk, record.pk)
+        self.assertEqual(taken.request_hash, "b")
+        self.assertIsNone(claim_record(self.user, "key", "b"))
+
+    def test_expired_records(self):
+        """期限切れの記録は参照時とコマンドで削除されるテスト"""
+        expired = IdempotencyRecord.objects.create(
+            creator=self.user, key="old", status_code=200, response={}
+        )
+        self.age(expired, days=2)
+        IdempotencyRecord.objects.create(creator=self.user, key="new", status_code=200)
+        other = IdempotencyRecord.objects.create(creator=self.user, key="other")
+        self.age(other, days=2)
+
+        self.assertIsNone(find_record(self.user, "old"))
+        self.assertIsNotNone(find_record(self.user, "new"))
+        out = StringIO()
+        call_command("prune_idempotency_records", stdout=out)
+        self.assertIn("pruned 1 idempotency record(s)", out.getvalue())
+        self.assertEqual(
+            list(IdempotencyRecord.objects.values_list("key", flat=True)), ["new"]
+        )
@@ -50,28 +50,28 @@ class ChatHistoryModelTest(TestCase):
         chat = ChatHistory.objects.create(
             thread_id=self.thread,
             message="Hello, this is a test message.",
-            sender="User1",
+            sender="USER",
         )
         self.assertEqual(chat.message, "Hello, this is a test message.")
-        self.assertEqual(chat.sender, "User1")
+        self.assertEqual(chat.sender, "USER")
 
     def test_timestamp_auto_now_add(self):
         chat = ChatHistory.objects.create(
-            thread_id=self.thread, message="Another message", sender="User2"
+            thread_id=self.thread, message="Another message", sender="AI"
         )
         self.assertIsNotNone(chat.timestamp)
         self.assertLessEqual(chat.timestamp, timezone.now())
 
     def test_foreign_key_relation_with_thread(self):
         chat = ChatHistory.objects.create(
-            thread_id=self.thread, message="Thread relation test", sender="User1"
+            thread_id=self.thread, message="Thread relation test", sender="USER"
         )
         self.assertEqual(chat.thread_id, self.thread)
 
     def test_str_method(self):
         message_text = "Hello, this is a test message."
         chat = ChatHistory.objects.create(
-            thread_id=self.thread, message=message_text, sender="User1"
+            thread_id=self.thread, message=message_text, sender="USER"
         )
         # 期待される__str__の出力
         expected_output = f"Thread {self.thread.id} - {message_text[:50]}"
@@ -0,0 +1,113 @@
+from dataclasses import replace
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from rag_sample_app.interview import save_turn
+from rag_sample_app.metrics import metrics
+from rag_sample_app.models import Thread
+from rag_sample_app.prefetch import (
+    PREFETCH_CACHE_ALIAS,
+    hit_ratio,
+    prefetch,
+    prefetch_key,
+    retrieve_for_turn,
+    schedule_prefetch,
+)
+from rag_sample_app.resilience import Deadline
+from rag_sample_app.retrieval import retrieval_breaker
+from rag_sample_app.search_cache import search_cache
+
+DOCUMENTS = [{"content": "志望動機の例"}]
+
+
+@override_settings(APP_CONFIG=replace(settings.APP_CONFIG, prefetch_ttl_seconds=60))
+class PrefetchTest(TestCase):
+    def setUp(self):
+        caches[PREFETCH_CACHE_ALIAS].clear()
+        retrieval_breaker.reset()
+        search_cache.clear()
+        metrics.reset()
+        self.user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(creator=self.user)
+
+    @patch("requests.get")
+    def test_prefetch_stores_documents(self, mock_requests):
+        """AIの質問で検索した結果がスレッドごとに保存されることを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": DOCUMENTS}
+
+        prefetch(self.thread.pk, "志望動機を教えてください")
+
+        self.assertEqual(
+            mock_requests.call_args.kwargs["params"]["search"],
+            "志望動機を教えてください",
+        )
+        self.assertEqual(
+            caches[PREFETCH_CACHE_ALIAS].get(prefetch_key(self.thread.pk)), DOCUMENTS
+        )
+
+    @patch("requests.get")
+    def test_failed_prefetch_is_not_stored(self, mock_requests):
+        mock_requests.return_value.status_code = 500
+        prefetch(self.thread.pk, "質問")
+        self.assertIsNone(
+            caches[PREFETCH_CACHE_ALIAS].get(prefetch_key(self.thread.pk))
+        )
+        self.assertEqual(
+            metrics.value("retrieval_prefetches_total", outcome="empty"), 1
+        )
+
+    @patch("requests.get")
+    def test_hit_skips_search(self, mock_requests):
+        """先読みした結果があれば検索せずに使い、１回で消すことを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+        caches[PREFETCH_CACHE_ALIAS].set(prefetch_key(self.thread.pk), DOCUMENTS)
+
+        documents = retrieve_for_turn(self.thread, "前職では営業でした", Deadline(30))
+        self.assertEqual(documents, DOCUMENTS)
+        mock_requests.assert_not_called()
+
+        self.assertEqual(
+            retrieve_for_turn(self.thread, "前職では営業でした", Deadline(30)), []
+        )
+        mock_requests.assert_called_once()
+        self.assertEqual(metrics.value("retrieval_prefetch_total", result="hit"), 1)
+        self.assertEqual(metrics.value("retrieval_prefetch_total", result="miss"), 1)
+        self.assertEqual(hit_ratio(), 0.5)
+        self.assertEqual(metrics.value("retrieval_prefetch_hit_ratio"), 0.5)
+
+    @override_settings(APP_CONFIG=settings.APP_CONFIG)
+    @patch("requests.get")
+    def test_disabled(self, mock_requests):
+        """先読みが無効な場合は保存された結果を使わず、予約もしないことを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+        caches[PREFETCH_CACHE_ALIAS].set(prefetch_key(self.thread.pk), DOCUMENTS)
+
+        self.assertEqual(retrieve_for_turn(self.thread, "回答", Deadline(30)), [])
+        with patch("rag_sample_app.prefetch._executor") as mock_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_prefetch(self.thread, "質問")
+        mock_executor.submit.assert_not_called()
+
+    def test_saved_ai_turn_schedules_prefetch(self):
+        """AIの応答を保存したあとに、その質問で先読みを予約することを確認するテスト"""
+        completion = SimpleNamespace(
+            model="gpt-4o",
+            usage=None,
+            choices=[SimpleNamespace(message=SimpleNamespace(content="志望動機は？"))],
+        )
+        with patch("rag_sample_app.prefetch._executor") as mock_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                save_turn(self.user, self.thread, "エンジニアです", completion, 0.1)
+        mock_executor.submit.assert_called_once()
+        self.assertEqual(
+            mock_executor.submit.call_args.args[1:],
+            (self.thread.pk, "志望動機は？", None),
+        )
@@ -0,0 +1,96 @@
+import time
+from dataclasses import replace
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from rag_sample_app.profiling import ProfilingMiddleware, collapsed, profile_store
+
+PROFILING = replace(settings.APP_CONFIG, profiling_token="secret")
+
+
+def slow_view(request):
+    User.objects.count()
+    time.sleep(0.05)
+    return HttpResponse("ok")
+
+
+@override_settings(APP_CONFIG=PROFILING)
+class ProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        profile_store.clear()
+        self.middleware = ProfilingMiddleware(slow_view)
+
+    def test_inactive_without_header(self):
+        """ヘッダがなく、サンプリングもしない場合は何も記録しないテスト"""
+        response = self.middleware(RequestFactory().get("/"))
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(profile_store.list(), [])
+
+    def test_profile_with_header(self):
+        """ヘッダを付けたリクエストのスタックとSQLが記録されるテスト"""
+        request = RequestFactory().get("/api/openai/", HTTP_X_PROFILE="secret")
+        response = self.middleware(request)
+
+        profile = profile_store.get(response["X-Profile-Id"])
+        self.assertEqual(profile["path"], "/api/openai/")
+        self.assertGreater(profile["samples"], 0)
+        self.assertIn("test_profiling.slow_view", collapsed(profile))
+        self.assertEqual(profile["query_count"], 1)
+        self.assertIn("COUNT", profile["query_log"][0]["sql"])
+
+        self.middleware(RequestFactory().get("/", HTTP_X_PROFILE="wrong"))
+        self.assertEqual(len(profile_store.list()), 1)
+
+    @override_settings(
+        APP_CONFIG=replace(PROFILING, profile_sample_rate=1.0, profile_buffer_size=2)
+    )
+    def test_sampled_requests_in_ring_buffer(self):
+        """割合でプロファイルしたリクエストは、上限を超えると古いものから捨てられるテスト"""
+        ids = [
+            self.middleware(RequestFactory().get("/"))["X-Profile-Id"] for _ in range(3)
+        ]
+        self.assertEqual(
+            [profile["id"] for profile in profile_store.list()], ids[:0:-1]
+        )
+        self.assertIsNone(profile_store.get(ids[0]))
+
+
+class ProfileDownloadTest(TestCase):
+    def setUp(self):
+        profile_store.clear()
+        with override_settings(APP_CONFIG=PROFILING):
+            response = ProfilingMiddleware(slow_view)(
+                RequestFactory().get("/", HTTP_X_PROFILE="secret")
+            )
+        self.profile_id = response["X-Profile-Id"]
+
+    def test_disabled_without_token(self):
+        response = self.client.get(reverse("profiles"))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(APP_CONFIG=PROFILING)
+    def test_download_profile(self):
+        """トークンを指定すると、一覧・折りたたんだスタック・SQLのログを取得できるテスト"""
+        self.assertEqual(self.client.get(reverse("profiles")).status_code, 401)
+        auth = {"HTTP_AUTHORIZATION": "Bearer secret"}
+
+        profiles = self.client.get(reverse("profiles"), **auth).json()["profiles"]
+        self.assertEqual(profiles[0]["id"], self.profile_id)
+        self.assertNotIn("stacks", profiles[0])
+
+        response = self.client.get(reverse("profile", args=[self.profile_id]), **auth)
+        self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+        stack, count = response.content.decode().splitlines()[0].rsplit(" ", 1)
+        self.assertIn(";", stack)
+        self.assertGreater(int(count), 0)
+
+        response = self.client.get(
+            reverse("profile-queries", args=[self.profile_id]), **auth
+        )
+        self.assertEqual(len(response.json()["queries"]), 1)
+        response = self.client.get(reverse("profile", args=["missing"]), **auth)
+        self.assertEqual(response.status_code, 404)
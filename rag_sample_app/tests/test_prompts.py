@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from rag_sample_app.interview import build_prompt
+from rag_sample_app.prompts import (
+    INTERVIEWER_NAMES,
+    build_messages,
+    build_prefix,
+    choose_interviewer,
+    system_prompt,
+)
+
+
+def chat(sender, message):
+    return SimpleNamespace(sender=sender, message=message)
+
+
+class PromptLayoutTest(SimpleTestCase):
+    def setUp(self):
+        self.thread = SimpleNamespace(interviewer="佐伯", first_message="ようこそ")
+
+    def test_prefix_is_stable_across_turns(self):
+        """前のターンのprefixが、次のターンのmessagesの先頭とそのまま一致することを確認するテスト"""
+        chats = [chat("USER", "山田です"), chat("AI", "志望動機は？")]
+        documents = [{"content": "営業の経験があります"}]
+
+        first = build_messages(
+            build_prefix(self.thread, chats[:0]), build_prompt("山田です", documents)
+        )
+        second = build_messages(
+            build_prefix(self.thread, chats), build_prompt("製品が好きです", [])
+        )
+
+        self.assertEqual(first[:-1], second[: len(first) - 1])
+        self.assertEqual(second[-1], {"role": "user", "content": "製品が好きです"})
+        # ドキュメントとユーザーの入力は最後のメッセージにだけ入る
+        self.assertEqual([m["role"] for m in first], ["system", "assistant", "user"])
+        self.assertIn("営業の経験があります", first[-1]["content"])
+        self.assertTrue(first[-1]["content"].endswith("山田です"))
+
+    def test_system_prompt_uses_thread_interviewer(self):
+        self.assertIn("佐伯", build_prefix(self.thread, [])[0]["content"])
+        self.assertEqual(system_prompt("佐伯"), system_prompt("佐伯"))
+        # 面接官のない既存のスレッドは共通のプロンプトを使う
+        self.assertNotIn("None", system_prompt(""))
+        self.assertIn(choose_interviewer(), INTERVIEWER_NAMES)
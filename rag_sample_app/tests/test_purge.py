@@ -0,0 +1,100 @@
+import datetime
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rag_sample_app import purge
+from rag_sample_app.models import ChatHistory, Thread, TurnUsage
+from rag_sample_app.purge import purge_deleted_threads, purge_thread, schedule_purge
+
+
+# シャードを追加した設定でも、defaultだけを使う構成としてテストする
+@override_settings(DATABASE_SHARDS=["default"])
+class PurgeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(creator=self.user)
+        for i in range(5):
+            ChatHistory.objects.create(
+                thread_id=self.thread, message=f"message {i}", sender="USER"
+            )
+
+    def test_soft_delete_hides_thread(self):
+        """論理削除したスレッドは通常の検索から見えなくなることを確認するテスト"""
+        self.assertEqual(Thread.objects.filter(pk=self.thread.pk).soft_delete(), 1)
+        self.assertFalse(Thread.objects.filter(pk=self.thread.pk).exists())
+        self.assertTrue(Thread.all_objects.filter(pk=self.thread.pk).exists())
+        self.assertEqual(ChatHistory.objects.filter(thread_id=self.thread).count(), 5)
+
+    def test_purge_thread_in_batches(self):
+        """チャット履歴が指定件数ずつ削除され、最後にスレッドが削除されることを確認するテスト"""
+        Thread.objects.filter(pk=self.thread.pk).soft_delete()
+        with patch(
+            "rag_sample_app.purge._delete_chats",
+            side_effect=purge._delete_chats,
+        ) as mock_delete:
+            deleted = purge_thread(self.thread.pk, batch_size=2)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(
+            [len(c.args[0]) for c in mock_delete.call_args_list], [2, 2, 1]
+        )
+        self.assertFalse(ChatHistory.objects.exists())
+        self.assertFalse(Thread.all_objects.exists())
+
+    def test_purge_keeps_usage(self):
+        """削除したスレッドの使用量は紐付けを外して残すことを確認するテスト"""
+        chat = ChatHistory.objects.first()
+        TurnUsage.objects.create(
+            creator=self.user, thread=self.thread, chat=chat, total_tokens=10
+        )
+        Thread.objects.filter(pk=self.thread.pk).soft_delete()
+        purge_thread(self.thread.pk)
+
+        usage = TurnUsage.objects.get()
+        self.assertIsNone(usage.thread)
+        self.assertIsNone(usage.chat)
+        self.assertEqual(usage.total_tokens, 10)
+
+    def test_purge_skips_live_thread(self):
+        """論理削除されていないスレッドは削除しないことを確認するテスト"""
+        purge_thread(self.thread.pk)
+        self.assertTrue(Thread.objects.filter(pk=self.thread.pk).exists())
+
+    def test_purge_deleted_threads(self):
+        """指定した時間より前に論理削除したスレッドだけを削除することを確認するテスト"""
+        recent = Thread.objects.create(creator=self.user)
+        Thread.objects.filter(pk__in=[self.thread.pk, recent.pk]).soft_delete()
+        Thread.all_objects.filter(pk=self.thread.pk).update(
+            deleted_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+
+        threads, chats = purge_deleted_threads(
+            older_than=timezone.now() - datetime.timedelta(minutes=10)
+        )
+
+        self.assertEqual((threads, chats), (1, 5))
+        self.assertEqual(
+            list(Thread.all_objects.values_list("pk", flat=True)), [recent.pk]
+        )
+
+    def test_schedule_purge_after_commit(self):
+        """トランザクションの確定後にバックグラウンドで削除されることを確認するテスト"""
+        Thread.objects.filter(pk=self.thread.pk).soft_delete()
+        with patch("rag_sample_app.purge._executor") as mock_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_purge([self.thread.pk])
+        mock_executor.submit.assert_called_once()
+        self.assertEqual(mock_executor.submit.call_args.args[1], [self.thread.pk])
+
+    def test_purge_threads_command(self):
+        """purge_threadsコマンドで論理削除済みのスレッドが削除されることを確認するテスト"""
+        Thread.objects.filter(pk=self.thread.pk).soft_delete()
+        out = StringIO()
+        call_command("purge_threads", "--batch-size", "3", stdout=out)
+        self.assertIn("purged 1 thread(s), 5 chat(s)", out.getvalue())
+        self.assertFalse(Thread.all_objects.exists())
@@ -0,0 +1,83 @@
+import datetime
+import uuid
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from rag_sample_app.archive import archive_thread, chat_history, chat_history_values
+from rag_sample_app.models import ChatHistory, Thread
+from rag_sample_app.renderers import ORJSONRenderer
+from rag_sample_app.serializers import ChatHistorySerializer, chat_history_rows
+
+
+class ORJSONRendererTest(SimpleTestCase):
+    def test_same_output_as_json_renderer(self):
+        """JSONRendererとバイト列まで同じ出力になることを確認するテスト"""
+        data = {
+            "thread_id": uuid.uuid4(),
+            "message": 'こんにちは\u2028\u2029 "quoted"',
+            "created_at": timezone.now(),
+            "utc": datetime.datetime(
+                2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc
+            ),
+            "date": datetime.date(2024, 1, 2),
+            "amount": Decimal("1.50"),
+            "items": [1, None, True, 2.5],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indent_falls_back(self):
+        """インデントの指定がある場合も同じ出力になることを確認するテスト"""
+        data = {"a": [1, 2]}
+        media_type = "application/json; indent=4"
+        self.assertEqual(
+            ORJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type),
+        )
+
+    def test_none(self):
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+
+class ChatHistoryRowsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(creator=user)
+        for i in range(3):
+            ChatHistory.objects.create(
+                thread_id=self.thread, message=f"メッセージ{i}", sender="USER"
+            )
+
+    def assert_same_as_serializer(self):
+        expected = JSONRenderer().render(
+            ChatHistorySerializer(chat_history(self.thread), many=True).data
+        )
+        actual = ORJSONRenderer().render(
+            chat_history_rows(chat_history_values(self.thread))
+        )
+        self.assertEqual(actual, expected)
+
+    def test_same_as_serializer(self):
+        """軽量版の出力がModelSerializerと同じになることを確認するテスト"""
+        self.assert_same_as_serializer()
+
+    def test_same_as_serializer_with_archive(self):
+        """アーカイブ済みの履歴を含む場合も同じになることを確認するテスト"""
+        archive_thread(self.thread)
+        ChatHistory.objects.create(thread_id=self.thread, message="new", sender="AI")
+        self.assert_same_as_serializer()
+
+    def test_benchmark_command(self):
+        """benchmark_serializationコマンドで両方の計測結果が出力されることを確認するテスト"""
+        out = StringIO()
+        call_command(
+            "benchmark_serialization", "--messages", "20", "--repeat", "1", stdout=out
+        )
+        self.assertIn("ModelSerializer:", out.getvalue())
+        self.assertIn("values+orjson:", out.getvalue())
+        self.assertFalse(ChatHistory.objects.exclude(thread_id=self.thread).exists())
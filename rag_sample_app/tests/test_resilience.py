@@ -0,0 +1,59 @@
+from django.test import SimpleTestCase
+
+from rag_sample_app.resilience import CircuitBreaker, Deadline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DeadlineTest(SimpleTestCase):
+    def test_share_is_bounded_by_remaining(self):
+        """各段階の持ち時間は残り時間を超えないことを確認するテスト"""
+        clock = FakeClock()
+        deadline = Deadline(30, clock=clock)
+        self.assertEqual(deadline.share(0.1), 3)
+        clock.now = 28
+        self.assertEqual(deadline.share(0.1), 2)
+        clock.now = 31
+        self.assertTrue(deadline.expired())
+        self.assertEqual(deadline.share(0.1), 0)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            "test", failure_threshold=2, reset_timeout=10, clock=self.clock
+        )
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_allows_single_trial(self):
+        """reset_timeout経過後は１件だけ試行し、成功すれば閉じることを確認するテスト"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now = 10
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_failure_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.state_value(), 2)
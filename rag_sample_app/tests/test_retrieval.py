@@ -0,0 +1,188 @@
+import threading
+from dataclasses import replace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rag_sample_app.local_search import (
+    LocalIndex,
+    embed,
+    get_local_index,
+    reset_local_index,
+    tokenize,
+)
+from rag_sample_app.metrics import metrics
+from rag_sample_app.models import Company, Document
+from rag_sample_app.resilience import Deadline
+from rag_sample_app.retrieval import (
+    hybrid_search,
+    parse_retrieval_branches,
+    reciprocal_rank_fusion,
+    retrieval_breaker,
+    retrieve,
+)
+from rag_sample_app.search_cache import (
+    INDEX_VERSION_CACHE_ALIAS,
+    index_version,
+    search_cache,
+)
+
+DOCUMENTS = [
+    {"id": 1, "content": "Pythonでバックエンドを開発しました"},
+    {"id": 2, "content": "営業として新規顧客を開拓しました"},
+    {"id": 3, "content": "チームリーダーとして開発チームをまとめました"},
+]
+
+
+class LocalIndexTest(SimpleTestCase):
+    def test_tokenize(self):
+        """NFKC正規化・小文字化した文字のbigramになることを確認するテスト"""
+        self.assertEqual(tokenize("ＡＩ 開発"), ["ai", "i開", "開発"])
+        self.assertEqual(tokenize("A"), ["a"])
+        self.assertEqual(tokenize(" "), [])
+
+    def test_embed_is_normalized(self):
+        vectors = embed(["開発", ""])
+        self.assertAlmostEqual(float((vectors[0] ** 2).sum()), 1.0, places=5)
+        self.assertEqual(float(abs(vectors[1]).sum()), 0.0)
+
+    def test_bm25(self):
+        """クエリのbigramを多く含むドキュメントが上位になり、無関係なものは返さないテスト"""
+        index = LocalIndex(DOCUMENTS)
+        self.assertEqual(
+            [document["id"] for document in index.bm25("開発チームのリーダー", 10)],
+            [3, 1],
+        )
+        self.assertEqual(index.bm25("無関係", 10), [])
+
+    def test_vector(self):
+        index = LocalIndex(DOCUMENTS)
+        self.assertEqual(index.vector("新規顧客の開拓", 1)[0]["id"], 2)
+        self.assertEqual(LocalIndex([]).vector("開発", 3), [])
+
+
+class FusionTest(SimpleTestCase):
+    def test_reciprocal_rank_fusion(self):
+        """複数のブランチで上位のドキュメントが統合後に上位になることを確認するテスト"""
+        a, b, c = ({"content": name} for name in "abc")
+        documents, contributions = reciprocal_rank_fusion(
+            {"keyword": [a, b], "vector": [c, b], "bm25": [b]}
+        )
+        self.assertEqual(documents, [b, a, c])
+        self.assertEqual(contributions, {"keyword": 2, "vector": 2, "bm25": 1})
+
+    def test_parse_retrieval_branches(self):
+        self.assertEqual(
+            parse_retrieval_branches("keyword=3, bm25=0.5"),
+            {"keyword": 3.0, "bm25": 0.5},
+        )
+
+
+@patch("requests.get")
+class HybridSearchTest(TestCase):
+    def setUp(self):
+        caches[INDEX_VERSION_CACHE_ALIAS].clear()
+        search_cache.clear()
+        reset_local_index()
+        retrieval_breaker.reset()
+        metrics.reset()
+        for document in DOCUMENTS:
+            Document.objects.create(content=document["content"])
+
+    def test_local_and_keyword_results_are_fused(self, mock_requests):
+        """Azure AI Searchとローカルの検索結果が統合されることを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {
+            "value": [
+                {"content": "Azureのドキュメント"},
+                {"content": DOCUMENTS[1]["content"]},
+            ]
+        }
+
+        documents = retrieve("新規顧客の開拓", Deadline(30))
+
+        # キーワード検索・ベクトル・BM25のすべてで上位のドキュメントが先頭になる
+        self.assertEqual(documents[0]["content"], DOCUMENTS[1]["content"])
+        self.assertIn({"content": "Azureのドキュメント"}, documents)
+        self.assertEqual(
+            metrics.value("retrieval_branch_contributions_total", branch="bm25"), 1
+        )
+        self.assertGreaterEqual(
+            metrics.value("retrieval_branch_contributions_total", branch="keyword"), 2
+        )
+
+    @override_settings(
+        APP_CONFIG=replace(
+            settings.APP_CONFIG, retrieval_branches="keyword=0.05,bm25=1"
+        )
+    )
+    def test_slow_branch_is_dropped(self, mock_requests):
+        """タイムアウトしたブランチの結果だけを捨てて、ほかのブランチの結果を返すテスト"""
+        release = threading.Event()
+
+        def slow_search(*args, **kwargs):
+            release.wait(5)
+            raise AssertionError("too late")
+
+        mock_requests.side_effect = slow_search
+        try:
+            documents = hybrid_search("営業", 3)
+        finally:
+            release.set()
+
+        self.assertEqual([document["id"] for document in documents], [2])
+        self.assertEqual(
+            metrics.value("retrieval_branch_timeouts_total", branch="keyword"), 1
+        )
+
+    def test_index_is_rebuilt_when_documents_change(self, mock_requests):
+        index = get_local_index()
+        self.assertIs(get_local_index(), index)
+        Document.objects.create(content="新しいドキュメント")
+        self.assertEqual(len(get_local_index()), 4)
+
+
+@patch("requests.get")
+class TenantRoutingTest(TestCase):
+    def setUp(self):
+        caches[INDEX_VERSION_CACHE_ALIAS].clear()
+        search_cache.clear()
+        reset_local_index()
+        retrieval_breaker.reset()
+        self.acme = Company.objects.create(
+            slug="acme", name="Acme", search_index="acme"
+        )
+        self.globex = Company.objects.create(
+            slug="globex", name="Globex", search_index="globex"
+        )
+        Document.objects.create(content="営業の研修資料", company=self.acme)
+        Document.objects.create(content="営業の評価基準", company=self.globex)
+        Document.objects.create(content="営業の共通の質問集")
+
+    def test_query_scans_only_its_company(self, mock_requests):
+        """企業のスレッドの検索は、その企業のインデックスとドキュメントだけを対象にするテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+
+        documents = retrieve("営業", Deadline(30), self.acme)
+
+        self.assertEqual([d["content"] for d in documents], ["営業の研修資料"])
+        self.assertTrue(mock_requests.call_args.args[0].endswith("/indexes/acme/docs"))
+        shared = retrieve("営業", Deadline(30))
+        self.assertEqual([d["content"] for d in shared], ["営業の共通の質問集"])
+
+    def test_document_change_invalidates_only_its_company(self, mock_requests):
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+        versions = (index_version(self.acme.pk), index_version(self.globex.pk))
+        index = get_local_index(self.globex.pk)
+
+        Document.objects.create(content="営業の新しい資料", company=self.acme)
+
+        self.assertEqual(index_version(self.acme.pk), versions[0] + 1)
+        self.assertEqual(index_version(self.globex.pk), versions[1])
+        self.assertIs(get_local_index(self.globex.pk), index)
+        self.assertEqual(len(get_local_index(self.acme.pk)), 2)
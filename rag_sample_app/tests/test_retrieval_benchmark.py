@@ -0,0 +1,82 @@
+import json
+import urllib.request
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from rag_sample_app.models import Document
+from rag_sample_app.retrieval_benchmark import (
+    StandInSearchServer,
+    ndcg_at_k,
+    percentile,
+    recall_at_k,
+    reciprocal_rank,
+    summarize,
+)
+
+
+class MetricsTest(SimpleTestCase):
+    def test_ranking_metrics(self):
+        ranked = ["a", "b", "c", "d"]
+        self.assertEqual(recall_at_k(ranked, ["b", "x"], 2), 0.5)
+        self.assertEqual(recall_at_k(ranked, [], 2), 0.0)
+        self.assertEqual(reciprocal_rank(ranked, ["c"]), 1 / 3)
+        self.assertEqual(reciprocal_rank(ranked, ["x"]), 0.0)
+        self.assertEqual(ndcg_at_k(ranked, ["a", "b"], 3), 1.0)
+        self.assertAlmostEqual(ndcg_at_k(["x", "a"], ["a"], 2), 0.6309, places=4)
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 50.0)
+        self.assertEqual(percentile(values, 0.99), 99.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_summarize(self):
+        results = [
+            {
+                "ranked": ["a", "b"],
+                "context": ["a"],
+                "relevant": ["a"],
+                "latency": 0.01,
+                "context_bytes": 100,
+            },
+            {
+                "ranked": ["b", "a"],
+                "context": ["b"],
+                "relevant": ["a"],
+                "latency": 0.03,
+                "context_bytes": 300,
+            },
+        ]
+        summary = summarize(results, 1)
+        self.assertEqual(summary["recall@1"], 0.5)
+        self.assertEqual(summary["context_recall"], 0.5)
+        self.assertEqual(summary["mrr"], 0.75)
+        self.assertEqual(summary["latency_p50_ms"], 10.0)
+        self.assertEqual(summary["context_bytes_avg"], 200)
+
+
+class StandInSearchServerTest(SimpleTestCase):
+    def test_returns_azure_shaped_results(self):
+        """Azure AI Searchと同じ形のJSONを、BM25の順位で返すことを確認するテスト"""
+        documents = [{"content": "営業の経験"}, {"content": "開発の経験"}]
+        with StandInSearchServer(documents) as server:
+            url = f"{server.url}/indexes/test/docs?search=%E9%96%8B%E7%99%BA"
+            with urllib.request.urlopen(url) as response:
+                body = json.loads(response.read())
+        self.assertEqual(body["value"][0]["content"], "開発の経験")
+        self.assertEqual(server.requests, 1)
+
+
+class BenchmarkRetrievalCommandTest(TestCase):
+    def test_command_reports_metrics(self):
+        """同梱のデータセットで計測し、ドキュメントを残さないことを確認するテスト"""
+        out = StringIO()
+        call_command("benchmark_retrieval", "--repeat", "1", "--json", stdout=out)
+        summary = json.loads(out.getvalue())
+
+        self.assertEqual(summary["queries"], 12)
+        self.assertGreater(summary["recall@5"], 0.5)
+        self.assertGreater(summary["context_bytes_avg"], 0)
+        self.assertEqual(Document.objects.count(), 0)
@@ -0,0 +1,87 @@
+import datetime
+from dataclasses import replace
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rag_sample_app.models import ChatHistory, DailyActivity, RollupWatermark, Thread
+from rag_sample_app.rollup import activity_summary, rolled_up_until, rollup_activity
+
+
+# シャードを追加した設定でも、defaultだけを使う構成としてテストする
+@override_settings(
+    APP_CONFIG=replace(settings.APP_CONFIG, rollup_lag_seconds=0),
+    DATABASE_SHARDS=["default"],
+)
+class RollupActivityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.thread = Thread.objects.create(creator=self.user)
+        self.add_turns(self.thread, 2)
+
+    def add_turns(self, thread, turns):
+        for i in range(turns):
+            ChatHistory.objects.create(thread_id=thread, message=f"{i}", sender="USER")
+            ChatHistory.objects.create(thread_id=thread, message=f"{i}", sender="AI")
+
+    def test_rollup_counts_only_new_rows(self):
+        """２回目の集計では、前回より後に書き込まれた行だけが加算されるテスト"""
+        self.assertEqual(rollup_activity(batch_size=3, now=timezone.now()), (1, 4))
+
+        other = User.objects.create(username="other")
+        self.add_turns(Thread.objects.create(creator=other), 1)
+        self.add_turns(self.thread, 1)
+        self.assertEqual(rollup_activity(batch_size=3, now=timezone.now()), (1, 4))
+        self.assertEqual(rollup_activity(now=timezone.now()), (0, 0))
+
+        activity = DailyActivity.objects.get(user=self.user)
+        self.assertEqual(
+            (activity.date, activity.threads, activity.turns, activity.messages),
+            (timezone.localdate(), 1, 3, 6),
+        )
+        self.assertEqual(
+            DailyActivity.objects.aggregate(Sum("messages")), {"messages__sum": 8}
+        )
+        self.assertEqual(
+            RollupWatermark.objects.get().last_chat_id,
+            ChatHistory.objects.latest("id").id,
+        )
+
+    def test_recent_rows_wait_for_next_run(self):
+        """直近（rollup_lag_seconds以内）の行は次回の集計に回されるテスト"""
+        later = timezone.now() + datetime.timedelta(hours=1)
+        with override_settings(
+            APP_CONFIG=replace(settings.APP_CONFIG, rollup_lag_seconds=300)
+        ):
+            self.assertEqual(rollup_activity(now=timezone.now()), (0, 0))
+            self.assertFalse(DailyActivity.objects.exists())
+            self.assertEqual(rollup_activity(now=later), (1, 4))
+
+    def test_activity_summary(self):
+        other = User.objects.create(username="other")
+        self.add_turns(Thread.objects.create(creator=other), 3)
+        self.add_turns(Thread.objects.create(creator=other), 1)
+        self.assertIsNone(rolled_up_until())
+        out = StringIO()
+        call_command("rollup_activity", stdout=out)
+        self.assertIn("rolled up 3 thread(s), 12 chat(s)", out.getvalue())
+
+        [day] = activity_summary(7)
+        self.assertEqual(
+            day,
+            {
+                "date": timezone.localdate(),
+                "threads": 3,
+                "turns": 6,
+                "messages": 12,
+                "users": 2,
+                "average_turns": 2.0,
+                "messages_per_user": 6.0,
+            },
+        )
+        self.assertLessEqual(rolled_up_until(), timezone.now())
@@ -0,0 +1,145 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from rag_sample_app.admission import AdmissionRejected
+from rag_sample_app.llm import CompletionTimeout, create_chat_completion
+from rag_sample_app.resilience import Deadline
+from rag_sample_app.routing import Deployment, DeploymentRouter, load_deployments
+from rag_sample_django.config import AppConfig
+
+
+def _status_error(error_class, status_code, headers=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_class("error", response=response, body=None)
+
+
+class DeploymentRouterTest(SimpleTestCase):
+    def test_prefers_fast_and_healthy_deployment(self):
+        """レイテンシが小さくエラー率の低いデプロイメントが優先されることを確認するテスト"""
+        slow = Deployment("router-slow", client=MagicMock())
+        fast = Deployment("router-fast", client=MagicMock())
+        flaky = Deployment("router-flaky", client=MagicMock())
+        slow.record_success(3.0)
+        fast.record_success(0.5)
+        flaky.record_success(0.4)
+        flaky.record_error()
+
+        router = DeploymentRouter([slow, flaky, fast])
+        self.assertEqual(router.candidates(), [fast, flaky, slow])
+
+    def test_blocked_deployment_is_last(self):
+        blocked = Deployment("router-blocked", client=MagicMock())
+        other = Deployment("router-other", client=MagicMock())
+        other.record_success(5.0)
+        blocked.limiter.observe(429, {"retry-after": "30"})
+
+        router = DeploymentRouter([blocked, other])
+        self.assertEqual(router.candidates(), [other, blocked])
+
+    @override_settings(
+        APP_CONFIG=AppConfig.from_env(
+            {
+                "OPENAI_API_KEY": "default-key",
+                "OPENAI_API_KEY_JAPANEAST": "je-key",
+                "OPENAI_DEPLOYMENTS": json.dumps(
+                    [
+                        {
+                            "name": "japaneast",
+                            "resource": "aoai-je",
+                            "deployment": "gpt-4o-mini",
+                            "region": "japaneast",
+                            "api_key_env": "OPENAI_API_KEY_JAPANEAST",
+                        },
+                        {"name": "eastus", "resource": "aoai-us", "deployment": "gpt"},
+                    ]
+                ),
+            }
+        )
+    )
+    def test_load_deployments(self):
+        deployments = load_deployments()
+        self.assertEqual([d.name for d in deployments], ["japaneast", "eastus"])
+        self.assertEqual(deployments[0].resource_name, "aoai-je")
+        self.assertEqual(deployments[0].region, "japaneast")
+        self.assertEqual([d.api_key for d in deployments], ["je-key", "default-key"])
+
+
+class CreateChatCompletionTest(SimpleTestCase):
+    def setUp(self):
+        # リミッターはデプロイメント名ごとに共有されるため、テストごとに名前を変える
+        self.primary = Deployment(f"primary-{self.id()}", client=MagicMock())
+        self.secondary = Deployment(f"secondary-{self.id()}", client=MagicMock())
+        self.secondary.record_success(1.0)
+        patcher = patch(
+            "rag_sample_app.llm.get_router",
+            return_value=DeploymentRouter([self.primary, self.secondary]),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failover_on_server_error(self):
+        """5xxの場合、次のデプロイメントに切り替えることを確認するテスト"""
+        create = self.primary.client.chat.completions.create
+        create.side_effect = _status_error(openai.InternalServerError, 500)
+        fallback = self.secondary.client.chat.completions.create
+
+        result = create_chat_completion("gpt", [{"role": "user", "content": "hi"}])
+
+        self.assertIs(result, fallback.return_value)
+        self.assertGreater(self.primary.error_rate, 0)
+
+    def test_reservation_is_kept_after_server_error(self):
+        """5xxやタイムアウトではトークンが消費された可能性があるので、確保した枠を戻さないテスト"""
+        messages = [{"role": "user", "content": "hi"}]
+        create = self.primary.client.chat.completions.create
+        create.side_effect = _status_error(openai.InternalServerError, 500)
+        level = self.primary.limiter.tokens.level
+
+        create_chat_completion("gpt", messages)
+
+        self.assertLess(self.primary.limiter.tokens.level, level - 400)
+
+    def test_reservation_is_refunded_when_not_sent(self):
+        """接続できなかった場合と429では、確保した枠を戻すことを確認するテスト"""
+        request = httpx.Request("POST", "https://example.openai.azure.com")
+        create = self.primary.client.chat.completions.create
+        create.side_effect = openai.APIConnectionError(request=request)
+        level = self.primary.limiter.tokens.level
+
+        create_chat_completion("gpt", [{"role": "user", "content": "hi"}])
+
+        self.assertAlmostEqual(self.primary.limiter.tokens.level, level, delta=1)
+
+    def test_all_rate_limited(self):
+        """すべてのデプロイメントが429の場合、AdmissionRejectedになることを確認するテスト"""
+        for deployment, retry_after in ((self.primary, "60"), (self.secondary, "30")):
+            deployment.client.chat.completions.create.side_effect = _status_error(
+                openai.RateLimitError, 429, {"retry-after": retry_after}
+            )
+
+        with self.assertRaises(AdmissionRejected) as cm:
+            create_chat_completion("gpt", [{"role": "user", "content": "hi"}])
+        self.assertEqual(cm.exception.retry_after, 30)
+
+    def test_client_error_is_not_retried(self):
+        create = self.primary.client.chat.completions.create
+        create.side_effect = _status_error(openai.BadRequestError, 400)
+
+        with self.assertRaises(openai.BadRequestError):
+            create_chat_completion("gpt", [{"role": "user", "content": "hi"}])
+        self.secondary.client.chat.completions.create.assert_not_called()
+
+    def test_timeout_when_deadline_expired(self):
+        """持ち時間を使い切っている場合、呼び出さずにCompletionTimeoutになることを確認するテスト"""
+        deadline = Deadline(0)
+
+        with self.assertRaises(CompletionTimeout):
+            create_chat_completion(
+                "gpt", [{"role": "user", "content": "hi"}], deadline=deadline
+            )
+        self.primary.client.chat.completions.create.assert_not_called()
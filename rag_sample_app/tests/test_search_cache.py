@@ -0,0 +1,99 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from rag_sample_app.metrics import metrics
+from rag_sample_app.models import Document
+from rag_sample_app.resilience import Deadline
+from rag_sample_app.retrieval import retrieval_breaker, retrieve
+from rag_sample_app.search_cache import (
+    INDEX_VERSION_CACHE_ALIAS,
+    LRUCache,
+    bump_index_version,
+    index_version,
+    search_cache,
+)
+
+DOCUMENTS = [{"content": "自己PRの例"}]
+
+
+class LRUCacheTest(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        """上限を超えたら最も長く使われていないエントリを捨てることを確認するテスト"""
+        cache = LRUCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_entry_is_dropped(self):
+        now = [100.0]
+        cache = LRUCache(max_entries=10, ttl=5, clock=lambda: now[0])
+        cache.set("a", 1)
+        now[0] = 104.9
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 105.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = LRUCache(max_entries=0, ttl=60)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+@patch("requests.get")
+class RetrievalCacheTest(TestCase):
+    def setUp(self):
+        caches[INDEX_VERSION_CACHE_ALIAS].clear()
+        search_cache.clear()
+        retrieval_breaker.reset()
+        metrics.reset()
+
+    def test_normalized_query_is_served_from_cache(self, mock_requests):
+        """正規化して同じになる検索語は、Azure AI Searchを再度呼ばないことを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": DOCUMENTS}
+
+        self.assertEqual(retrieve("自己PR  です", Deadline(30)), DOCUMENTS)
+        self.assertEqual(retrieve(" 自己PR です ", Deadline(30)), DOCUMENTS)
+
+        mock_requests.assert_called_once()
+        self.assertEqual(metrics.value("retrieval_cache_total", result="hit"), 1)
+        self.assertEqual(metrics.value("retrieval_cache_total", result="miss"), 1)
+
+    def test_failure_is_not_cached(self, mock_requests):
+        mock_requests.return_value.status_code = 500
+        self.assertEqual(retrieve("自己PR", Deadline(30)), [])
+        self.assertEqual(retrieve("自己PR", Deadline(30)), [])
+        self.assertEqual(mock_requests.call_count, 2)
+
+    def test_document_change_invalidates_cache(self, mock_requests):
+        """ドキュメントの追加・削除でインデックスのバージョンが上がり、検索し直すことを確認するテスト"""
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": DOCUMENTS}
+        retrieve("自己PR", Deadline(30))
+
+        document = Document.objects.create(content="新しいドキュメント")
+        self.assertEqual(index_version(), 1)
+        retrieve("自己PR", Deadline(30))
+        self.assertEqual(mock_requests.call_count, 2)
+
+        document.delete()
+        self.assertEqual(index_version(), 2)
+        retrieve("自己PR", Deadline(30))
+        self.assertEqual(mock_requests.call_count, 3)
+
+    def test_invalidate_search_cache_command(self, mock_requests):
+        out = StringIO()
+        bump_index_version()
+        call_command("invalidate_search_cache", stdout=out)
+        self.assertIn("index version is now 2", out.getvalue())
@@ -37,7 +37,7 @@ class ChatHistorySerializerTest(TestCase):
         self.chat_history = ChatHistory.objects.create(
             thread_id=self.thread,
             message="This is a test message",
-            sender="Test Sender",
+            sender="USER",
         )
 
     def test_chat_history_serializer(self):
@@ -0,0 +1,190 @@
+import datetime
+import unittest
+from dataclasses import replace
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from rag_sample_app.archive import chat_history
+from rag_sample_app.export import stream_export
+from rag_sample_app.models import (
+    ChatHistory,
+    DailyActivity,
+    Thread,
+    ThreadArchive,
+    TurnUsage,
+)
+from rag_sample_app.purge import purge_deleted_threads
+from rag_sample_app.rollup import rollup_activity
+from rag_sample_app.sharding import active_shard, shard_for, use_shard
+from rag_sample_app.usage import record_usage
+from rag_sample_app.utils import jwt_required
+
+SHARDS = ["default", "shard1"]
+
+
+class ShardForTest(SimpleTestCase):
+    @override_settings(DATABASE_SHARDS=["default"])
+    def test_single_database(self):
+        self.assertEqual(shard_for(123), "default")
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    def test_adding_a_shard_only_moves_users_to_it(self):
+        """シャードを追加したとき、割り当てが変わるのは新しいシャードに移るユーザーだけになるテスト"""
+        before = {user_id: shard_for(user_id) for user_id in range(3000)}
+        self.assertEqual(set(before.values()), set(SHARDS))
+        self.assertEqual(shard_for(42), before[42])
+
+        with override_settings(DATABASE_SHARDS=[*SHARDS, "shard2"]):
+            after = {user_id: shard_for(user_id) for user_id in range(3000)}
+        moved = [user_id for user_id in after if after[user_id] != before[user_id]]
+        self.assertTrue(all(after[user_id] == "shard2" for user_id in moved))
+        self.assertAlmostEqual(len(moved) / 3000, 1 / 3, delta=0.05)
+
+
+@unittest.skipUnless("shard1" in settings.DATABASES, "shard1 is not configured")
+@override_settings(DATABASE_SHARDS=SHARDS)
+class ShardedStorageTest(TestCase):
+    # shard1がない設定でもテストの収集とシステムチェックが失敗しないように、設定済みのものだけ指定する
+    databases = {"default", "shard1"} & set(settings.DATABASES)
+
+    def setUp(self):
+        # shard1に割り当てられるユーザー
+        self.user = User.objects.create(username="user0")
+        while shard_for(self.user) != "shard1":
+            self.user = User.objects.create(username=f"user{self.user.pk}")
+
+    def test_jwt_required_activates_user_shard(self):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION="Bearer token")
+        with patch("rag_sample_app.utils.authenticate_token", return_value=self.user):
+            response = jwt_required(lambda r: JsonResponse({"shard": active_shard()}))(
+                request
+            )
+        self.assertEqual(response.content, b'{"shard": "shard1"}')
+        self.assertIsNone(active_shard())
+
+    def test_threads_and_chats_are_stored_on_user_shard(self):
+        """スレッドとチャット履歴はユーザーのシャードに、使用量はdefaultに保存されるテスト"""
+        with use_shard(shard_for(self.user)):
+            thread = Thread.objects.create(creator=self.user)
+            chat = ChatHistory(thread_id=thread, message="こんにちは", sender="USER")
+            chat.save()
+            record_usage(self.user, SimpleNamespace(), 0.1, thread=thread, chat=chat)
+            self.assertEqual(chat_history(thread), [chat])
+            self.assertEqual(Thread.objects.filter(creator=self.user).count(), 1)
+
+        self.assertEqual(Thread.objects.using("shard1").count(), 1)
+        self.assertEqual(ChatHistory.objects.using("shard1").count(), 1)
+        self.assertFalse(Thread.objects.using("default").exists())
+        self.assertEqual(TurnUsage.objects.using("default").get().thread_id, thread.pk)
+
+    def test_export_reads_user_shard_after_view_returns(self):
+        """ストリーミングのジェネレーターは、ビューの外でもユーザーのシャードから読むテスト"""
+        thread = Thread.objects.using("shard1").create(
+            creator=self.user, first_message="こんにちは"
+        )
+        ChatHistory.objects.using("shard1").create(
+            thread_id=thread, message="回答", sender="USER"
+        )
+        lines = list(stream_export(self.user, "shard1", "ndjson", chunk_size=1))
+        self.assertEqual(len(lines), 2)
+        self.assertIsNone(active_shard())
+
+    def test_purge_deleted_threads_on_every_shard(self):
+        thread = Thread.objects.using("shard1").create(
+            creator=self.user, deleted_at=timezone.now()
+        )
+        ChatHistory.objects.using("shard1").create(
+            thread_id=thread, message="削除", sender="USER"
+        )
+        self.assertEqual(purge_deleted_threads(), (1, 1))
+        self.assertFalse(Thread.all_objects.using("shard1").exists())
+
+    def test_rebalance_moves_misplaced_users(self):
+        """defaultに残っているユーザーの履歴を、日時とIDを変えずにシャードへ移動するテスト"""
+        created_at = timezone.now() - datetime.timedelta(days=30)
+        thread = Thread.objects.using("default").create(creator=self.user)
+        Thread.all_objects.using("default").filter(pk=thread.pk).update(
+            created_at=created_at
+        )
+        ThreadArchive.objects.using("default").create(
+            thread=thread, data=b"", last_chat_id=0
+        )
+        chats = [
+            ChatHistory.objects.using("default").create(
+                thread_id=thread, message=f"{i}", sender="USER"
+            )
+            for i in range(3)
+        ]
+        other = User.objects.create(username="other")
+        while shard_for(other) != "default":
+            other = User.objects.create(username=f"other{other.pk}")
+        Thread.objects.using("default").create(creator=other)
+
+        out = StringIO()
+        call_command("rebalance_shards", "--batch-size", "2", stdout=out)
+
+        self.assertIn("moved 1 user(s), 1 thread(s), 3 chat(s)", out.getvalue())
+        moved = Thread.objects.using("shard1").get()
+        self.assertEqual(moved.created_at, created_at)
+        self.assertEqual(
+            list(ChatHistory.objects.using("shard1").values_list("id", "timestamp")),
+            [(chat.id, chat.timestamp) for chat in chats],
+        )
+        self.assertTrue(ThreadArchive.objects.using("shard1").exists())
+        self.assertEqual(Thread.objects.using("default").get().creator, other)
+        self.assertFalse(ChatHistory.objects.using("default").exists())
+
+        out = StringIO()
+        call_command("rebalance_shards", stdout=out)
+        self.assertIn("moved 0 user(s)", out.getvalue())
+
+    def test_rebalance_does_not_count_moved_chats_twice(self):
+        """集計済みの履歴を移動しても、移動先の集計で二重に数えないことを確認するテスト"""
+        thread = Thread.objects.using("default").create(creator=self.user)
+        for sender in ("USER", "AI"):
+            ChatHistory.objects.using("default").create(
+                thread_id=thread, message="回答", sender=sender
+            )
+        config = replace(settings.APP_CONFIG, rollup_lag_seconds=0)
+        with override_settings(APP_CONFIG=config):
+            rollup_activity()
+            # 移動元でまだ集計していない行は、移動先で一度だけ数える
+            ChatHistory.objects.using("default").create(
+                thread_id=thread, message="追加", sender="USER"
+            )
+
+            call_command("rebalance_shards", stdout=StringIO())
+            rollup_activity()
+
+        activity = DailyActivity.objects.get(user=self.user)
+        self.assertEqual(
+            (activity.threads, activity.turns, activity.messages), (1, 2, 3)
+        )
+
+    def test_rebalance_keeps_chats_on_id_conflict(self):
+        """移動先に別のスレッドの同じIDのチャット履歴がある場合、移動元を削除せずに停止するテスト"""
+        thread = Thread.objects.using("default").create(creator=self.user)
+        chat = ChatHistory.objects.using("default").create(
+            thread_id=thread, message="移動する", sender="USER"
+        )
+        existing = Thread.objects.using("shard1").create(creator=self.user)
+        ChatHistory.objects.using("shard1").create(
+            id=chat.id, thread_id=existing, message="既存", sender="USER"
+        )
+
+        with self.assertRaisesMessage(CommandError, "already exist on shard1"):
+            call_command("rebalance_shards", stdout=StringIO())
+
+        self.assertTrue(
+            ChatHistory.objects.using("default").filter(pk=chat.pk).exists()
+        )
+        self.assertTrue(Thread.objects.using("default").filter(pk=thread.pk).exists())
+        self.assertFalse(Thread.objects.using("shard1").filter(pk=thread.pk).exists())
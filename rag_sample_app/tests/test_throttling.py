@@ -0,0 +1,137 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from unittest.mock import MagicMock, patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from rag_sample_app.throttling import (
+    GCRA_SCRIPT,
+    RATELIMIT_CACHE_ALIAS,
+    check_shared_ratelimit_cache,
+    consume,
+    parse_rate_limits,
+    rate_limit,
+)
+
+
+class ParseRateLimitsTest(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_rate_limits("openai=30/min, new-thread=5/hour"),
+            {"openai": (30, 60), "new-thread": (5, 3600)},
+        )
+        self.assertEqual(parse_rate_limits(""), {})
+
+
+class ConsumeTest(SimpleTestCase):
+    def setUp(self):
+        caches[RATELIMIT_CACHE_ALIAS].clear()
+
+    def test_burst_then_refill(self):
+        """上限回数までは連続で許可され、時間の経過で１回分ずつ回復することを確認するテスト"""
+        results = [consume("key", 3, 60, now=0) for _ in range(4)]
+        self.assertEqual(
+            [allowed for allowed, *_ in results], [True, True, True, False]
+        )
+        self.assertEqual([remaining for _, remaining, *_ in results[:3]], [2, 1, 0])
+        self.assertEqual(results[3][3], 20)
+
+        allowed, *_ = consume("key", 3, 60, now=20)
+        self.assertTrue(allowed)
+
+    def test_concurrent_requests_are_admitted_once_each(self):
+        """同時に消費しても、上限回数を超えて許可しないことを確認するテスト"""
+        cache = caches[RATELIMIT_CACHE_ALIAS]
+        original_get = cache.get
+
+        def slow_get(*args, **kwargs):
+            # 読み込みと書き込みの間に他のリクエストが割り込めるようにする
+            value = original_get(*args, **kwargs)
+            time.sleep(0.002)
+            return value
+
+        with patch.object(cache, "get", slow_get):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(
+                    executor.map(lambda _: consume("key", 5, 60, now=0), range(8))
+                )
+        self.assertEqual(sum(allowed for allowed, *_ in results), 5)
+
+    def test_lock_held_by_another_worker(self):
+        """他のワーカーがロックを持ったままの場合は待ってから拒否することを確認するテスト"""
+        caches[RATELIMIT_CACHE_ALIAS].add("key:lock", 1)
+        allowed, remaining, _, retry_after = consume("key", 3, 60, now=0)
+        self.assertFalse(allowed)
+        self.assertEqual((remaining, retry_after), (0, 20))
+
+    def test_redis_runs_gcra_as_script(self):
+        """Redisではスクリプトで読み書きし、その結果から残り回数を計算することを確認するテスト"""
+        cache = RedisCache("redis://localhost:6379/1", {})
+        client = MagicMock()
+        client.eval.return_value = [1, b"20.0"]
+        cache.__dict__["_cache"] = MagicMock(get_client=MagicMock(return_value=client))
+        with patch("rag_sample_app.throttling.caches", {RATELIMIT_CACHE_ALIAS: cache}):
+            allowed, remaining, reset, retry_after = consume("key", 3, 60, now=0)
+
+        self.assertEqual((allowed, remaining, reset, retry_after), (True, 2, 20.0, 0))
+        script, numkeys, key, *args = client.eval.call_args.args
+        self.assertEqual(script, GCRA_SCRIPT)
+        self.assertEqual((numkeys, key), (1, ":1:key"))
+        self.assertEqual(args, ["0", "20.0", "60", 61])
+
+
+@override_settings(APP_CONFIG=replace(settings.APP_CONFIG, rate_limits="test=2/min"))
+class RateLimitDecoratorTest(SimpleTestCase):
+    def setUp(self):
+        caches[RATELIMIT_CACHE_ALIAS].clear()
+        self.factory = RequestFactory()
+        self.view = rate_limit("test")(lambda r: JsonResponse({"success": "True"}))
+
+    def _request(self, pk):
+        request = self.factory.post("/api/openai/")
+        request.user = User(pk=pk)
+        return request
+
+    def test_rate_limit_per_user(self):
+        """ユーザーごとに回数が制限され、429とRetry-Afterを返すことを確認するテスト"""
+        first = self.view(self._request(1))
+        self.view(self._request(1))
+        limited = self.view(self._request(1))
+        other_user = self.view(self._request(2))
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["RateLimit-Limit"], "2")
+        self.assertEqual(first["RateLimit-Remaining"], "1")
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(json.loads(limited.content), {"error": "Rate limit exceeded"})
+        self.assertEqual(limited["Retry-After"], "30")
+        self.assertEqual(other_user.status_code, 200)
+
+    def test_unconfigured_scope_is_not_limited(self):
+        view = rate_limit("other")(lambda r: JsonResponse({"success": "True"}))
+        response = view(self._request(1))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("RateLimit-Limit"))
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    def test_warns_on_per_process_cache(self):
+        self.assertEqual(
+            [error.id for error in check_shared_ratelimit_cache(None)],
+            ["rag_sample_app.W001"],
+        )
+        caches_setting = {
+            **settings.CACHES,
+            RATELIMIT_CACHE_ALIAS: {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache"
+            },
+        }
+        with override_settings(CACHES=caches_setting):
+            self.assertEqual(check_shared_ratelimit_cache(None), [])
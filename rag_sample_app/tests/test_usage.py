@@ -0,0 +1,106 @@
+import datetime
+from dataclasses import replace
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rag_sample_app.models import TurnUsage
+from rag_sample_app.usage import (
+    BudgetExceeded,
+    aggregate_usage,
+    check_budget,
+    record_usage,
+    tokens_used_today,
+)
+
+
+class RecordUsageTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+
+    def test_record_usage(self):
+        """レスポンスのusageとレイテンシが保存されることを確認するテスト"""
+        response = SimpleNamespace(
+            model="gpt-4o",
+            usage=SimpleNamespace(
+                prompt_tokens=100, completion_tokens=20, total_tokens=120
+            ),
+        )
+        usage = record_usage(self.user, response, 1.2345)
+        self.assertEqual(usage.model, "gpt-4o")
+        self.assertEqual(usage.prompt_tokens, 100)
+        self.assertEqual(usage.completion_tokens, 20)
+        self.assertEqual(usage.total_tokens, 120)
+        self.assertEqual(usage.latency_ms, 1234)
+        self.assertEqual(usage.cached_tokens, 0)
+
+    def test_record_cached_tokens(self):
+        """プロンプトキャッシュが効いたトークン数が保存されることを確認するテスト"""
+        response = SimpleNamespace(
+            usage=SimpleNamespace(
+                prompt_tokens=2048,
+                completion_tokens=20,
+                total_tokens=2068,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=1920),
+            ),
+        )
+        usage = record_usage(self.user, response, 0.5)
+        self.assertEqual(usage.cached_tokens, 1920)
+        rows = aggregate_usage(TurnUsage.objects.all(), "day")
+        self.assertEqual(rows[0]["cached_tokens"], 1920)
+
+    def test_record_usage_without_usage(self):
+        """usageが返らない場合は0として保存されることを確認するテスト"""
+        usage = record_usage(self.user, SimpleNamespace(), 0.5)
+        self.assertEqual(usage.total_tokens, 0)
+        self.assertEqual(usage.model, "")
+
+
+class BudgetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+
+    def test_yesterday_is_not_counted(self):
+        """前日の使用量は当日の合計に含まれないことを確認するテスト"""
+        usage = TurnUsage.objects.create(creator=self.user, total_tokens=500)
+        TurnUsage.objects.filter(pk=usage.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=1, hours=1)
+        )
+        TurnUsage.objects.create(creator=self.user, total_tokens=30)
+        self.assertEqual(tokens_used_today(self.user), 30)
+
+    @override_settings(APP_CONFIG=replace(settings.APP_CONFIG, daily_token_budget=100))
+    def test_check_budget(self):
+        """上限に達するとBudgetExceededを送出し、翌日までの秒数を返すテスト"""
+        TurnUsage.objects.create(creator=self.user, total_tokens=99)
+        check_budget(self.user)
+
+        TurnUsage.objects.create(creator=self.user, total_tokens=1)
+        with self.assertRaises(BudgetExceeded) as cm:
+            check_budget(self.user)
+        self.assertTrue(1 <= cm.exception.retry_after <= 86400)
+
+    @override_settings(APP_CONFIG=replace(settings.APP_CONFIG, daily_token_budget=0))
+    def test_unlimited_budget(self):
+        """上限が0の場合は制限しないことを確認するテスト"""
+        TurnUsage.objects.create(creator=self.user, total_tokens=10**9)
+        check_budget(self.user)
+
+
+class AggregateUsageTest(TestCase):
+    def test_aggregate_by_day(self):
+        """日ごとに合計と平均レイテンシが集計されることを確認するテスト"""
+        user = User.objects.create(username="testuser")
+        TurnUsage.objects.create(creator=user, total_tokens=10, latency_ms=100)
+        TurnUsage.objects.create(creator=user, total_tokens=30, latency_ms=300)
+
+        rows = aggregate_usage(TurnUsage.objects.all(), "day")
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["day"], timezone.localdate())
+        self.assertEqual(rows[0]["turns"], 2)
+        self.assertEqual(rows[0]["total_tokens"], 40)
+        self.assertEqual(rows[0]["avg_latency_ms"], 200)
@@ -1,5 +1,4 @@
 import json  # 追加
-import os
 from unittest.mock import Mock, patch
 
 import jwt
@@ -7,9 +6,13 @@ from django.contrib.auth import get_user_model
 from django.db import IntegrityError
 from django.http import JsonResponse
 from django.test import RequestFactory, TestCase
-from dotenv import load_dotenv
 
-from rag_sample_app.utils import get_cognito_public_keys, jwt_required, load_environment
+from rag_sample_app.utils import (
+    clear_public_key_cache,
+    get_cognito_public_keys,
+    get_public_key,
+    jwt_required,
+)
 
 User = get_user_model()
 
@@ -39,6 +42,7 @@ JWKS_MOCK_RESPONSE = {
 class JWTRequiredDecoratorTest(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
+        clear_public_key_cache()
 
     @patch("rag_sample_app.utils.get_cognito_public_keys")
     def test_missing_authorization_header(self, mock_get_cognito_public_keys):
@@ -240,39 +244,13 @@ class JWTRequiredDecoratorTest(TestCase):
         self.assertIn("test_kid_2", keys)
         self.assertEqual(len(keys), 2)
 
-    # 環境変数のテスト
-    @patch("os.getenv")
-    @patch("rag_sample_app.utils.load_dotenv")
-    def test_load_production_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが"production"であることをシミュレート
-        mock_getenv.return_value = "production"
-
-        # テスト対象のコードを実行
-        load_environment()
-
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.production")
-
-    @patch("os.getenv")
-    @patch("rag_sample_app.utils.load_dotenv")
-    def test_load_development_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが設定されていない（デフォルトは "development"）
-        mock_getenv.return_value = None
-
-        # テスト対象のコードを実行
-        load_environment()
-
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.development")
-
-    @patch("os.getenv")
-    @patch("rag_sample_app.utils.load_dotenv")
-    def test_load_staging_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが"staging"であることをシミュレート
-        mock_getenv.return_value = "staging"
-
-        # テスト対象のコードを実行
-        load_environment()
-
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.development")
+    @patch("rag_sample_app.utils.get_cognito_public_keys")
+    def test_public_keys_are_cached(self, mock_get_cognito_public_keys):
+        """公開鍵はキャッシュされ、リクエストごとに取得しないことを確認するテスト"""
+        mock_get_cognito_public_keys.return_value = {"kid": "public_key"}
+
+        self.assertEqual(get_public_key("kid"), "public_key")
+        self.assertEqual(get_public_key("kid"), "public_key")
+        # 直前に取得したばかりなので、未知のkidでも取得し直さない
+        self.assertIsNone(get_public_key("unknown"))
+        mock_get_cognito_public_keys.assert_called_once()
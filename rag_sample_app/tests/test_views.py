@@ -1,15 +1,39 @@
+import csv
+import datetime
+import io
+import json
+from dataclasses import replace
 from functools import wraps
+from types import SimpleNamespace
 from unittest import mock
 from unittest.mock import ANY, MagicMock, patch
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import SimpleTestCase, TestCase
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
-from requests.exceptions import JSONDecodeError
+from django.utils import timezone
+from requests.exceptions import JSONDecodeError, Timeout
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from rag_sample_app.models import ChatHistory, Document, Thread
+from rag_sample_app.admission import AdmissionRejected
+from rag_sample_app.archive import archive_thread
+from rag_sample_app.idempotency import request_hash
+from rag_sample_app.interview import save_turn
+from rag_sample_app.llm import CompletionTimeout
+from rag_sample_app.metrics import metrics
+from rag_sample_app.models import (
+    ChatHistory,
+    Company,
+    DailyActivity,
+    Document,
+    IdempotencyRecord,
+    Thread,
+    TurnUsage,
+)
+from rag_sample_app.resilience import Deadline
 
 DUMMY_THREAD_ID = "e554463c-05e3-e0a1-60fe-8f1805a223eb"  # gitleaks:allow
 
@@ -25,16 +49,21 @@ def _mock_jwt_required(view_func):
 
 # jwt_requiredを書き換えるために、Viewsを読み込む前にmock化をする
 mock.patch("rag_sample_app.utils.jwt_required", _mock_jwt_required).start()
+from rag_sample_app.retrieval import retrieval_breaker
+from rag_sample_app.search_cache import search_cache
+from rag_sample_app.serializers import DocumentSerializer
+from rag_sample_app.throttling import RATELIMIT_CACHE_ALIAS
 from rag_sample_app.views import (
     generate_and_save_summary,
     get_openai_response,
     limit_string_length,
-    load_environment,
 )
 
 
 class APITestBase(APITestCase):
     def setUp(self):
+        caches[RATELIMIT_CACHE_ALIAS].clear()
+        search_cache.clear()
         self.user = User.objects.create(username="testuser", email="test@example.com")
         self.client.force_authenticate(user=self.user)
 
@@ -56,7 +85,7 @@ class ChatHistoryListCreateTest(APITestBase):
         data = {
             "thread_id": self.thread.id,
             "message": "Hello world",
-            "sender": self.user.username,
+            "sender": "USER",
         }
         response = self.client.post(url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -72,6 +101,114 @@ class ChatHistoryListCreateTest(APITestBase):
         self.assertEqual(response.data, {"error": "Thread not found"})
 
 
+class ConditionalGetTest(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.thread = Thread.objects.create(
+            creator=self.user, summary="summary", first_message="Hello!"
+        )
+        ChatHistory.objects.create(thread_id=self.thread, message="Hi", sender="USER")
+
+    def assert_not_modified(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        return etag
+
+    def test_chat_history_not_modified(self):
+        """履歴が変わっていなければ304を返し、追加されると新しいETagになることを確認するテスト"""
+        url = reverse("chat-history-list")
+        params = {"thread_id": self.thread.id}
+        etag = self.assert_not_modified(url, params)
+
+        ChatHistory.objects.create(thread_id=self.thread, message="Yo", sender="AI")
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data), 2)
+
+    def test_chat_history_not_modified_skips_history_query(self):
+        """304の場合は履歴を読み込まずに、集計のクエリだけで応答することを確認するテスト"""
+        url = reverse("chat-history-list")
+        params = {"thread_id": self.thread.id}
+        etag = self.client.get(url, params)["ETag"]
+        with self.assertNumQueries(3):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_all_threads_not_modified(self):
+        """スレッドの追加・要約の更新・削除でETagが変わることを確認するテスト"""
+        url = reverse("all-threads")
+        etag = self.assert_not_modified(url)
+
+        other = Thread.objects.create(creator=self.user, summary="new")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = self.assert_not_modified(url)
+
+        other.summary = "changed"
+        other.save()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_200_OK,
+        )
+        etag = self.assert_not_modified(url)
+
+        Thread.objects.filter(id=other.id).soft_delete()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_all_threads_settles_while_summary_is_empty(self):
+        """ユーザーの入力がまだないスレッドがあっても、2回目以降のポーリングは304になるテスト"""
+        thread = Thread.objects.create(creator=self.user, first_message="Hello!")
+        url = reverse("all-threads")
+        etag = self.assert_not_modified(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 最初の回答を保存すると、要約を作るためにETagが変わる
+        completion = SimpleNamespace(
+            model="gpt-4o",
+            usage=None,
+            choices=[SimpleNamespace(message=SimpleNamespace(content="志望動機は？"))],
+        )
+        save_turn(self.user, thread, "エンジニアです", completion, 0.1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summaries = [row["summary"] for row in response.data["threads"]]
+        self.assertIn("エンジニアです", summaries)
+
+    def test_all_threads_etag_after_generating_summary(self):
+        """要約を作って保存したレスポンスには、保存後の状態のETagが付くテスト"""
+        thread = Thread.objects.create(creator=self.user, first_message="Hello!")
+        ChatHistory.objects.create(thread_id=thread, message="Hi", sender="USER")
+        url = reverse("all-threads")
+        response = self.client.get(url)
+        self.assertEqual(response.data["threads"][0]["summary"], "Hi")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_first_message_not_modified(self):
+        """初回メッセージをGETで取得でき、2回目以降は304を返すことを確認するテスト"""
+        url = reverse("get-first-message", args=[self.thread.id])
+        self.assert_not_modified(url)
+
+    def test_etag_is_per_thread(self):
+        """他のスレッドのETagでは304にならないことを確認するテスト"""
+        other = Thread.objects.create(creator=self.user, first_message="Hello!")
+        etag = self.client.get(reverse("get-first-message", args=[self.thread.id]))[
+            "ETag"
+        ]
+        response = self.client.get(
+            reverse("get-first-message", args=[other.id]), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
 class DocumentListTest(APITestBase):
     def setUp(self):
         super().setUp()
@@ -84,11 +221,18 @@ class DocumentListTest(APITestBase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_documents_match_serializer(self):
+        """.values()で返すドキュメントが、DocumentSerializerと同じ形であることを確認するテスト"""
+        response = self.client.get(reverse("document-list"))
+        self.assertEqual(response.json(), [DocumentSerializer(self.document).data])
+
 
 class OpenAIResponseTest(APITestBase):
     def setUp(self):
         super().setUp()
         self.thread = Thread.objects.create(creator=self.user)
+        retrieval_breaker.reset()
+        metrics.reset()
 
     @patch("requests.get")
     @patch("openai.chat.completions.create")
@@ -147,8 +291,9 @@ class OpenAIResponseTest(APITestBase):
         self.assertIn("response", response.data)
 
     @patch("requests.get")
-    def test_json_decode_error(self, mock_get):
-        """response.json()でJSONDecodeErrorが発生した場合のテスト"""
+    @patch("openai.chat.completions.create")
+    def test_json_decode_error(self, mock_openai, mock_get):
+        """response.json()でJSONDecodeErrorが発生した場合、ドキュメントなしで続行するテスト"""
 
         # requests.getのモックレスポンスを設定
         mock_response = MagicMock()
@@ -156,29 +301,65 @@ class OpenAIResponseTest(APITestBase):
         # response.json()が呼ばれた時にJSONDecodeErrorを発生させる
         mock_response.json.side_effect = JSONDecodeError("Expecting value", "", 0)
         mock_get.return_value = mock_response
+        mock_openai.return_value.choices[0].message.content = "AI response"
 
         url = reverse("openai-response")
         data = {"search_word": "search", "thread_id": self.thread.id}
         response = self.client.post(url, data, format="json")
 
-        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
-        self.assertIn("error", response.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        messages = mock_openai.call_args.kwargs["messages"]
+        self.assertEqual(messages[-1], {"role": "user", "content": "search"})
 
     @patch("requests.get")
-    def test_search_service_error(self, mock_get):
-        """searchserviceで異常ステータスが帰ってきた場合のテスト"""
+    @patch("openai.chat.completions.create")
+    def test_search_service_error(self, mock_openai, mock_get):
+        """searchserviceで異常ステータスが帰ってきた場合、ドキュメントなしで続行するテスト"""
 
         # requests.getのモックレスポンスを設定
         mock_response = MagicMock()
         mock_response.status_code = status.HTTP_404_NOT_FOUND
         mock_get.return_value = mock_response
+        mock_openai.return_value.choices[0].message.content = "AI response"
 
         url = reverse("openai-response")
         data = {"search_word": "search", "thread_id": self.thread.id}
         response = self.client.post(url, data, format="json")
 
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertIn("error", response.data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"response": "AI response"})
+        self.assertEqual(metrics.value("retrieval_failures_total", reason="error"), 1)
+
+    @patch("requests.get")
+    @patch("openai.chat.completions.create")
+    def test_search_timeout(self, mock_openai, mock_get):
+        """検索が持ち時間内に終わらない場合、ドキュメントなしで続行するテスト"""
+        mock_get.side_effect = Timeout()
+        mock_openai.return_value.choices[0].message.content = "AI response"
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(mock_get.call_args.kwargs["timeout"], 3)
+        self.assertEqual(metrics.value("retrieval_failures_total", reason="timeout"), 1)
+
+    @patch("requests.get")
+    @patch("openai.chat.completions.create")
+    def test_search_skipped_when_circuit_open(self, mock_openai, mock_get):
+        """サーキットブレーカーが開いている場合、検索せずに続行するテスト"""
+        for _ in range(retrieval_breaker.failure_threshold):
+            retrieval_breaker.record_failure()
+        mock_openai.return_value.choices[0].message.content = "AI response"
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_get.assert_not_called()
+        self.assertEqual(metrics.value("retrieval_circuit_state"), 2)
 
     @patch("requests.get")
     @patch("openai.chat.completions.create")
@@ -216,6 +397,178 @@ class OpenAIResponseTest(APITestBase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("response", response.data)
 
+    @patch("requests.get")
+    @patch("openai.chat.completions.create")
+    def test_idempotency_key_replays_result(self, mock_openai, mock_requests):
+        """同じIdempotency-Keyで再送された場合、保存済みの結果が返されることを確認するテスト"""
+        mock_requests.return_value.status_code = status.HTTP_200_OK
+        mock_requests.return_value.json.return_value = {"value": []}
+        mock_openai.return_value.choices[0].message.content = "AI response"
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        first = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        second = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, {"response": "AI response"})
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(mock_openai.call_count, 1)
+        self.assertEqual(ChatHistory.objects.filter(thread_id=self.thread).count(), 2)
+
+    @patch("requests.get")
+    @patch("rag_sample_app.views.create_chat_completion")
+    def test_idempotency_key_not_stored_on_error(self, mock_completion, mock_get):
+        """エラーになった結果は保存されず、再送で再実行されることを確認するテスト"""
+        mock_get.return_value.status_code = status.HTTP_200_OK
+        mock_get.return_value.json.return_value = {"value": []}
+        mock_completion.side_effect = AdmissionRejected(1)
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k2")
+
+        self.assertFalse(IdempotencyRecord.objects.filter(key="k2").exists())
+
+    def test_idempotency_key_in_progress(self):
+        """同じIdempotency-Keyのリクエストが処理中の場合、409エラーを返すテスト"""
+        IdempotencyRecord.objects.create(creator=self.user, key="k3")
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k3")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_idempotency_key_with_different_request(self):
+        """同じIdempotency-Keyで内容の異なるリクエストは、保存済みの結果を返さずに422を返すテスト"""
+        IdempotencyRecord.objects.create(
+            creator=self.user,
+            key="k4",
+            request_hash=request_hash(
+                {"search_word": "search", "thread_id": str(self.thread.id)}
+            ),
+            status_code=200,
+            response={"response": "AI response"},
+        )
+
+        url = reverse("openai-response")
+        data = {"search_word": "other", "thread_id": str(self.thread.id)}
+        response = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k4")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @patch("requests.get")
+    @patch("rag_sample_app.views.create_chat_completion")
+    def test_abandoned_idempotency_key_is_taken_over(self, mock_completion, mock_get):
+        """処理中のまま持ち時間を過ぎた記録は、再送したリクエストが引き継いで実行するテスト"""
+        mock_get.return_value.status_code = status.HTTP_200_OK
+        mock_get.return_value.json.return_value = {"value": []}
+        mock_completion.return_value.choices[0].message.content = "AI response"
+        record = IdempotencyRecord.objects.create(creator=self.user, key="k5")
+        IdempotencyRecord.objects.filter(pk=record.pk).update(
+            created_at=timezone.now() - datetime.timedelta(minutes=5)
+        )
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY="k5")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        record.refresh_from_db()
+        self.assertEqual(record.status_code, status.HTTP_200_OK)
+
+    @patch("rag_sample_app.views.turn_flight.do")
+    def test_duplicate_turns_share_key(self, mock_do):
+        """正規化後に同一の入力は同じキーでまとめられることを確認するテスト"""
+        mock_do.return_value = (({"response": "AI response"}, 200), True)
+
+        url = reverse("openai-response")
+        self.client.post(
+            url, {"search_word": "ＡＢＣ ", "thread_id": self.thread.id}, format="json"
+        )
+        self.client.post(
+            url, {"search_word": "ABC", "thread_id": self.thread.id}, format="json"
+        )
+
+        first_key = mock_do.call_args_list[0][0][0]
+        second_key = mock_do.call_args_list[1][0][0]
+        self.assertEqual(first_key, second_key)
+
+    @patch("requests.get")
+    @patch("rag_sample_app.views.create_chat_completion")
+    def test_post_openai_response_overloaded(self, mock_completion, mock_requests):
+        """OpenAIの呼び出し枠が空いていない場合、503とRetry-Afterを返すテスト"""
+        mock_requests.return_value.status_code = status.HTTP_200_OK
+        mock_requests.return_value.json.return_value = {"value": []}
+        mock_completion.side_effect = AdmissionRejected(12.5)
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "13")
+        self.assertEqual(ChatHistory.objects.filter(thread_id=self.thread).count(), 0)
+
+    @override_settings(
+        APP_CONFIG=replace(settings.APP_CONFIG, rate_limits="openai=1/min")
+    )
+    @patch("rag_sample_app.views.turn_flight.do")
+    def test_rate_limited(self, mock_do):
+        """ユーザーごとの回数制限を超えた場合、OpenAIを呼び出さずに429を返すテスト"""
+        mock_do.return_value = (({"response": "AI response"}, 200), False)
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        first = self.client.post(url, data, format="json")
+        second = self.client.post(url, data, format="json")
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first["RateLimit-Remaining"], "0")
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", second)
+        mock_do.assert_called_once()
+
+    @patch("requests.get")
+    @patch("openai.chat.completions.create")
+    def test_usage_recorded(self, mock_openai, mock_requests):
+        """OpenAIのusageがターンごとに保存されることを確認するテスト"""
+        mock_requests.return_value.status_code = status.HTTP_200_OK
+        mock_requests.return_value.json.return_value = {"value": []}
+        mock_openai.return_value.choices[0].message.content = "AI response"
+        mock_openai.return_value.model = "gpt-4o"
+        mock_openai.return_value.usage.prompt_tokens = 120
+        mock_openai.return_value.usage.completion_tokens = 30
+        mock_openai.return_value.usage.total_tokens = 150
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        usage = TurnUsage.objects.get(creator=self.user)
+        self.assertEqual(usage.thread, self.thread)
+        self.assertEqual(usage.chat.message, "AI response")
+        self.assertEqual(usage.model, "gpt-4o")
+        self.assertEqual(usage.total_tokens, 150)
+
+    @override_settings(APP_CONFIG=replace(settings.APP_CONFIG, daily_token_budget=100))
+    @patch("rag_sample_app.views.turn_flight.do")
+    def test_budget_exceeded(self, mock_do):
+        """その日のトークン上限を超えたユーザーにはOpenAIを呼び出さずに429を返すテスト"""
+        TurnUsage.objects.create(creator=self.user, total_tokens=100)
+
+        url = reverse("openai-response")
+        data = {"search_word": "search", "thread_id": self.thread.id}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.data, {"error": "Daily token budget exceeded"})
+        self.assertIn("Retry-After", response)
+        mock_do.assert_not_called()
+
 
 class ThreadSummaryTest(APITestBase):
     def setUp(self):
@@ -250,6 +603,60 @@ class ThreadSummaryTest(APITestBase):
         self.assertEqual(response.data, {"summary": "test"})
 
 
+class ThreadEvaluationTest(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.thread = Thread.objects.create(creator=self.user, first_message="ようこそ")
+        ChatHistory.objects.create(
+            thread_id=self.thread, message="山田です", sender="USER"
+        )
+        self.url = reverse("thread-evaluation", args=[self.thread.id])
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_get_thread_evaluation(self, mock_completion):
+        """評価レポートを作成し、２回目は保存したレポートを返すことを確認するテスト"""
+        mock_completion.return_value.choices[0].message.content = (
+            '{"scores": {"logic": 4}, "strengths": [], "weaknesses": []}'
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["scores"], {"logic": 4.0})
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["scores"], {"logic": 4.0})
+        self.assertEqual(mock_completion.call_count, 1)
+
+    def test_thread_not_found(self):
+        response = self.client.get(reverse("thread-evaluation", args=[DUMMY_THREAD_ID]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_empty_thread(self):
+        thread = Thread.objects.create(creator=self.user)
+        response = self.client.get(reverse("thread-evaluation", args=[thread.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_overloaded(self, mock_completion):
+        mock_completion.side_effect = AdmissionRejected(5)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "5")
+
+    @override_settings(
+        APP_CONFIG=replace(settings.APP_CONFIG, rate_limits="evaluation=1/min")
+    )
+    @patch("rag_sample_app.evaluation.create_chat_completion")
+    def test_rate_limited(self, mock_completion):
+        """評価の作り直しだけが回数制限の対象になることを確認するテスト"""
+        mock_completion.return_value.choices[0].message.content = "{}"
+        self.client.get(self.url)
+        ChatHistory.objects.create(thread_id=self.thread, message="追加", sender="USER")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+
+
 class CreateNewThreadTest(APITestBase):
     @patch("rag_sample_app.views.get_openai_response")
     def test_create_new_thread(self, mock_openai_response):
@@ -260,16 +667,165 @@ class CreateNewThreadTest(APITestBase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertIn("thread_id", response.data)
 
+    @patch("rag_sample_app.views.get_openai_response")
+    def test_create_new_thread_overloaded(self, mock_openai_response):
+        """OpenAIの呼び出し枠が空いていない場合、スレッドを作成せずに503を返すテスト"""
+        mock_openai_response.side_effect = AdmissionRejected(3)
+        url = reverse("new-thread")
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertFalse(Thread.objects.filter(creator=self.user).exists())
+
+    @patch("rag_sample_app.views.create_chat_completion")
+    def test_create_new_thread_timeout(self, mock_completion):
+        """挨拶の生成が持ち時間内に終わらない場合、スレッドを作成せずに504を返すテスト"""
+        mock_completion.side_effect = CompletionTimeout()
+        response = self.client.post(reverse("new-thread"))
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(response.data, {"error": "The AI service timed out"})
+        self.assertFalse(Thread.objects.filter(creator=self.user).exists())
+        self.assertIsInstance(mock_completion.call_args.kwargs["deadline"], Deadline)
+
+    @patch("openai.chat.completions.create")
+    def test_create_new_thread_records_usage(self, mock_openai):
+        """最初のメッセージの使用量が新しいスレッドに紐づけて保存されることを確認するテスト"""
+        mock_openai.return_value.choices[0].message.content = "Initial response"
+        mock_openai.return_value.usage.total_tokens = 42
+        response = self.client.post(reverse("new-thread"))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        usage = TurnUsage.objects.get(creator=self.user)
+        self.assertEqual(str(usage.thread_id), response.data["thread_id"])
+        self.assertEqual(usage.total_tokens, 42)
+
+    @patch("rag_sample_app.views.get_openai_response")
+    def test_create_new_thread_for_company(self, mock_openai_response):
+        """所属する企業のスレッドを作り、所属していない企業は404にするテスト"""
+        mock_openai_response.return_value = "Initial response"
+        acme = Company.objects.create(slug="acme", name="Acme", search_index="acme")
+        other = Company.objects.create(slug="other", name="Other", search_index="o")
+        acme.members.add(self.user)
+
+        response = self.client.post(reverse("new-thread"))
+        thread = Thread.objects.get(id=response.data["thread_id"])
+        self.assertEqual(thread.company, acme)
+
+        response = self.client.post(reverse("new-thread"), {"company": other.slug})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch("openai.chat.completions.create")
+    def test_interviewer_is_kept_for_thread(self, mock_openai):
+        """最初のメッセージと以降のターンで同じシステムプロンプトを使うことを確認するテスト"""
+        mock_openai.return_value.choices[0].message.content = "Initial response"
+        response = self.client.post(reverse("new-thread"))
+        thread = Thread.objects.get(id=response.data["thread_id"])
+        greeting_system = mock_openai.call_args.kwargs["messages"][0]
+        self.assertIn(thread.interviewer, greeting_system["content"])
+
+        with patch("rag_sample_app.views.retrieve_for_turn", return_value=[]):
+            self.client.post(
+                reverse("openai-response"),
+                {"search_word": "山田です", "thread_id": thread.id},
+                format="json",
+            )
+        self.assertEqual(mock_openai.call_args.kwargs["messages"][0], greeting_system)
+
+
+class UsageSummaryTest(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.thread = Thread.objects.create(creator=self.user)
+        other = User.objects.create(username="other")
+        TurnUsage.objects.create(creator=self.user, thread=self.thread, total_tokens=10)
+        TurnUsage.objects.create(creator=self.user, thread=self.thread, total_tokens=20)
+        TurnUsage.objects.create(creator=other, total_tokens=1000)
+
+    def test_usage_by_thread(self):
+        """自分の使用量だけがスレッドごとに集計されることを確認するテスト"""
+        response = self.client.get(reverse("usage-summary"), {"group_by": "thread"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["usage"]), 1)
+        self.assertEqual(response.data["usage"][0]["thread"], self.thread.id)
+        self.assertEqual(response.data["usage"][0]["turns"], 2)
+        self.assertEqual(response.data["usage"][0]["total_tokens"], 30)
+        self.assertEqual(response.data["today"]["total_tokens"], 30)
+
+    def test_usage_by_user_requires_staff(self):
+        """ユーザーごとの集計は管理者以外には403を返すテスト"""
+        response = self.client.get(reverse("usage-summary"), {"group_by": "user"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("usage-summary"), {"group_by": "user"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row["user"], row["total_tokens"]) for row in response.data["usage"]],
+            [("other", 1000), ("testuser", 30)],
+        )
+
+    def test_invalid_group_by(self):
+        """group_byが不正な場合に400を返すテスト"""
+        response = self.client.get(reverse("usage-summary"), {"group_by": "model"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivitySummaryTest(APITestBase):
+    def test_activity_requires_staff(self):
+        """集計済みの利用状況だけを管理者に返すテスト"""
+        DailyActivity.objects.create(
+            date=timezone.localdate(), user=self.user, threads=2, turns=5, messages=10
+        )
+        response = self.client.get(reverse("activity-summary"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("activity-summary"), {"days": "7"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["activity"][0]["average_turns"], 2.5)
+        self.assertIsNone(response.data["rolled_up_until"])
+
 
 class DeleteThreadTest(APITestBase):
     def setUp(self):
         super().setUp()
         self.thread = Thread.objects.create(creator=self.user)
 
-    def test_delete_thread(self):
+    @patch("rag_sample_app.views.schedule_purge")
+    def test_delete_thread(self, mock_schedule):
         url = reverse("delete-thread", args=[self.thread.id])
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Thread.objects.filter(id=self.thread.id).exists())
+        mock_schedule.assert_called_once_with([self.thread.id])
+
+    @patch("rag_sample_app.views.schedule_purge")
+    def test_delete_threads(self, mock_schedule):
+        """複数のスレッドをまとめて削除し、他のユーザーのスレッドは削除しないテスト"""
+        mine = Thread.objects.create(creator=self.user)
+        other = Thread.objects.create(creator=User.objects.create(username="other"))
+        url = reverse("delete-threads")
+        data = {"thread_ids": [str(self.thread.id), str(mine.id), str(other.id)]}
+        response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(
+            response.data["deleted"], [str(self.thread.id), str(mine.id)]
+        )
+        self.assertFalse(Thread.objects.filter(creator=self.user).exists())
+        self.assertTrue(Thread.objects.filter(id=other.id).exists())
+        self.assertCountEqual(
+            mock_schedule.call_args.args[0], [self.thread.id, mine.id]
+        )
+
+    def test_delete_threads_invalid(self):
+        """thread_idsが不正な場合に400を返すテスト"""
+        url = reverse("delete-threads")
+        response = self.client.post(url, {"thread_ids": ["abc"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_delete_thread_does_not_found(self):
 
@@ -371,7 +927,7 @@ class GenerateAndSaveSummaryTest(TestCase):
 
 class GetOpenAIResponseTest(SimpleTestCase):
 
-    @patch("rag_sample_app.views.openai.chat.completions.create")
+    @patch("openai.chat.completions.create")
     def test_get_openai_response(self, mock_openai_create):
         """OpenAIのAPIレスポンスが正常に取得されることを確認するテスト"""
         # モックのレスポンスを設定
@@ -460,40 +1016,106 @@ class AllThreadsTest(APITestBase):
         )  # サマリー生成関数が呼ばれたことを確認
 
 
-class EnvironmentTest(TestCase):
-    # 環境変数のテスト
-    @patch("os.getenv")
-    @patch("rag_sample_app.views.load_dotenv")
-    def test_load_production_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが"production"であることをシミュレート
-        mock_getenv.return_value = "production"
+class ExportTest(APITestBase):
+    def setUp(self):
+        super().setUp()
+        # 通常のDjangoのビューなので、セッションでログインする
+        self.client.force_login(self.user)
+        self.thread = Thread.objects.create(
+            creator=self.user, first_message="自己紹介を"
+        )
+        self.chats = [
+            ChatHistory.objects.create(
+                thread_id=self.thread, message=f"回答{i}", sender="USER"
+            )
+            for i in range(3)
+        ]
+        other = User.objects.create(username="other")
+        Thread.objects.create(creator=other, first_message="他のユーザー")
+
+    def export(self, **params):
+        response = self.client.get(reverse("export"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content).decode()
 
-        # テスト対象のコードを実行
-        load_environment()
+    def test_export_ndjson(self):
+        """初回メッセージとチャット履歴が、自分のスレッドの分だけ１行ずつ返されるテスト"""
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual(
+            [row["message"] for row in rows], ["自己紹介を", "回答0", "回答1", "回答2"]
+        )
+        self.assertEqual(rows[0]["sender"], "AI")
+        self.assertEqual(rows[1]["message_id"], self.chats[0].pk)
+        self.assertEqual({row["thread_id"] for row in rows}, {str(self.thread.pk)})
+
+    def test_export_csv(self):
+        response = self.client.get(reverse("export"), {"format": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[3]["message"], "回答2")
+
+    def test_resume_from_cursor(self):
+        """行のcursorを指定すると、その行の次から再開されるテスト"""
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        second = Thread.objects.create(creator=self.user, first_message="次の面接")
+
+        resumed = [
+            json.loads(line)
+            for line in self.export(cursor=rows[1]["cursor"]).splitlines()
+        ]
+        self.assertEqual(resumed[:2], rows[2:])
+        self.assertEqual(resumed[2]["thread_id"], str(second.pk))
 
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.production")
+    def test_export_archived_thread(self):
+        """アーカイブ済みの履歴と、その後の履歴が順に返されるテスト"""
+        archive_thread(self.thread)
+        ChatHistory.objects.create(thread_id=self.thread, message="追加", sender="AI")
 
-    @patch("os.getenv")
-    @patch("rag_sample_app.views.load_dotenv")
-    def test_load_development_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが設定されていない（デフォルトは "development"）
-        mock_getenv.return_value = None
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual(
+            [row["message"] for row in rows],
+            ["自己紹介を", "回答0", "回答1", "回答2", "追加"],
+        )
+        resumed = self.export(cursor=rows[2]["cursor"]).splitlines()
+        self.assertEqual(
+            [json.loads(line)["message"] for line in resumed], ["回答2", "追加"]
+        )
 
-        # テスト対象のコードを実行
-        load_environment()
+    async def test_export_under_asgi(self):
+        """ASGIでは、全体を読み込まずに非同期のイテレーターで返すことを確認するテスト"""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("export"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(
+            [row["message"] for row in rows], ["自己紹介を", "回答0", "回答1", "回答2"]
+        )
 
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.development")
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse("export"), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"error": "Invalid cursor"})
+        response = self.client.get(reverse("export"), {"format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-    @patch("os.getenv")
-    @patch("rag_sample_app.views.load_dotenv")
-    def test_load_staging_env(self, mock_load_dotenv, mock_getenv):
-        # ENVが"staging"であることをシミュレート
-        mock_getenv.return_value = "staging"
 
-        # テスト対象のコードを実行
-        load_environment()
+class MetricsViewTest(SimpleTestCase):
+    @override_settings(APP_CONFIG=replace(settings.APP_CONFIG, metrics_token=None))
+    def test_disabled_without_token(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
-        # 正しいファイルが読み込まれたか確認
-        mock_load_dotenv.assert_called_once_with(".env.development")
+    @override_settings(APP_CONFIG=replace(settings.APP_CONFIG, metrics_token="secret"))
+    def test_metrics(self):
+        """トークンを指定するとPrometheus形式のメトリクスが返されるテスト"""
+        unauthorized = self.client.get(reverse("metrics"))
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(unauthorized.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b"retrieval_circuit_state", response.content)
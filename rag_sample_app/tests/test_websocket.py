@@ -0,0 +1,266 @@
+import json
+from dataclasses import replace
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rag_sample_app.admission import AdmissionRejected
+from rag_sample_app.models import ChatHistory, Thread, TurnUsage
+from rag_sample_app.retrieval import retrieval_breaker
+from rag_sample_app.search_cache import search_cache
+from rag_sample_app.throttling import RATELIMIT_CACHE_ALIAS
+from rag_sample_app.utils import AuthenticationFailed
+from rag_sample_app.websocket import _retrieve, interview_websocket
+from rag_sample_django.asgi import application
+
+SCOPE = {"type": "websocket", "path": "/api/ws/interview/"}
+
+
+def chunk(content=None, usage=None):
+    choices = (
+        []
+        if content is None
+        else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    )
+    return SimpleNamespace(model="gpt-4o", choices=choices, usage=usage)
+
+
+def stream(*parts, total_tokens=30):
+    return iter(
+        [chunk(part) for part in parts]
+        + [
+            chunk(
+                usage=SimpleNamespace(
+                    prompt_tokens=20, completion_tokens=10, total_tokens=total_tokens
+                )
+            )
+        ]
+    )
+
+
+@patch("requests.get")
+@patch("rag_sample_app.websocket.authenticate_token")
+class InterviewWebSocketTest(TestCase):
+    def setUp(self):
+        caches[RATELIMIT_CACHE_ALIAS].clear()
+        retrieval_breaker.reset()
+        search_cache.clear()
+        self.user = User.objects.create(username="testuser")
+        self.thread = Thread.objects.create(
+            creator=self.user, first_message="自己紹介をどうぞ"
+        )
+        ChatHistory.objects.create(
+            thread_id=self.thread, message="山田です", sender="USER"
+        )
+        ChatHistory.objects.create(
+            thread_id=self.thread, message="よろしくお願いします", sender="AI"
+        )
+
+    async def connect(self, **auth):
+        communicator = ApplicationCommunicator(interview_websocket, SCOPE)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(), {"type": "websocket.accept"}
+        )
+        await self.send(communicator, {"type": "auth", "token": "token", **auth})
+        return communicator
+
+    async def send(self, communicator, data):
+        await communicator.send_input(
+            {"type": "websocket.receive", "text": json.dumps(data)}
+        )
+
+    async def receive(self, communicator):
+        message = await communicator.receive_output(timeout=5)
+        self.assertEqual(message["type"], "websocket.send")
+        return json.loads(message["text"])
+
+    async def test_turn_streams_tokens_and_saves_history(
+        self, mock_auth, mock_requests
+    ):
+        """トークンごとに送信し、ターンの結果がOpenAIResponseと同様に保存されることを確認するテスト"""
+        mock_auth.return_value = self.user
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+
+        with patch("openai.chat.completions.create") as mock_openai:
+            mock_openai.side_effect = [
+                stream("志望", "動機は？"),
+                stream("ありがとう", "ございます"),
+            ]
+            communicator = await self.connect(thread_id=str(self.thread.id))
+            self.assertEqual(
+                await self.receive(communicator),
+                {"type": "ready", "thread_id": str(self.thread.id)},
+            )
+
+            await self.send(
+                communicator, {"type": "turn", "search_word": "エンジニアです"}
+            )
+            self.assertEqual(
+                await self.receive(communicator), {"type": "token", "content": "志望"}
+            )
+            self.assertEqual(
+                await self.receive(communicator),
+                {"type": "token", "content": "動機は？"},
+            )
+            done = await self.receive(communicator)
+            self.assertEqual(done["type"], "done")
+            self.assertEqual(done["response"], "志望動機は？")
+
+            # ２ターン目は保存した履歴を読み込まずに、メモリ上の履歴を使う
+            await self.send(
+                communicator, {"type": "turn", "search_word": "御社の製品が好きです"}
+            )
+            await self.receive(communicator)
+            await self.receive(communicator)
+            done = await self.receive(communicator)
+            self.assertEqual(done["response"], "ありがとうございます")
+            await communicator.send_input(
+                {"type": "websocket.disconnect", "code": 1000}
+            )
+            await communicator.wait()
+
+        messages = mock_openai.call_args.kwargs["messages"]
+        self.assertEqual(
+            [message["content"] for message in messages[1:]],
+            [
+                "自己紹介をどうぞ",
+                "山田です",
+                "よろしくお願いします",
+                "エンジニアです",
+                "志望動機は？",
+                "御社の製品が好きです",
+            ],
+        )
+        self.assertTrue(mock_openai.call_args.kwargs["stream"])
+        chats = await ChatHistory.objects.filter(thread_id=self.thread).acount()
+        self.assertEqual(chats, 6)
+        usage = (
+            await TurnUsage.objects.filter(thread=self.thread)
+            .select_related("chat")
+            .order_by("id")
+            .afirst()
+        )
+        self.assertEqual(usage.total_tokens, 30)
+        self.assertEqual(usage.chat.message, "志望動機は？")
+
+    async def test_new_thread_is_created_on_first_turn(self, mock_auth, mock_requests):
+        """thread_idを指定しない場合は最初のターンでスレッドを作成することを確認するテスト"""
+        mock_auth.return_value = self.user
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+
+        with patch("openai.chat.completions.create", return_value=stream("こんにちは")):
+            communicator = await self.connect()
+            self.assertEqual(
+                await self.receive(communicator), {"type": "ready", "thread_id": None}
+            )
+            await self.send(
+                communicator, {"type": "turn", "search_word": "はじめまして"}
+            )
+            await self.receive(communicator)
+            done = await self.receive(communicator)
+
+        thread = await Thread.objects.exclude(id=self.thread.id).aget()
+        self.assertEqual(done["thread_id"], str(thread.id))
+
+    async def test_authentication_failed(self, mock_auth, mock_requests):
+        """認証に失敗した場合はエラーを送信して接続を閉じることを確認するテスト"""
+        mock_auth.side_effect = AuthenticationFailed({"error": "Token has expired"})
+        communicator = await self.connect()
+        self.assertEqual(
+            await self.receive(communicator),
+            {"type": "error", "status": 401, "error": "Token has expired"},
+        )
+        self.assertEqual(
+            await communicator.receive_output(),
+            {"type": "websocket.close", "code": 4401},
+        )
+
+    async def test_turn_before_auth(self, mock_auth, mock_requests):
+        """認証前のターンは拒否されることを確認するテスト"""
+        communicator = ApplicationCommunicator(interview_websocket, SCOPE)
+        await communicator.send_input({"type": "websocket.connect"})
+        await communicator.receive_output()
+        await self.send(communicator, {"type": "turn", "search_word": "hi"})
+        self.assertEqual((await self.receive(communicator))["status"], 401)
+        mock_auth.assert_not_called()
+
+    async def test_thread_not_found(self, mock_auth, mock_requests):
+        mock_auth.return_value = self.user
+        communicator = await self.connect(
+            thread_id="e554463c-05e3-e0a1-60fe-8f1805a223eb"
+        )
+        self.assertEqual((await self.receive(communicator))["status"], 404)
+
+    @override_settings(
+        APP_CONFIG=replace(settings.APP_CONFIG, rate_limits="openai=1/min")
+    )
+    async def test_rate_limited(self, mock_auth, mock_requests):
+        """HTTPと同じ回数制限がターンごとに適用されることを確認するテスト"""
+        mock_auth.return_value = self.user
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+
+        with patch("openai.chat.completions.create", return_value=stream("a")):
+            communicator = await self.connect(thread_id=str(self.thread.id))
+            await self.receive(communicator)
+            await self.send(communicator, {"type": "turn", "search_word": "1"})
+            await self.receive(communicator)
+            await self.receive(communicator)
+            await self.send(communicator, {"type": "turn", "search_word": "2"})
+            error = await self.receive(communicator)
+
+        self.assertEqual(error["status"], 429)
+        self.assertEqual(error["error"], "Rate limit exceeded")
+        self.assertGreaterEqual(error["retry_after"], 1)
+
+    async def test_overloaded(self, mock_auth, mock_requests):
+        """OpenAIの呼び出し枠がない場合は503のエラーを送信し、履歴を保存しないテスト"""
+        mock_auth.return_value = self.user
+        mock_requests.return_value.status_code = 200
+        mock_requests.return_value.json.return_value = {"value": []}
+
+        with patch("openai.chat.completions.create", side_effect=AdmissionRejected(7)):
+            communicator = await self.connect(thread_id=str(self.thread.id))
+            await self.receive(communicator)
+            await self.send(communicator, {"type": "turn", "search_word": "1"})
+            error = await self.receive(communicator)
+
+        self.assertEqual(error["status"], 503)
+        self.assertEqual(error["retry_after"], 7)
+        self.assertEqual(
+            await ChatHistory.objects.filter(thread_id=self.thread).acount(), 2
+        )
+
+
+class RetrieveWorkerTest(SimpleTestCase):
+    @patch("rag_sample_app.websocket.connection")
+    @patch("rag_sample_app.websocket.retrieve_for_turn")
+    def test_worker_connection_is_closed(self, mock_retrieve, mock_connection):
+        """検索のワーカーで開いたDBの接続を、失敗した場合も閉じることを確認するテスト"""
+        mock_retrieve.return_value = [{"content": "doc"}]
+        self.assertEqual(_retrieve(None, "質問", None), [{"content": "doc"}])
+        self.assertEqual(mock_connection.close.call_count, 1)
+
+        mock_retrieve.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            _retrieve(None, "質問", None)
+        self.assertEqual(mock_connection.close.call_count, 2)
+
+
+class ASGIRoutingTest(TestCase):
+    async def test_unknown_websocket_path_is_rejected(self):
+        communicator = ApplicationCommunicator(
+            application, {"type": "websocket", "path": "/unknown/"}
+        )
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(), {"type": "websocket.close"}
+        )
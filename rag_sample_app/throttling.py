@@ -0,0 +1,185 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+
+from rag_sample_django.config import get_config
+
+RATELIMIT_CACHE_ALIAS = "ratelimit"
+
+PERIODS = {"sec": 1, "min": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate):
+    """
+    "30/min" のような表記を (回数, 期間[秒]) にする
+    """
+    count, period = rate.split("/")
+    return int(count), PERIODS[period.strip()]
+
+
+def parse_rate_limits(value):
+    """
+    "openai=30/min,new-thread=10/min" のような表記をスコープごとのレートにする
+    """
+    rates = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        scope, rate = item.split("=")
+        rates[scope.strip()] = parse_rate(rate)
+    return rates
+
+
+# GCRAをRedisの中で１回の操作として実行するスクリプト（TATは文字列の数値で保存する）
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+if new_tat - now > burst then
+    return {0, tostring(tat)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'EX', ARGV[4])
+return {1, tostring(new_tat)}
+"""
+
+# Redis以外のキャッシュで、キーごとのロックを待つ時間[秒]と、ロックを持ったワーカーが停止した場合に解放されるまでの秒数
+LOCK_WAIT = 0.05
+LOCK_TIMEOUT = 2
+
+
+def _gcra_redis(cache, key, now, interval, burst, timeout):
+    client = cache._cache.get_client(key, write=True)
+    allowed, tat = client.eval(
+        GCRA_SCRIPT,
+        1,
+        cache.make_and_validate_key(key),
+        repr(now),
+        repr(interval),
+        repr(burst),
+        timeout,
+    )
+    return bool(allowed), float(tat)
+
+
+def _gcra_locked(cache, key, now, interval, burst, timeout):
+    """
+    cache.add（Memcached・Redis・データベースで不可分な操作）で取ったキーごとのロックの中で
+    TATを読み書きする。ロックを取れない場合は許可しない
+    """
+    lock_key = f"{key}:lock"
+    give_up = time.monotonic() + LOCK_WAIT
+    while not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= give_up:
+            return None
+        time.sleep(0.001)
+    try:
+        tat = max(cache.get(key, now), now)
+        new_tat = tat + interval
+        if new_tat - now > burst:
+            return False, tat
+        cache.set(key, new_tat, timeout=timeout)
+        return True, new_tat
+    finally:
+        cache.delete(lock_key)
+
+
+def consume(key, count, period, now=None):
+    """
+    GCRA（トークンバケットと同等）で１回分を消費する。
+    キャッシュには次に枠が空く理論上の時刻（TAT）だけを保存し、読み書きはワーカー間で不可分に行う
+    （Redisではスクリプト、それ以外のキャッシュではキーごとのロック）。
+    戻り値は (許可したか, 残り回数, 満杯に戻るまでの秒数, 再試行までの秒数)
+    """
+    cache = caches[RATELIMIT_CACHE_ALIAS]
+    now = time.time() if now is None else now
+    interval = period / count
+    burst = period  # バケットが満杯のときに連続で許可できる時間幅
+    timeout = math.ceil(period) + 1
+    if isinstance(cache, RedisCache):
+        result = _gcra_redis(cache, key, now, interval, burst, timeout)
+    else:
+        result = _gcra_locked(cache, key, now, interval, burst, timeout)
+    if result is None:
+        # 同じユーザーの同時のリクエストが多く、ロックを取れなかった
+        return False, 0, 0, interval
+    allowed, tat = result
+    if not allowed:
+        return False, 0, tat - now, tat + interval - now - burst
+    remaining = int((burst - (tat - now)) // interval)
+    return True, remaining, tat - now, 0
+
+
+def check_rate_limit(scope, user_key):
+    """
+    ユーザー・スコープごとに１回分を消費する。
+    戻り値は (許可したか, RateLimit-*ヘッダ)。スコープに制限がない場合はNone
+    """
+    rate = parse_rate_limits(get_config().rate_limits).get(scope)
+    if rate is None:
+        return None
+
+    count, period = rate
+    key = f"ratelimit:{scope}:{user_key}"
+    allowed, remaining, reset, retry_after = consume(key, count, period)
+    headers = {
+        "RateLimit-Limit": str(count),
+        "RateLimit-Remaining": str(remaining),
+        "RateLimit-Reset": str(math.ceil(reset)),
+    }
+    if not allowed:
+        headers["Retry-After"] = str(math.ceil(retry_after))
+    return allowed, headers
+
+
+def rate_limit(scope):
+    """
+    jwt_requiredでrequest.userが設定された後に、ユーザー・スコープごとに回数を制限する
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            state = check_rate_limit(scope, request.user.pk)
+            if state is None:
+                return view_func(request, *args, **kwargs)
+
+            allowed, headers = state
+            if not allowed:
+                response = JsonResponse({"error": "Rate limit exceeded"}, status=429)
+            else:
+                response = view_func(request, *args, **kwargs)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        return _wrapped_view
+
+    return decorator
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_ratelimit_cache(app_configs, **kwargs):
+    """
+    LocMemCacheはプロセスごとなので、複数のワーカーで動かすと回数制限が共有されない
+    """
+    backend = settings.CACHES.get(RATELIMIT_CACHE_ALIAS, {}).get("BACKEND", "")
+    if not backend.endswith(".LocMemCache"):
+        return []
+    return [
+        checks.Warning(
+            "The rate limit cache is per process, so each worker has its own limits.",
+            hint="Set RATELIMIT_CACHE_BACKEND to a shared cache such as Redis.",
+            id="rag_sample_app.W001",
+        )
+    ]
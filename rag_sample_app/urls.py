@@ -1,14 +1,22 @@
 from django.urls import path
 
 from .views import (
+    ActivitySummary,
     AllThreads,
     ChatHistoryList,
     DeleteThread,
+    DeleteThreads,
     DocumentList,
     OpenAIResponse,
+    ThreadEvaluation,
     ThreadSummary,
+    UsageSummary,
     create_new_thread,
+    export_view,
     get_first_message,
+    metrics_view,
+    profile_view,
+    profiles_view,
 )
 
 urlpatterns = [
@@ -25,11 +33,29 @@ urlpatterns = [
         ThreadSummary.as_view(),
         name="thread-summary",
     ),
+    path(
+        "thread-evaluation/<uuid:thread_id>/",
+        ThreadEvaluation.as_view(),
+        name="thread-evaluation",
+    ),
     path("all-threads/", AllThreads.as_view(), name="all-threads"),
     path(
         "delete-thread/<uuid:thread_id>/", DeleteThread.as_view(), name="delete-thread"
     ),
+    path("delete-threads/", DeleteThreads.as_view(), name="delete-threads"),
     path(
         "first-message/<uuid:thread_id>/", get_first_message, name="get-first-message"
     ),
+    path("export/", export_view, name="export"),
+    path("usage/", UsageSummary.as_view(), name="usage-summary"),
+    path("activity/", ActivitySummary.as_view(), name="activity-summary"),
+    path("metrics/", metrics_view, name="metrics"),
+    path("profiles/", profiles_view, name="profiles"),
+    path("profiles/<str:profile_id>/", profile_view, name="profile"),
+    path(
+        "profiles/<str:profile_id>/queries/",
+        profile_view,
+        {"part": "queries"},
+        name="profile-queries",
+    ),
 ]
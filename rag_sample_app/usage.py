@@ -0,0 +1,99 @@
+import datetime
+import math
+
+from django.db.models import Avg, Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from rag_sample_django.config import get_config
+
+from .metrics import metrics
+from .models import TurnUsage
+
+
+class BudgetExceeded(Exception):
+    """
+    ユーザーの１日あたりのトークン上限を超えた
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__("Daily token budget exceeded")
+
+
+def _count(usage, name):
+    value = getattr(usage, name, 0)
+    return value if isinstance(value, int) else 0
+
+
+def record_usage(user, response, latency, thread=None, chat=None):
+    """
+    OpenAIのレスポンスのusageを保存する。
+    プロンプトキャッシュが効いたトークン数（usage.prompt_tokens_details.cached_tokens）も記録する
+    """
+    usage = getattr(response, "usage", None)
+    model = getattr(response, "model", "")
+    prompt_tokens = _count(usage, "prompt_tokens")
+    cached_tokens = _count(
+        getattr(usage, "prompt_tokens_details", None), "cached_tokens"
+    )
+    metrics.inc("openai_prompt_tokens_total", prompt_tokens)
+    metrics.inc("openai_cached_tokens_total", cached_tokens)
+    return TurnUsage.objects.create(
+        creator=user,
+        thread=thread,
+        chat=chat,
+        model=model if isinstance(model, str) else "",
+        prompt_tokens=prompt_tokens,
+        completion_tokens=_count(usage, "completion_tokens"),
+        total_tokens=_count(usage, "total_tokens"),
+        cached_tokens=cached_tokens,
+        latency_ms=round(latency * 1000),
+    )
+
+
+def start_of_today():
+    return timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def tokens_used_today(user):
+    return (
+        TurnUsage.objects.filter(
+            creator=user, created_at__gte=start_of_today()
+        ).aggregate(total=Sum("total_tokens"))["total"]
+        or 0
+    )
+
+
+def check_budget(user):
+    """
+    その日の使用量が上限に達していればBudgetExceededを送出する（0は無制限）
+    """
+    budget = get_config().daily_token_budget
+    if budget and tokens_used_today(user) >= budget:
+        tomorrow = start_of_today() + datetime.timedelta(days=1)
+        raise BudgetExceeded((tomorrow - timezone.localtime()).total_seconds())
+
+
+def aggregate_usage(queryset, group_by):
+    """
+    日・スレッド・ユーザーごとの使用量をSQLで集計する
+    """
+    columns = {
+        "day": TruncDate("created_at", tzinfo=timezone.get_current_timezone()),
+        "thread": F("thread_id"),
+        "user": F("creator__username"),
+    }
+    rows = (
+        queryset.values(key=columns[group_by])
+        .annotate(
+            turns=Count("id"),
+            prompt_tokens=Sum("prompt_tokens"),
+            completion_tokens=Sum("completion_tokens"),
+            total_tokens=Sum("total_tokens"),
+            cached_tokens=Sum("cached_tokens"),
+            avg_latency_ms=Avg("latency_ms"),
+        )
+        .order_by("key")
+    )
+    return [{group_by: row.pop("key"), **row} for row in rows]
@@ -1,4 +1,5 @@
-import os
+import threading
+import time
 from functools import wraps
 
 import jwt
@@ -6,33 +7,25 @@ import requests
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError
 from django.http import JsonResponse
-from dotenv import load_dotenv
 from jwt.algorithms import RSAAlgorithm
 
+from rag_sample_django.config import get_config
 
-# 開発環境か本番環境かに応じてファイルを指定
-def load_environment():
-    environment = os.getenv("ENV", "development")
-    if environment == "production":
-        load_dotenv(".env.production")
-    else:
-        load_dotenv(".env.development")
+from .sharding import shard_for, use_shard
 
-
-load_environment()
 User = get_user_model()  # Djangoのユーザーモデルを取得
 
-COGNITO_REGION = "ap-northeast-1"
-COGNITO_USER_POOL_ID = os.environ["COGNITO_USER_POOL_ID"]
-COGNITO_APP_CLIENT_ID = os.environ["COGNITO_CLIENT_ID"]
-COGNITO_ISSUER = (
-    f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}"
-)
-COGNITO_JWKS_URL = f"{COGNITO_ISSUER}/.well-known/jwks.json"
+# 公開鍵の再取得間隔（秒）。未知のkidの場合も、この間隔より短くは再取得しない
+JWKS_CACHE_SECONDS = 3600
+JWKS_REFRESH_INTERVAL = 60
+
+_public_keys = {}
+_public_keys_fetched_at = None
+_public_keys_lock = threading.Lock()
 
 
 def get_cognito_public_keys():
-    response = requests.get(COGNITO_JWKS_URL)
+    response = requests.get(get_config().cognito_jwks_url)
     jwks = response.json()
     keys = {}
     for key in jwks["keys"]:
@@ -42,6 +35,81 @@ def get_cognito_public_keys():
     return keys
 
 
+def get_public_key(kid):
+    """
+    キャッシュした公開鍵を返す。期限切れまたは未知のkidの場合は取得し直す
+    """
+    global _public_keys, _public_keys_fetched_at
+    with _public_keys_lock:
+        now = time.monotonic()
+        age = None if _public_keys_fetched_at is None else now - _public_keys_fetched_at
+        stale = age is None or age > JWKS_CACHE_SECONDS
+        if stale or (kid not in _public_keys and age > JWKS_REFRESH_INTERVAL):
+            _public_keys = get_cognito_public_keys()
+            _public_keys_fetched_at = now
+        return _public_keys.get(kid)
+
+
+def clear_public_key_cache():
+    global _public_keys, _public_keys_fetched_at
+    with _public_keys_lock:
+        _public_keys = {}
+        _public_keys_fetched_at = None
+
+
+class AuthenticationFailed(Exception):
+    """
+    JWTの検証に失敗した（bodyはエラーレスポンスの内容）
+    """
+
+    def __init__(self, body, status=401):
+        self.body = body
+        self.status = status
+        super().__init__(body["error"])
+
+
+def authenticate_token(token):
+    """
+    CognitoのJWTを検証して、対応するユーザーを返す（存在しなければ作成する）
+    """
+    try:
+        headers = jwt.get_unverified_header(token)
+        public_key = get_public_key(headers["kid"])
+
+        if public_key is None:
+            raise AuthenticationFailed({"error": "Public key not found"})
+
+        config = get_config()
+        decoded_token = jwt.decode(
+            token,
+            public_key,
+            algorithms=["RS256"],
+            audience=config.cognito_client_id,
+            issuer=config.cognito_issuer,
+        )
+
+        # 'cognito:username' または 'sub' からユーザーを取得
+        username = decoded_token.get("cognito:username", decoded_token.get("sub"))
+        email = decoded_token.get("email", "")
+
+        try:
+            # ユーザーが存在しなければ作成
+            user, created = User.objects.get_or_create(
+                username=username, defaults={"email": email}
+            )
+        except IntegrityError:
+            raise AuthenticationFailed(
+                {"error": "Error creating or retrieving user"}, status=500
+            )
+
+    except jwt.ExpiredSignatureError:
+        raise AuthenticationFailed({"error": "Token has expired"})
+    except jwt.InvalidTokenError as e:
+        raise AuthenticationFailed({"error": "Invalid token", "details": str(e)})
+
+    return user
+
+
 def jwt_required(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
@@ -59,44 +127,12 @@ def jwt_required(view_func):
             )
 
         try:
-            public_keys = get_cognito_public_keys()
-            headers = jwt.get_unverified_header(token)
-            public_key = public_keys.get(headers["kid"])
-
-            if public_key is None:
-                return JsonResponse({"error": "Public key not found"}, status=401)
-
-            decoded_token = jwt.decode(
-                token,
-                public_key,
-                algorithms=["RS256"],
-                audience=COGNITO_APP_CLIENT_ID,
-                issuer=COGNITO_ISSUER,
-            )
-
-            # 'cognito:username' または 'sub' からユーザーを取得
-            username = decoded_token.get("cognito:username", decoded_token.get("sub"))
-            email = decoded_token.get("email", "")
-
-            try:
-                # ユーザーが存在しなければ作成
-                user, created = User.objects.get_or_create(
-                    username=username, defaults={"email": email}
-                )
-                request.user = user
-
-            except IntegrityError:
-                return JsonResponse(
-                    {"error": "Error creating or retrieving user"}, status=500
-                )
-
-        except jwt.ExpiredSignatureError:
-            return JsonResponse({"error": "Token has expired"}, status=401)
-        except jwt.InvalidTokenError as e:
-            return JsonResponse(
-                {"error": "Invalid token", "details": str(e)}, status=401
-            )
+            request.user = authenticate_token(token)
+        except AuthenticationFailed as e:
+            return JsonResponse(e.body, status=e.status)
 
-        return view_func(request, *args, **kwargs)
+        # スレッドとチャット履歴はユーザーのシャードから読み書きする
+        with use_shard(shard_for(request.user)):
+            return view_func(request, *args, **kwargs)
 
     return _wrapped_view
@@ -0,0 +1,68 @@
+"""
+ETagに使うバージョン。重いクエリやシリアライズの前に、集計だけで変更の有無を判定する
+"""
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+
+from .coalescing import coalescing_key
+from .models import ChatHistory, Thread, ThreadArchive
+
+
+def history_fingerprint(thread):
+    """
+    スレッドの履歴の状態を表す文字列（件数と最新のID）
+    """
+    state = ChatHistory.objects.filter(thread_id=thread).aggregate(
+        count=Count("id"), last_id=Max("id")
+    )
+    return f"{state['count']}:{state['last_id']}"
+
+
+def history_version(thread):
+    """
+    アーカイブを含めたスレッドの履歴の状態を表す文字列
+    """
+    # アーカイブ後も同じ件数・IDになることがないように、アーカイブの状態も含める
+    archive = ThreadArchive.objects.filter(thread=thread).values_list(
+        "last_chat_id", flat=True
+    )
+    return f"{history_fingerprint(thread)}:{archive.first()}"
+
+
+def thread_set_version(user):
+    """
+    ユーザーのスレッド一覧の状態を表す文字列（件数と最後の更新日時）
+    """
+    state = Thread.objects.filter(creator=user).aggregate(
+        count=Count("id"), updated_at=Max("updated_at")
+    )
+    return f"{state['count']}:{state['updated_at']}"
+
+
+def _find_thread(user, thread_id):
+    try:
+        return Thread.objects.filter(creator=user, id=thread_id).first()
+    except ValidationError:
+        return None
+
+
+def chat_history_etag(request, *args, **kwargs):
+    thread = _find_thread(request.user, request.query_params.get("thread_id"))
+    if thread is None:
+        return None
+    return coalescing_key("chat-history", thread.pk, history_version(thread))
+
+
+def all_threads_etag(request, *args, **kwargs):
+    return coalescing_key(
+        "all-threads", request.user.pk, thread_set_version(request.user)
+    )
+
+
+def first_message_etag(request, thread_id, *args, **kwargs):
+    # 初回メッセージはスレッドの作成後に変わらない
+    thread = _find_thread(request.user, thread_id)
+    if thread is None:
+        return None
+    return coalescing_key("first-message", thread.pk, thread.created_at)
@@ -1,61 +1,70 @@
 import datetime
-import os
-import random
-
-import openai
-import requests
+import hmac
+import time
+import uuid
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
-from dotenv import load_dotenv
+from django.utils.http import quote_etag
+from django.views.decorators.http import etag, require_GET
 from rest_framework import generics, status
 from rest_framework.decorators import api_view
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import ChatHistory, Document, Thread
-from .serializers import ChatHistorySerializer, DocumentSerializer
+from rag_sample_django.config import get_config
+
+from .admission import AdmissionRejected
+from .archive import chat_history, chat_history_values
+from .coalescing import SingleFlight, coalescing_key, normalize_search_word
+from .evaluation import EvaluationError, get_or_create_evaluation
+from .export import InvalidCursor, astream_export, decode_cursor, stream_export
+from .idempotency import claim_record, find_record, request_hash
+from .interview import build_prompt, limit_string_length, save_turn
+from .llm import CompletionTimeout, create_chat_completion
+from .metrics import metrics
+from .models import ChatHistory, Company, Document, Thread, TurnUsage
+from .prefetch import retrieve_for_turn, schedule_prefetch
+from .profiling import collapsed, profile_store
+from .prompts import build_messages, build_prefix, choose_interviewer, system_prompt
+from .purge import schedule_purge
+from .renderers import ORJSONRenderer
+from .resilience import Deadline
+from .rollup import activity_summary, rolled_up_until
+from .serializers import ChatHistorySerializer, chat_history_rows
+from .sharding import active_shard
+from .throttling import check_rate_limit, rate_limit
+from .usage import (
+    BudgetExceeded,
+    aggregate_usage,
+    check_budget,
+    record_usage,
+    start_of_today,
+    tokens_used_today,
+)
 from .utils import jwt_required  # utils.pyからデコレータをインポート
+from .versions import (
+    all_threads_etag,
+    chat_history_etag,
+    first_message_etag,
+    history_fingerprint,
+    history_version,
+)
 
-
-def load_environment():
-    # 開発環境か本番環境かに応じてファイルを指定
-    environment = os.getenv("ENV", "development")
-    if environment == "production":
-        load_dotenv(".env.production")
-    else:
-        load_dotenv(".env.development")
-
-
-load_environment()
-
-# 環境変数の取得
-api_key = os.getenv("API_KEY")
-search_service = os.getenv("SEARCH_SERVICE")
-index = os.getenv("INDEX")
-aoai_api_key = os.getenv("OPENAI_API_KEY")
-aoai_service_name = os.getenv("OPENAI_RESOURCE_NAME")
-aoai_deployment_name = os.getenv("OPENAI_DEPLOYMENT_NAME")
-aoai_resource_name = os.environ.get("OPENAI_RESOURCE_NAME")
-aoai_api_version = os.getenv("OPENAI_API_VERSION")
-aoai_model = os.getenv("OPENAI_MODEL")
 SENDER_NAME_AI = "AI"
 
-# OpenAI APIの設定
-openai.api_type = "azure"
-openai.api_version = aoai_api_version
-openai.api_key = aoai_api_key
-openai.azure_endpoint = f"https://{aoai_resource_name}.openai.azure.com/openai/deployments/{aoai_deployment_name}/chat/completions?api-version={aoai_api_version}"
-
-
-def limit_string_length(strings, max_length):
-    """
-    文字数制限を超えた文字列を切り詰める
-    """
-    if len(strings) > max_length:
-        return strings[:max_length]
-    return strings
+# 実行中のターン（OpenAIResponse）を同一キーでまとめる
+turn_flight = SingleFlight()
+# 同じスレッド・同じ履歴の評価の作成を１回にまとめる
+evaluation_flight = SingleFlight()
 
 
 # 最新のユーザからのチャットを１行で取得する
+# （アーカイブ済みのスレッドはアーカイブ時に要約を保存しているので、ホットテーブルだけを読む）
 def generate_and_save_summary(thread):
     chat_history_items = (
         ChatHistory.objects.filter(thread_id=thread)
@@ -66,77 +75,123 @@ def generate_and_save_summary(thread):
 
     # ユーザからの入力を取得
     user_input = "\n".join([item.message for item in chat_history_items])
-    thread.summary = user_input
-    thread.save()
+    # 要約が変わらない場合（ユーザーの入力がまだない場合を含む）は保存しない。
+    # 保存するとスレッド一覧のETagが変わり、ポーリングで304を返せなくなる
+    if user_input and user_input != thread.summary:
+        thread.summary = user_input
+        thread.save()
     return user_input
 
 
-# 3つの名前からランダムに選択する関数
-def choose_random_name():
-    names = ["高階", "渡海", "佐伯", "藤原", "西崎", "世良", "猫田"]
-    return random.choice(names)
+def overloaded_response(error):
+    """
+    OpenAIの呼び出し枠が空いていない場合のレスポンス
+    """
+    return Response(
+        {"error": "The AI service is busy. Please retry later."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def timeout_response():
+    """
+    持ち時間内にOpenAIの応答が得られなかった場合のレスポンス
+    """
+    return Response(
+        {"error": "The AI service timed out"},
+        status=status.HTTP_504_GATEWAY_TIMEOUT,
+    )
 
 
-# 実行例
-choose_random_name()
+def budget_exceeded_response(error):
+    """
+    ユーザーの１日あたりのトークン上限を超えた場合のレスポンス
+    """
+    return Response(
+        {"error": "Daily token budget exceeded"},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(error.retry_after)},
+    )
 
 
-def get_openai_response(message):
-    messages = [
-        {
-            "role": "system",
-            "content": f"あなたは、面接官の{choose_random_name()}です。面接を受ける人に対して、適切な質問をしてください。面接は１対１です。最初は自己紹介から始めましょう。",
-        }
-    ]
+def get_openai_response(
+    message, user_key=None, on_usage=None, interviewer=None, deadline=None
+):
+    # スレッドの以降のターンと同じシステムプロンプトにして、プロンプトキャッシュを使えるようにする
+    if interviewer is None:
+        interviewer = choose_interviewer()
+    messages = [{"role": "system", "content": system_prompt(interviewer)}]
     messages.append({"role": "user", "content": message})
-    openai_response = openai.chat.completions.create(
-        model=aoai_model, messages=messages
+    started = time.monotonic()
+    openai_response = create_chat_completion(
+        model=get_config().openai_model,
+        messages=messages,
+        user_key=user_key,
+        deadline=deadline,
     )
+    if on_usage is not None:
+        on_usage(openai_response, time.monotonic() - started)
     return openai_response.choices[0].message.content
 
 
 class ChatHistoryList(generics.ListCreateAPIView):
     serializer_class = ChatHistorySerializer
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
 
     # dispatchメソッドにデコレータを適用
     @method_decorator(jwt_required)
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
-    def get_queryset(self):
+    def get_thread(self):
         thread_id = self.request.query_params.get("thread_id")
         user = self.request.user
 
         try:
-            thread = Thread.objects.get(creator=user, id=thread_id)
+            return Thread.objects.get(creator=user, id=thread_id)
         except Thread.DoesNotExist:
             return None
 
+    def get_queryset(self):
+        thread = self.get_thread()
+        if thread is None:
+            return None
+
         return ChatHistory.objects.filter(thread_id=thread)
 
+    # 履歴が変わっていなければ、履歴を読み込まずに304を返す
+    @method_decorator(etag(chat_history_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        if queryset is None:
+        thread = self.get_thread()
+        if thread is None:
             return Response(
                 {"error": "Thread not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        # アーカイブ済みの履歴も合わせて、モデルを作らずに返す
+        return Response(chat_history_rows(chat_history_values(thread)))
 
 
 class DocumentList(APIView):
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
 
     @method_decorator(jwt_required)
     def get(self, request):
-        documents = Document.objects.all()
-        serializer = DocumentSerializer(documents, many=True)
-        return Response(serializer.data)
+        # DocumentSerializerと同じ項目（companyは企業のID）を.values()で取得する
+        # （共通のドキュメントと、ユーザーが所属する企業のドキュメントだけを返す）
+        documents = Document.objects.filter(
+            Q(company__isnull=True) | Q(company__members=request.user)
+        ).values("id", "content", "company")
+        return Response(list(documents))
 
 
 class OpenAIResponse(APIView):
 
-    @method_decorator(jwt_required)
+    @method_decorator([jwt_required, rate_limit("openai")])
     def post(self, request):
         search_word = request.data.get("search_word")
         if search_word is None:
@@ -145,6 +200,25 @@ class OpenAIResponse(APIView):
             )
         thread_id = request.data.get("thread_id")  # thread_idを取得
         user = request.user
+        deadline = Deadline(get_config().request_deadline_seconds)
+        idempotency_key = request.headers.get("Idempotency-Key")
+
+        # 同じIdempotency-Keyで完了済みのリクエストは保存済みの結果を返す（内容が異なる場合は拒否する）
+        digest = request_hash({"search_word": search_word, "thread_id": thread_id})
+        record = find_record(user, idempotency_key) if idempotency_key else None
+        if record is not None:
+            if record.request_hash and record.request_hash != digest:
+                return Response(
+                    {"error": "Idempotency-Key was used with a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is not None:
+                return Response(
+                    record.response,
+                    status=record.status_code,
+                    headers={"Idempotent-Replayed": "true"},
+                )
+
         if thread_id:
             try:
                 thread = Thread.objects.get(creator=user, id=thread_id)
@@ -152,89 +226,155 @@ class OpenAIResponse(APIView):
                 return Response(
                     {"error": "Thread not found"}, status=status.HTTP_404_NOT_FOUND
                 )
+            thread_key = thread.id
+            fingerprint = history_fingerprint(thread)
         else:
-            thread = Thread.objects.create(creator=user)
+            thread = None
+            thread_key = f"new:{user.pk}"
+            fingerprint = ""
 
-        search_url = f"https://{search_service}.search.windows.net/indexes/{index}/docs"
-        headers = {"Content-Type": "application/json", "api-key": api_key}
-        params = {"api-version": "2021-04-30-Preview", "search": search_word}
-        response = requests.get(search_url, headers=headers, params=params)
+        try:
+            check_budget(user)
+        except BudgetExceeded as e:
+            return budget_exceeded_response(e)
 
-        if response.status_code == status.HTTP_200_OK:
-            try:
-                results = response.json()
-            except requests.exceptions.JSONDecodeError as e:
-                return Response(
-                    {"error": "JSON decode error: " + str(e)},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
+        # 同時に届いた同一のターンは１回のOpenAI呼び出しにまとめる
+        if idempotency_key:
+            flight_key = coalescing_key("idempotency", user.pk, idempotency_key)
         else:
-            return Response(
-                {"error": f"Error {response.status_code}: {response.text}"},
-                status=response.status_code,
+            flight_key = coalescing_key(
+                thread_key, normalize_search_word(search_word), fingerprint
             )
-
-        if results["value"]:
-            max_length = 2000
-            combined_content = "\n".join(
-                [
-                    limit_string_length(
-                        doc.get("content", "No content found"), max_length
-                    )
-                    for doc in results["value"][:1]
-                ]
+        try:
+            (body, status_code), _ = turn_flight.do(
+                flight_key,
+                lambda: self.run_turn(
+                    user, thread, search_word, deadline, idempotency_key, digest
+                ),
+            )
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        except CompletionTimeout:
+            return timeout_response()
+        return Response(body, status=status_code)
+
+    def run_turn(
+        self, user, thread, search_word, deadline, idempotency_key=None, digest=""
+    ):
+        if idempotency_key:
+            record = claim_record(user, idempotency_key, digest)
+            if record is None:
+                # 別のワーカーで同じキーのリクエストを処理中
+                return (
+                    {"error": "A request with this Idempotency-Key is in progress"},
+                    status.HTTP_409_CONFLICT,
+                )
+            try:
+                body, status_code = self.generate_turn(
+                    user, thread, search_word, deadline
+                )
+            except BaseException:
+                # 再送で再実行できるように記録を残さない
+                record.delete()
+                raise
+            record.status_code = status_code
+            record.response = body
+            record.save(update_fields=["status_code", "response"])
+            return body, status_code
+
+        return self.generate_turn(user, thread, search_word, deadline)
+
+    def generate_turn(self, user, thread, search_word, deadline):
+        if thread is None:
+            thread = Thread.objects.create(
+                creator=user, company=Company.objects.default_for(user)
             )
-            prompt = f"以下の<document>に基づいて質問に答えてください（答えられる情報がない場合は、AIベースの回答をしてください）<document> {combined_content}</document>"
-        else:
-            prompt = search_word
 
-        # ここでチャット履歴を取得して、messagesリストに追加する
-        chat_history_items = ChatHistory.objects.filter(thread_id=thread).order_by(
-            "timestamp"
+        documents = retrieve_for_turn(thread, search_word, deadline)
+        prompt = build_prompt(search_word, documents)
+        # 変わらない部分（システムプロンプトと履歴）を先頭に、このターンの内容を最後に置く
+        prefix = build_prefix(thread, chat_history(thread))
+        messages = build_messages(prefix, prompt)
+
+        started = time.monotonic()
+        openai_response = create_chat_completion(
+            model=get_config().openai_model,
+            messages=messages,
+            user_key=user.pk,
+            deadline=deadline,
         )
-        messages = [
-            {
-                "role": "system",
-                "content": "あなたは、企業の面接官です。面接を受ける人に対して、適切な質問をしてください。",
-            }
-        ]
+        latency = time.monotonic() - started
 
-        messages.append({"role": "assistant", "content": thread.first_message})
+        # チャット履歴を保存
+        response = save_turn(user, thread, search_word, openai_response, latency)
+        return {"response": response}, status.HTTP_200_OK
 
-        for item in chat_history_items:
-            if item.sender == "USER":
-                messages.append({"role": "user", "content": item.message})
-            elif item.sender == "AI":
-                messages.append({"role": "assistant", "content": item.message})
 
-        # search_wordを履歴に追加
-        if search_word != prompt:
-            messages.append({"role": "system", "content": search_word})
+class UsageSummary(APIView):
+    """
+    トークン使用量の集計（group_by=day|thread|user、userは管理者のみ）
+    """
 
-        messages.append({"role": "user", "content": prompt})
+    @method_decorator(jwt_required)
+    def get(self, request):
+        user = request.user
+        group_by = request.query_params.get("group_by", "day")
+        if group_by not in ("day", "thread", "user"):
+            return Response(
+                {"error": "group_by must be one of day, thread, user"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            days = int(request.query_params.get("days", "30"))
+        except ValueError:
+            return Response(
+                {"error": "days must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        openai_response = openai.chat.completions.create(
-            model=aoai_model, messages=messages
+        usages = TurnUsage.objects.filter(
+            created_at__gte=start_of_today() - datetime.timedelta(days=days - 1)
         )
+        if group_by == "user":
+            if not user.is_staff:
+                return Response(
+                    {"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
+                )
+        else:
+            usages = usages.filter(creator=user)
 
-        response = openai_response.choices[0].message.content
-
-        # チャット履歴を保存
-        user_input = ChatHistory(
-            thread_id=thread,
-            message=search_word,
-            timestamp=datetime.datetime.now(),
-            sender="USER",
+        return Response(
+            {
+                "usage": aggregate_usage(usages, group_by),
+                "today": {
+                    "total_tokens": tokens_used_today(user),
+                    "budget": get_config().daily_token_budget,
+                },
+            }
         )
-        user_input.save()
-        ai_input = ChatHistory(
-            thread_id=thread,
-            message=response,
-            timestamp=datetime.datetime.now(),
-            sender="AI",
+
+
+class ActivitySummary(APIView):
+    """
+    日ごとの面接の数と長さ（管理者のみ）。rollup_activityで集計した結果だけを読む
+    """
+
+    @method_decorator(jwt_required)
+    def get(self, request):
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            days = int(request.query_params.get("days", "30"))
+        except ValueError:
+            return Response(
+                {"error": "days must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            {"activity": activity_summary(days), "rolled_up_until": rolled_up_until()}
         )
-        ai_input.save()
-        return Response({"response": response})
 
 
 class ThreadSummary(APIView):
@@ -257,37 +397,125 @@ class ThreadSummary(APIView):
         return Response({"summary": summary})
 
 
-class AllThreads(APIView):
+class ThreadEvaluation(APIView):
+    """
+    面接全体の評価レポート（履歴が変わるまではスレッドに保存したものを返す）
+    """
 
     @method_decorator(jwt_required)
+    def get(self, request, thread_id):
+        user = request.user
+        thread = Thread.objects.filter(creator=user, id=thread_id).first()
+        if thread is None:
+            return Response(
+                {"error": "Thread not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        version = history_version(thread)
+        if thread.evaluation is not None and thread.evaluation_version == version:
+            return Response(thread.evaluation)
+
+        # 作り直す場合だけ、OpenAIの呼び出し回数とトークン上限を確認する
+        state = check_rate_limit("evaluation", user.pk)
+        if state is not None and not state[0]:
+            return Response(
+                {"error": "Rate limit exceeded"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers=state[1],
+            )
+        try:
+            check_budget(user)
+        except BudgetExceeded as e:
+            return budget_exceeded_response(e)
+
+        deadline = Deadline(get_config().request_deadline_seconds)
+        try:
+            (report, _), _ = evaluation_flight.do(
+                coalescing_key("evaluation", thread.pk, version),
+                lambda: get_or_create_evaluation(thread, user, deadline),
+            )
+        except EvaluationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        except CompletionTimeout:
+            return timeout_response()
+        return Response(report)
+
+
+class AllThreads(APIView):
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    @method_decorator([jwt_required, etag(all_threads_etag)])
     def get(self, request):
         user = request.user
-        threads = Thread.objects.filter(creator=user).order_by("-created_at")
+        threads = (
+            Thread.objects.filter(creator=user)
+            .order_by("-created_at")
+            .values("id", "summary", "created_at")
+        )
         thread_data = []
+        saved = False
         for thread in threads:
-            if not thread.summary:
-                summary = generate_and_save_summary(thread)
+            if not thread["summary"]:
+                summary = generate_and_save_summary(Thread.objects.get(pk=thread["id"]))
+                saved = saved or bool(summary)
             else:
-                summary = thread.summary
+                summary = thread["summary"]
             thread_data.append(
                 {
-                    "thread_id": str(thread.id),
+                    "thread_id": str(thread["id"]),
                     "summary": summary,
-                    "created_at": thread.created_at,
+                    "created_at": thread["created_at"],
                 }
             )
 
-        return Response({"threads": thread_data})
+        response = Response({"threads": thread_data})
+        if saved:
+            # ETagは要約を保存する前に計算されているので、保存後の状態で付け直す
+            response["ETag"] = quote_etag(all_threads_etag(request))
+        return response
 
 
 @api_view(["POST"])
 @jwt_required
+@rate_limit("new-thread")
 def create_new_thread(request):
     user = request.user
-    response = get_openai_response(
-        "こんにちは。面接に来た受験者に挨拶してください。自己紹介を促してください。"
+    # 検索する企業（指定がなければ所属する企業）
+    company_slug = request.data.get("company")
+    if company_slug:
+        company = Company.objects.filter(members=user, slug=company_slug).first()
+        if company is None:
+            return Response(
+                {"error": "Company not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+    else:
+        company = Company.objects.default_for(user)
+    try:
+        check_budget(user)
+    except BudgetExceeded as e:
+        return budget_exceeded_response(e)
+
+    usages = []
+    interviewer = choose_interviewer()
+    try:
+        response = get_openai_response(
+            "こんにちは。面接に来た受験者に挨拶してください。自己紹介を促してください。",
+            user_key=user.pk,
+            on_usage=lambda *usage: usages.append(usage),
+            interviewer=interviewer,
+            deadline=Deadline(get_config().request_deadline_seconds),
+        )
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except CompletionTimeout:
+        return timeout_response()
+    new_thread = Thread.objects.create(
+        creator=user, first_message=response, interviewer=interviewer, company=company
     )
-    new_thread = Thread.objects.create(creator=user, first_message=response)
+    for openai_response, latency in usages:
+        record_usage(user, openai_response, latency, thread=new_thread)
+    schedule_prefetch(new_thread, response)
 
     return Response(
         {"thread_id": str(new_thread.id), "response": response},
@@ -300,20 +528,53 @@ class DeleteThread(APIView):
     @method_decorator(jwt_required)
     def delete(self, request, thread_id):
         user = request.user
-        try:
-            thread = Thread.objects.get(creator=user, id=thread_id)
-        except Thread.DoesNotExist:
+        # すぐに見えなくして、チャット履歴の削除はバックグラウンドで行う
+        if not Thread.objects.filter(creator=user, id=thread_id).soft_delete():
             return Response(
                 {"error": "Thread not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        thread.delete()
+        schedule_purge([thread_id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class DeleteThreads(APIView):
+    """
+    複数のスレッドをまとめて削除する
+    """
+
+    @method_decorator(jwt_required)
+    def post(self, request):
+        user = request.user
+        thread_ids = request.data.get("thread_ids")
+        if not isinstance(thread_ids, list) or not thread_ids:
+            return Response(
+                {"error": "thread_ids is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            thread_ids = [uuid.UUID(str(thread_id)) for thread_id in thread_ids]
+        except ValueError:
+            return Response(
+                {"error": "Invalid thread_id"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic(using=Thread.objects.db):
+            threads = Thread.objects.select_for_update().filter(
+                creator=user, id__in=thread_ids
+            )
+            deleted = list(threads.values_list("id", flat=True))
+            Thread.objects.filter(id__in=deleted).soft_delete()
+            schedule_purge(deleted)
+        return Response(
+            {"deleted": [str(thread_id) for thread_id in deleted]},
+            status=status.HTTP_200_OK,
+        )
+
+
 # 初めてのメッセージを返す
-@api_view(["POST"])
+@api_view(["GET", "POST"])
 @jwt_required
+@etag(first_message_etag)
 def get_first_message(request, thread_id):
     user = request.user
     # ユーザIDで絞り込み
@@ -327,3 +588,89 @@ def get_first_message(request, thread_id):
 
     response = response.first_message
     return Response({"response": response})
+
+
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+# すべてのスレッドとチャット履歴をNDJSONまたはCSVでストリーミングする（?cursor=で途中から再開）
+# DRFは?format=をレンダラーの選択に使うので、通常のDjangoのビューにする
+@require_GET
+@jwt_required
+@rate_limit("export")
+def export_view(request):
+    format = request.GET.get("format", "ndjson")
+    if format not in EXPORT_CONTENT_TYPES:
+        return JsonResponse({"error": "format must be one of ndjson, csv"}, status=400)
+    cursor = request.GET.get("cursor")
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    # ASGIでは、同期のイテレーターは全体を読み込んでから送られるので非同期で返す
+    stream = astream_export if isinstance(request, ASGIRequest) else stream_export
+    response = StreamingHttpResponse(
+        stream(request.user, active_shard(), format, cursor),
+        content_type=EXPORT_CONTENT_TYPES[format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="interviews.{format}"'
+    return response
+
+
+def _has_bearer_token(request, token):
+    # 一致するまでの時間からトークンを推測されないように、一定時間で比較する
+    authorization = request.headers.get("Authorization", "")
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+# Prometheus形式のメトリクス（METRICS_TOKENが未設定の場合は無効）
+def metrics_view(request):
+    token = get_config().metrics_token
+    if not token:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    if not _has_bearer_token(request, token):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def _profiling_denied(request):
+    # プロファイルの取得はPROFILING_TOKENと同じBearerトークンが必要（未設定の場合は無効）
+    token = get_config().profiling_token
+    if not token:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    if not _has_bearer_token(request, token):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return None
+
+
+# 記録したプロファイルの一覧（新しい順）
+@require_GET
+def profiles_view(request):
+    denied = _profiling_denied(request)
+    if denied is not None:
+        return denied
+    return JsonResponse({"profiles": profile_store.list()})
+
+
+# プロファイルのスタックをflamegraph.pl・speedscopeで読める形式で返す（queries/はSQLのログ）
+@require_GET
+def profile_view(request, profile_id, part="stacks"):
+    denied = _profiling_denied(request)
+    if denied is not None:
+        return denied
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        return JsonResponse({"error": "Profile not found"}, status=404)
+    if part == "queries":
+        return JsonResponse({"queries": profile["query_log"]})
+    response = HttpResponse(
+        collapsed(profile), content_type="text/plain; charset=utf-8"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{profile_id}.folded"'
+    return response
@@ -0,0 +1,244 @@
+"""
+面接セッション用のWebSocket（ASGI）。
+接続ごとに一度だけ認証し、スレッドと履歴をメモリに保持して、AIの応答をトークンごとに送信する。
+
+クライアントからのメッセージ
+    {"type": "auth", "token": "<JWT>", "thread_id": "<省略可>"}
+    {"type": "turn", "search_word": "..."}
+サーバーからのメッセージ
+    {"type": "ready", "thread_id": ...}
+    {"type": "token", "content": "..."}
+    {"type": "done", "thread_id": ..., "response": "..."}
+    {"type": "error", "status": 429, "error": "...", "retry_after": 10}
+"""
+
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connection
+
+from rag_sample_django.config import get_config
+
+from .admission import AdmissionRejected
+from .archive import chat_history
+from .interview import build_prompt, save_turn
+from .llm import CompletionTimeout, StreamInterrupted, stream_chat_completion
+from .metrics import metrics
+from .models import Company, Thread
+from .prefetch import retrieve_for_turn
+from .prompts import build_messages, build_prefix
+from .resilience import Deadline
+from .sharding import activate_shard, shard_for
+from .throttling import check_rate_limit
+from .usage import BudgetExceeded, check_budget
+from .utils import AuthenticationFailed, authenticate_token
+
+logger = logging.getLogger(__name__)
+
+# 認証に失敗した場合などのクローズコード（4000番台はアプリケーション定義）
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+
+
+class SessionError(Exception):
+    def __init__(self, status, error, retry_after=None):
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+        super().__init__(error)
+
+    def message(self):
+        message = {"type": "error", "status": self.status, "error": self.error}
+        if self.retry_after is not None:
+            message["retry_after"] = self.retry_after
+        return message
+
+
+def _load_thread(user, thread_id):
+    try:
+        thread = Thread.objects.filter(creator=user, id=thread_id).first()
+    except ValidationError:
+        thread = None
+    if thread is None:
+        raise SessionError(404, "Thread not found")
+    # 企業はdefaultにあるので、検索のワーカーでDBに接続しないように先に読み込む
+    thread.company
+    return thread, build_prefix(thread, chat_history(thread))
+
+
+def _create_thread(user):
+    thread = Thread.objects.create(
+        creator=user, company=Company.objects.default_for(user)
+    )
+    return thread, build_prefix(thread, [])
+
+
+def _retrieve(thread, search_word, deadline):
+    try:
+        return retrieve_for_turn(thread, search_word, deadline)
+    finally:
+        # ローカルのインデックスを作るときはDocumentを読むので、prefetchと同じくワーカーの接続を閉じる
+        connection.close()
+
+
+def _admit(user):
+    """
+    OpenAIResponseと同じ回数制限と１日のトークン上限を確認する
+    """
+    state = check_rate_limit("openai", user.pk)
+    if state is not None and not state[0]:
+        raise SessionError(429, "Rate limit exceeded", int(state[1]["Retry-After"]))
+    try:
+        check_budget(user)
+    except BudgetExceeded as e:
+        raise SessionError(429, "Daily token budget exceeded", e.retry_after)
+
+
+class InterviewSession:
+    def __init__(self, send):
+        self._send = send
+        self.user = None
+        self.thread = None
+        self.history = None
+
+    async def send_json(self, message):
+        await self._send(
+            {"type": "websocket.send", "text": json.dumps(message, ensure_ascii=False)}
+        )
+
+    async def close(self, code):
+        await self._send({"type": "websocket.close", "code": code})
+
+    async def authenticate(self, data):
+        try:
+            self.user = await sync_to_async(authenticate_token)(data.get("token"))
+        except AuthenticationFailed as e:
+            await self.send_json({"type": "error", "status": e.status, **e.body})
+            await self.close(CLOSE_UNAUTHORIZED)
+            return False
+
+        # 以降のメッセージの処理では、このユーザーのシャードのスレッドを読み書きする
+        activate_shard(shard_for(self.user))
+
+        thread_id = data.get("thread_id")
+        if thread_id:
+            try:
+                self.thread, self.history = await sync_to_async(_load_thread)(
+                    self.user, thread_id
+                )
+            except SessionError as e:
+                await self.send_json(e.message())
+                await self.close(CLOSE_NOT_FOUND)
+                return False
+
+        await self.send_json(
+            {"type": "ready", "thread_id": self.thread and str(self.thread.id)}
+        )
+        return True
+
+    async def turn(self, data):
+        search_word = data.get("search_word")
+        if search_word is None:
+            raise SessionError(400, "search_word is required")
+        await sync_to_async(_admit)(self.user)
+
+        deadline = Deadline(get_config().request_deadline_seconds)
+        if self.thread is None:
+            self.thread, self.history = await sync_to_async(_create_thread)(self.user)
+
+        # 検索とLLMの呼び出しは時間がかかるので、Djangoの同期処理用のスレッドを塞がない
+        documents = await sync_to_async(_retrieve, thread_sensitive=False)(
+            self.thread, search_word, deadline
+        )
+        prompt = build_prompt(search_word, documents)
+        messages = build_messages(self.history, prompt)
+        send_token = async_to_sync(self.send_json)
+
+        started = time.monotonic()
+        try:
+            completion = await sync_to_async(
+                stream_chat_completion, thread_sensitive=False
+            )(
+                get_config().openai_model,
+                messages,
+                lambda content: send_token({"type": "token", "content": content}),
+                user_key=self.user.pk,
+                deadline=deadline,
+            )
+        except AdmissionRejected as e:
+            raise SessionError(
+                503, "The AI service is busy. Please retry later.", e.retry_after
+            )
+        except CompletionTimeout:
+            raise SessionError(504, "The AI service timed out")
+        except StreamInterrupted:
+            raise SessionError(502, "The AI response was interrupted")
+        latency = time.monotonic() - started
+
+        response = await sync_to_async(save_turn)(
+            self.user, self.thread, search_word, completion, latency
+        )
+        # 次のターンでは履歴をDBから読み込まずに、メモリ上の履歴に追加する
+        self.history.append({"role": "user", "content": search_word})
+        self.history.append({"role": "assistant", "content": response})
+        metrics.inc("websocket_turns_total")
+        await self.send_json(
+            {"type": "done", "thread_id": str(self.thread.id), "response": response}
+        )
+
+    async def receive(self, message):
+        try:
+            data = json.loads(message.get("text") or message.get("bytes") or "")
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.send_json(SessionError(400, "Invalid JSON").message())
+            return True
+
+        if self.user is None:
+            if data.get("type") != "auth":
+                await self.send_json(
+                    SessionError(401, "Authentication required").message()
+                )
+                await self.close(CLOSE_UNAUTHORIZED)
+                return False
+            return await self.authenticate(data)
+
+        if data.get("type") != "turn":
+            await self.send_json(SessionError(400, "Unknown message type").message())
+            return True
+        try:
+            await self.turn(data)
+        except SessionError as e:
+            await self.send_json(e.message())
+        except Exception:
+            logger.exception("interview turn failed")
+            await self.send_json(SessionError(500, "Internal server error").message())
+        return True
+
+
+async def interview_websocket(scope, receive, send):
+    """
+    面接セッションのASGIアプリケーション。ターンは受信した順に１つずつ処理する
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    metrics.inc("websocket_sessions_total")
+
+    session = InterviewSession(send)
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message["type"] != "websocket.receive":
+                continue
+            if not await session.receive(message):
+                return
+    finally:
+        await sync_to_async(close_old_connections)()
@@ -13,4 +13,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rag_sample_django.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# アプリケーションのモジュールはDjangoの初期化後に読み込む
+from rag_sample_app.websocket import interview_websocket  # noqa: E402
+
+# WebSocketのパスとASGIアプリケーション（HTTPはDjangoで処理する）
+websocket_routes = {
+    "/api/ws/interview/": interview_websocket,
+}
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        handler = websocket_routes.get(scope["path"])
+        if handler is None:
+            # acceptせずに閉じると、ハンドシェイクが403で拒否される
+            await send({"type": "websocket.close"})
+            return
+        await handler(scope, receive, send)
+        return
+    await django_application(scope, receive, send)
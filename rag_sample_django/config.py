@@ -0,0 +1,152 @@
+"""
+アプリケーション全体の設定。環境変数は起動時に一度だけ読み込み、
+settings.APP_CONFIG から参照する。
+"""
+
+import json
+import os
+from dataclasses import dataclass, fields
+
+from django.core.exceptions import ImproperlyConfigured
+from dotenv import load_dotenv
+
+
+# 開発環境か本番環境かに応じてファイルを指定
+def load_environment():
+    environment = os.getenv("ENV", "development")
+    if environment == "production":
+        load_dotenv(".env.production")
+    else:
+        load_dotenv(".env.development")
+
+
+def parse_deployments(value, environ):
+    """
+    OPENAI_DEPLOYMENTS（JSON配列）を読み込み、api_key_envで指定した環境変数のAPIキーをapi_keyにする。
+    キーが設定されていない場合は、最初のリクエストではなく起動時にエラーにする
+    """
+    try:
+        entries = json.loads(value)
+    except ValueError as e:
+        raise ImproperlyConfigured("OPENAI_DEPLOYMENTS is not valid JSON") from e
+    deployments = []
+    for entry in entries:
+        entry = dict(entry)
+        name = entry.pop("api_key_env", None)
+        if name is not None:
+            if not environ.get(name):
+                raise ImproperlyConfigured(
+                    f"{name} for the deployment {entry.get('name')} is not set"
+                )
+            entry["api_key"] = environ[name]
+        deployments.append(entry)
+    return tuple(deployments)
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    # Azure AI Search
+    search_api_key: str = None
+    search_service: str = None
+    search_index: str = None
+    # 検索サービスのURL（未設定の場合はSEARCH_SERVICEから作る。ベンチマークのスタンドインなどに使う）
+    search_endpoint: str = None
+    # Azure OpenAI
+    openai_api_key: str = None
+    openai_resource_name: str = None
+    openai_deployment_name: str = None
+    openai_api_version: str = None
+    openai_model: str = None
+    # OPENAI_DEPLOYMENTSを読み込んだデプロイメントの一覧（APIキーは解決済み）
+    openai_deployments: tuple = ()
+    openai_tokens_per_minute: int = 30000
+    openai_requests_per_minute: int = 180
+    openai_admission_max_wait: float = 10.0
+    # 同じデプロイメントを呼び出すプロセスの数（ワーカー数×コンテナ数）。TPM/RPMをこの数で等分する
+    openai_quota_processes: int = 1
+    # １ターンの処理全体の持ち時間と検索の割合
+    request_deadline_seconds: float = 30.0
+    retrieval_budget_share: float = 0.1
+    retrieval_breaker_failures: int = 5
+    retrieval_breaker_reset_seconds: float = 30.0
+    metrics_token: str = None
+    # X-Profileヘッダに指定するとそのリクエストをプロファイルするトークン（api/profiles/の認証にも使う）
+    profiling_token: str = None
+    # ヘッダがなくてもプロファイルするリクエストの割合と、保持するプロファイルの件数
+    profile_sample_rate: float = 0.0
+    profile_buffer_size: int = 50
+    # ユーザー・エンドポイントごとの回数制限（"スコープ=回数/期間" のカンマ区切り）
+    rate_limits: str = "openai=30/min,new-thread=10/min,evaluation=5/min,export=2/min"
+    # ユーザーごとの１日あたりのトークン上限（0は無制限）
+    daily_token_budget: int = 0
+    # Idempotency-Keyの記録を保持する秒数
+    idempotency_ttl_seconds: int = 86400
+    # 削除したスレッドのチャット履歴を１回のDELETEで消す件数
+    purge_batch_size: int = 1000
+    # 最後のチャットからこの日数が経ったスレッドをアーカイブする
+    archive_after_days: int = 90
+    # 利用状況の集計で、書き込み中のトランザクションを待つために直近の行を見送る秒数
+    rollup_lag_seconds: int = 300
+    # ハイブリッド検索のブランチとタイムアウト[秒]（"ブランチ=秒" のカンマ区切り）
+    retrieval_branches: str = "keyword=3,vector=0.5,bm25=0.5"
+    # プロンプトに入れるドキュメントの件数と、MMRで関連度を重視する割合（1で多様性を考慮しない）
+    context_documents: int = 3
+    mmr_lambda: float = 0.7
+    # 検索結果をプロセス内にキャッシュする件数（0はキャッシュしない）と有効期限
+    search_cache_size: int = 1000
+    search_cache_ttl_seconds: float = 600.0
+    # AIの質問で検索を先読みした結果を保持する秒数（0は先読みしない）
+    prefetch_ttl_seconds: float = 0.0
+    # 面接の評価で１回に採点する発言の数と、同時に採点するチャンクの数
+    evaluation_chunk_size: int = 20
+    evaluation_concurrency: int = 4
+    # AWS Cognito
+    cognito_region: str = "ap-northeast-1"
+    cognito_user_pool_id: str = None
+    cognito_client_id: str = None
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """
+        環境変数から設定を作成する。未設定の項目はデフォルト値を使う
+        """
+        environ = os.environ if environ is None else environ
+        names = {
+            "search_api_key": "API_KEY",
+            "search_service": "SEARCH_SERVICE",
+            "search_index": "INDEX",
+            "cognito_client_id": "COGNITO_CLIENT_ID",
+        }
+        values = {}
+        for field in fields(cls):
+            value = environ.get(names.get(field.name, field.name.upper()))
+            if value is None or value == "":
+                continue
+            if field.type is int:
+                value = int(value)
+            elif field.type is float:
+                value = float(value)
+            elif field.name == "openai_deployments":
+                value = parse_deployments(value, environ)
+            values[field.name] = value
+        return cls(**values)
+
+    @property
+    def search_base_url(self):
+        return (
+            self.search_endpoint or f"https://{self.search_service}.search.windows.net"
+        )
+
+    @property
+    def cognito_issuer(self):
+        return f"https://cognito-idp.{self.cognito_region}.amazonaws.com/{self.cognito_user_pool_id}"
+
+    @property
+    def cognito_jwks_url(self):
+        return f"{self.cognito_issuer}/.well-known/jwks.json"
+
+
+def get_config():
+    from django.conf import settings
+
+    return settings.APP_CONFIG
@@ -14,15 +14,10 @@ import datetime
 import os
 from pathlib import Path
 
-# dotenvを使用するための設定を追加
-from dotenv import load_dotenv
+from .config import AppConfig, load_environment
 
-# 開発環境か本番環境かに応じてファイルを指定
-environment = os.getenv("ENV", "development")
-if environment == "production":
-    load_dotenv(".env.production")
-else:
-    load_dotenv(".env.development")
+# 開発環境か本番環境かに応じて.envファイルを読み込む（読み込みはここで一度だけ行う）
+load_environment()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -82,6 +77,8 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    # 他のミドルウェアを含めて計測するので先頭に置く
+    "rag_sample_app.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -127,6 +124,56 @@ DATABASES = {
     }
 }
 
+# スレッドとチャット履歴をユーザーごとに分けて置くデータベース（defaultも１つのシャードとして使う）。
+# DB_SHARDSは "エイリアス=ホスト" のカンマ区切りで、DB名・ユーザー・パスワードはdefaultと同じ。
+# シャードを追加したら migrate --database <エイリアス> と rebalance_shards を実行する。
+# チャット履歴のIDはシャード間で移動しても変えないので、MySQLのauto_increment_increment と
+# auto_increment_offset をシャードごとに設定してIDが重ならないようにしておくこと
+# （defaultの既存の行は1から連番なので、追加するシャードのAUTO_INCREMENTはdefaultの最大値より大きくする）。
+# IDが重なった場合、rebalance_shardsはそのユーザーの移動を取り消して停止する
+DATABASE_SHARDS = ["default"]
+for item in os.getenv("DB_SHARDS", "").split(","):
+    if not item.strip():
+        continue
+    alias, host = (part.strip() for part in item.split("="))
+    DATABASES[alias] = {**DATABASES["default"], "HOST": host}
+    DATABASE_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ["rag_sample_app.sharding.ShardRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# 回数制限の状態はワーカー間で共有できるキャッシュ（Redis・Memcachedなど）に置く。
+# 既定のLocMemCacheはプロセスごとなので、本番では check --deploy が警告する
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "ratelimit": {
+        "BACKEND": os.getenv(
+            "RATELIMIT_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("RATELIMIT_CACHE_LOCATION", "ratelimit"),
+    },
+    "retrieval": {
+        "BACKEND": os.getenv(
+            "RETRIEVAL_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("RETRIEVAL_CACHE_LOCATION", "retrieval"),
+    },
+    "prefetch": {
+        "BACKEND": os.getenv(
+            "PREFETCH_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("PREFETCH_CACHE_LOCATION", "prefetch"),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -171,3 +218,6 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # CORSの設定を追加
 CORS_ALLOWED_ORIGINS = [os.environ["CORS_DOMAIN"]]
+
+# アプリケーションの設定（環境変数から一度だけ作成する）
+APP_CONFIG = AppConfig.from_env()